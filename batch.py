@@ -0,0 +1,316 @@
+import argparse
+import fnmatch
+import glob
+import os
+import signal
+import sys
+import time
+import traceback
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import export
+import graph_gen
+import profiler
+import render
+from cache import SourceCache, UnitCache
+
+try:
+    import resource
+except ImportError:
+    # Windows 下没有resource模块，内存上限不生效
+    resource = None
+
+
+class FileTimeout(Exception):
+    pass
+
+
+def collect_files(paths, pattern='*.c'):
+    """
+    展开目录和通配符，递归收集c文件，按文件大小从大到小排序（大文件优先调度）
+
+    :param paths: [str] 目录、文件或通配符
+    :param pattern: 目录下匹配的文件名模式
+    :return: [str] 文件路径
+    """
+    files = []
+    for each in paths:
+        matches = glob.glob(each, recursive=True) if glob.has_magic(each) else [each]
+        for match in matches:
+            if os.path.isdir(match):
+                for root, _, names in os.walk(match):
+                    for name in fnmatch.filter(names, pattern):
+                        files.append(os.path.join(root, name))
+            elif os.path.isfile(match):
+                files.append(match)
+    # 去重并保持稳定顺序
+    files = list(dict.fromkeys(os.path.normpath(f) for f in files))
+    files.sort(key=lambda f: os.path.getsize(f), reverse=True)
+    return files
+
+
+def output_name(path):
+    """
+    由文件路径生成输出名称，子目录用'_'连接，避免不同目录的同名文件互相覆盖
+    """
+    name = os.path.splitext(os.path.normpath(path))[0]
+    name = name.replace(os.sep, '_').replace(':', '').lstrip('._')
+    return name if name != '' else 'graph'
+
+
+_cache = None
+_unit_cache = None
+_split_render = False
+_prelude = False
+_no_render = False
+
+
+def _on_timeout(signum, frame):
+    raise FileTimeout()
+
+
+def _init_worker(memory_limit, cache_dir=None, cache_size=None, profile=False, split_render=False, prelude=False,
+                 no_render=False):
+    """
+    进程池初始化：设置每个进程的内存上限（MB），打开源码缓存和方法缓存（同一目录，后缀不同），
+    profile为True时在子进程中记录各阶段耗时，split_render为True时每个方法单独绘制，
+    prelude为True时使用fake libc头文件的快照，no_render为True时只写DOT文件不布局
+    """
+    global _cache, _unit_cache, _split_render, _prelude, _no_render
+    _split_render = split_render
+    _prelude = prelude
+    _no_render = no_render
+    if profile:
+        profiler.enable()
+    if cache_dir:
+        _cache = SourceCache(cache_dir, cache_size * 1024 * 1024) if cache_size else SourceCache(cache_dir)
+        _unit_cache = UnitCache(cache_dir, _cache.max_bytes)
+    if memory_limit and resource is not None:
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _on_timeout)
+
+
+def _render_status(results):
+    """
+    由render.render_graph的逐单元结果得到文件的状态：有布局出错为'error'，有布局超时为'timeout'，
+    所有单元都没有布局（超过skip_limit）为'skipped'，否则为'ok'
+
+    :return: (状态, 信息) 信息中列出没有成功布局的单元
+    """
+    statuses = set(each[4] for each in results)
+    if 'error' in statuses:
+        status = 'error'
+    elif 'timeout' in statuses:
+        status = 'timeout'
+    elif len(results) > 0 and statuses == {'skipped'}:
+        status = 'skipped'
+    else:
+        status = 'ok'
+    message = '\n'.join('%s %s: %s' % (each[4], each[0], each[5]) for each in results if each[4] != 'ok')
+    return status, message
+
+
+def _run_one(path, timeout, render_timeout=None):
+    """
+    在子进程中分析单个文件
+    timeout限制分析（及不拆分时的绘制）；拆分绘制时在布局前取消，每个布局改由render_timeout单独限制，
+    超时的布局只保留DOT文件
+
+    :param render_timeout: 拆分绘制时单个布局的超时时间（秒），None时使用timeout
+    :return: ((path, 状态 'ok'/'timeout'/'memory'/'error'/'skipped', 耗时, 错误信息), [profiler事件])
+    """
+    start = time.time()
+    use_alarm = timeout and hasattr(signal, 'setitimer')
+    status = 'ok'
+    message = ''
+    with profiler.span('file', file=path) as args:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            # 批量模式下不打印dupath，不打开查看器
+            graph = graph_gen.analyze(path, output_name(path), cache=_cache, unit_cache=_unit_cache,
+                                      prelude=_prelude)
+            if _no_render:
+                # 不调用graphviz，没有安装dot时也可以只做分析
+                with profiler.span('write_dot', graph=graph.name):
+                    with open(os.path.join('tmp', graph.name + '.gv'), 'w', encoding='utf-8') as f:
+                        export.write_dot(graph, f)
+            elif _split_render:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+                # 每个进程已经处理一个文件，布局不再并行；超时的方法只保留DOT文件
+                status, message = _render_status(render.render_graph(
+                    graph, workers=1, timeout=render_timeout if render_timeout is not None else timeout))
+            else:
+                graph.render()
+        except FileTimeout:
+            status = 'timeout'
+            message = 'exceeded %ss' % timeout
+        except MemoryError:
+            status = 'memory'
+            message = 'memory limit exceeded'
+        except Exception:
+            status = 'error'
+            message = traceback.format_exc(limit=-2)
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        args['status'] = status
+    # 事件随结果返回主进程合并
+    return (path, status, time.time() - start, message), profiler.take_events()
+
+
+def _isolated(path, timeout, render_timeout, initargs, finish):
+    """
+    在单独的进程中重新运行一个文件，进程再次退出时记为'crashed'
+
+    :return: 'crashed'的结果，正常完成时由finish记录结果并返回None
+    """
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs) as executor:
+        future = executor.submit(_run_one, path, timeout, render_timeout)
+        wait([future])
+        if not isinstance(future.exception(), BrokenProcessPool):
+            finish(future)
+            return None
+    return path, 'crashed', time.time() - start, 'worker process died'
+
+
+def run_batch(paths, workers=None, timeout=None, memory_limit=None, pattern='*.c',
+              cache_dir=None, cache_size=None, profile=False, split_render=False, prelude=False,
+              render_timeout=None, no_render=False):
+    """
+    并行分析多个文件，单个文件失败不影响其他文件
+
+    :param paths: [str] 目录、文件或通配符
+    :param workers: 进程数，默认CPU核数
+    :param timeout: 单个文件超时时间（秒）
+    :param memory_limit: 单个进程内存上限（MB）
+    :param pattern: 目录下匹配的文件名模式
+    :param cache_dir: 预处理、ast和方法建图结果的缓存目录，None表示不使用缓存
+    :param cache_size: 缓存大小上限（MB）
+    :param profile: 为True时收集所有子进程的阶段事件，合并到当前进程的profiler（需先profiler.enable()）
+    :param split_render: 每个方法单独绘制到 tmp/文件名.units/，大图合并直线链或跳过布局，见render.render_graph
+    :param prelude: 使用fake libc头文件的宏定义和typedef快照，见prelude.load
+    :param render_timeout: split_render时单个布局的超时时间（秒），None时使用timeout
+    :param no_render: 只分析并把DOT写到 tmp/文件名.gv，不调用graphviz布局，优先于split_render
+    :return: [(path, status, seconds, message)]
+    """
+    files = collect_files(paths, pattern)
+    results = []
+    if len(files) == 0:
+        return results
+    os.makedirs('tmp', exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    initargs = (memory_limit, cache_dir, cache_size, profile, split_render, prelude, no_render)
+
+    def finish(future):
+        result, events = future.result()
+        results.append(result)
+        if profile and profiler.enabled():
+            profiler.current().merge(events)
+
+    # 同时提交的文件不超过进程数，进程池损坏时正在运行的文件是确定的
+    pending = deque(files)
+    running = {}
+    executor = None
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            if executor is None:
+                executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+            while len(pending) > 0 and len(running) < workers:
+                path = pending.popleft()
+                running[executor.submit(_run_one, path, timeout, render_timeout)] = path
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            if not any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                for future in done:
+                    finish(future)
+                    del running[future]
+                continue
+            # 一个进程退出使整个进程池损坏，正在运行的其他文件也会失败：
+            # 在新的单进程池中逐个重新运行，仍然失败的才是使进程退出的文件，未开始的文件交给新的进程池
+            wait(running)
+            suspects = []
+            for future, path in running.items():
+                if isinstance(future.exception(), BrokenProcessPool):
+                    suspects.append(path)
+                else:
+                    finish(future)
+            running = {}
+            executor.shutdown(wait=True)
+            executor = None
+            if len(suspects) == 1:
+                results.append((suspects[0], 'crashed', 0.0, 'worker process died'))
+                continue
+            for path in suspects:
+                crashed = _isolated(path, timeout, render_timeout, initargs, finish)
+                if crashed is not None:
+                    results.append(crashed)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True)
+    return results
+
+
+def summary(results, stream=sys.stdout):
+    """
+    打印汇总信息，返回退出码：0 全部成功，1 存在失败，2 没有输入文件
+    """
+    if len(results) == 0:
+        print('no input files', file=stream)
+        return 2
+    failed = [r for r in results if r[1] != 'ok']
+    for path, status, seconds, message in failed:
+        print('[%s] %s (%.2fs)' % (status, path, seconds), file=stream)
+        if message:
+            print('    ' + message.strip().replace('\n', '\n    '), file=stream)
+    # 各文件耗时之和（墙钟），并行时大于总耗时
+    total = sum(r[2] for r in results)
+    print('files: %d, ok: %d, failed: %d, file time: %.2fs'
+          % (len(results), len(results) - len(failed), len(failed), total), file=stream)
+    return 1 if len(failed) > 0 else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='batch generate CFG and du-path of c files')
+    parser.add_argument('paths', nargs='+', help='directories, files or glob patterns')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-t', '--timeout', type=float, default=None, help='per-file timeout in seconds')
+    parser.add_argument('-m', '--memory', type=int, default=None, help='per-process memory limit in MB')
+    parser.add_argument('--pattern', default='*.c', help='file name pattern used in directories')
+    parser.add_argument('--cache-dir', default=None, help='cache directory of preprocessed source and ast')
+    parser.add_argument('--cache-size', type=int, default=None, help='cache size limit in MB')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--split-render', action='store_true',
+                        help='render one graph per function with bounded layout size')
+    output.add_argument('--no-render', action='store_true',
+                        help='only analyze and write tmp/<name>.gv, without graphviz layout')
+    parser.add_argument('--render-timeout', type=float, default=None,
+                        help='timeout of each layout with --split-render, defaults to --timeout')
+    parser.add_argument('--libc-prelude', action='store_true',
+                        help='predeclare fake libc macros and typedefs (size_t, FILE, NULL, ...)')
+    parser.add_argument('--profile', default=None, metavar='PREFIX',
+                        help='write phase summary to PREFIX.json and chrome trace to PREFIX.trace.json')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    if args.profile:
+        profiler.enable()
+    with profiler.span('batch'):
+        results = run_batch(args.paths, args.workers, args.timeout, args.memory, args.pattern,
+                            args.cache_dir, args.cache_size, args.profile is not None, args.split_render,
+                            args.libc_prelude, args.render_timeout, args.no_render)
+    code = summary(results)
+    print('wall time: %.2fs' % (time.time() - start))
+    if args.profile:
+        summary_path, trace_path = profiler.disable().write(args.profile)
+        print('profile: %s, %s' % (summary_path, trace_path))
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
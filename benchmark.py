@@ -0,0 +1,586 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import graph_gen
+
+# 语句类型的默认权重
+DEFAULT_MIX = {'assign': 6, 'if': 3, 'while': 1, 'for': 1, 'do': 1, 'switch': 1}
+
+# 预设的测试规模，默认运行除large外的全部预设
+PRESETS = {
+    'small': dict(functions=10, statements=20, depth=3),
+    'medium': dict(functions=100, statements=50, depth=4),
+    'large': dict(functions=200, statements=200, depth=6),
+    'deep': dict(functions=1, statements=2000, depth=400, mix={'assign': 1, 'if': 4, 'while': 1}),
+    'switch': dict(functions=50, statements=60, depth=3, mix={'assign': 3, 'switch': 4}),
+    'expr': dict(functions=10, statements=20, depth=2, expr_depth=6),
+    # 大规模的线性检查：同类预设的规模相差一倍，耗时也应约为一倍
+    'flat-50k': dict(functions=1, statements=50000, depth=0, mix={'assign': 1}),
+    'flat-100k': dict(functions=1, statements=100000, depth=0, mix={'assign': 1}),
+    'nest-5k': dict(functions=1, statements=11000, depth=5000, mix={'if': 1}, max_indent=8),
+    'nest-10k': dict(functions=1, statements=22000, depth=10000, mix={'if': 1}, max_indent=8),
+}
+DEFAULT_PRESETS = ['small', 'medium', 'deep', 'switch', 'expr']
+# --scaling 运行的预设对 (较小规模, 两倍规模)
+SCALING_PAIRS = [('flat-50k', 'flat-100k'), ('nest-5k', 'nest-10k')]
+
+PHASES = ['strip', 'preprocess', 'parse', 'build', 'du', 'dataflow', 'render']
+
+BINARY_OPS = ['+', '-', '*', '<', '>', '==', '&&', '||']
+
+
+class Generator:
+    def __init__(self, functions=10, statements=20, depth=3, mix=None, variables=5, expr_depth=2, seed=0,
+                 max_indent=None):
+        """
+        生成可被graph_gen分析的C代码
+
+        :param functions: 方法个数
+        :param statements: 每个方法的语句数（包括嵌套在内部的语句）
+        :param depth: 最大嵌套深度
+        :param mix: {语句类型: 权重} 类型为 assign/if/while/for/do/switch
+        :param variables: 每个方法的局部变量个数
+        :param expr_depth: 表达式树的深度
+        :param seed: 随机种子，相同参数和种子生成相同的代码
+        :param max_indent: 缩进的最大层数，None为不限制；嵌套上万层时限制缩进，否则代码大小按深度的平方增长
+        """
+        self.functions = functions
+        self.statements = statements
+        self.depth = depth
+        self.mix = dict(mix if mix is not None else DEFAULT_MIX)
+        self.variables = max(1, variables)
+        self.expr_depth = expr_depth
+        self.seed = seed
+        self.max_indent = max_indent
+        self.rng = random.Random(seed)
+        self.kinds = list(self.mix.keys())
+        self.weights = [self.mix[k] for k in self.kinds]
+
+    def params(self):
+        params = {'functions': self.functions, 'statements': self.statements, 'depth': self.depth,
+                  'mix': self.mix, 'variables': self.variables, 'expr_depth': self.expr_depth, 'seed': self.seed}
+        if self.max_indent is not None:
+            params['max_indent'] = self.max_indent
+        return params
+
+    def var(self):
+        return 'v%d' % self.rng.randrange(self.variables)
+
+    def expr(self, depth=None):
+        depth = self.expr_depth if depth is None else depth
+        if depth <= 0:
+            return self.var() if self.rng.random() < 0.7 else str(self.rng.randrange(10))
+        return '(%s %s %s)' % (self.expr(depth - 1), self.rng.choice(BINARY_OPS), self.expr(depth - 1))
+
+    def source(self):
+        """
+        :return: str 完整的C代码
+        """
+        out = []
+        for i in range(self.functions):
+            out.append(self.function(i))
+        return '\n'.join(out)
+
+    def function(self, index):
+        lines = ['int f%d(int a, int b)' % index, '{']
+        lines.append('    int %s;' % ', '.join('v%d = %d' % (k, k) for k in range(self.variables)))
+        self.block(lines, 1, self.statements, 0)
+        lines.append('    return v0;')
+        lines.append('}')
+        return '\n'.join(lines)
+
+    def block(self, lines, level, budget, in_loop):
+        """
+        生成budget条语句追加到lines，返回实际生成的语句数
+        嵌套结构用显式栈生成，深度较大时不受递归深度限制
+
+        :param lines: [str] 输出的代码行
+        :param level: 缩进层数
+        :param budget: 语句数
+        :param in_loop: 0 不在循环内，1 在循环内（可以生成break），2 直接位于循环体中（还可以生成continue，
+                        graph_gen不支持if/switch内的continue）
+        """
+        # 栈中每项: [缩进层数, 剩余语句数, 是否在循环内, 块结束时追加的行]
+        stack = [[level, budget, in_loop, None]]
+        count = 0
+        while len(stack) > 0:
+            frame = stack[-1]
+            level, remaining, in_loop, closing = frame
+            if remaining <= 0:
+                stack.pop()
+                if closing is not None:
+                    lines.extend(closing)
+                continue
+            indent = '    ' * (level if self.max_indent is None else min(level, self.max_indent))
+            kind = self.rng.choices(self.kinds, self.weights)[0]
+            if level > self.depth or remaining == 1 or kind == 'assign':
+                frame[1] -= 1
+                count += 1
+                if in_loop and self.rng.random() < 0.05:
+                    lines.append(indent + ('continue;' if in_loop == 2 and self.rng.random() < 0.5 else 'break;'))
+                else:
+                    lines.append(indent + '%s = %s;' % (self.var(), self.expr()))
+                continue
+            # 复合语句本身占一条，大部分剩余语句分给内部，使嵌套能达到depth层
+            inner = remaining - 1 - self.rng.randint(0, (remaining - 1) // max(2, self.depth - level + 1))
+            frame[1] -= inner + 1
+            count += 1
+            if kind == 'if':
+                lines.append(indent + 'if (%s) {' % self.expr())
+                if inner > 1 and self.rng.random() < 0.5:
+                    then = inner - self.rng.randint(1, max(1, inner // max(2, self.depth - level + 1)))
+                    stack.append([level + 1, inner - then, min(in_loop, 1), [indent + '}']])
+                    stack.append([level + 1, then, min(in_loop, 1), [indent + '} else {']])
+                else:
+                    stack.append([level + 1, inner, min(in_loop, 1), [indent + '}']])
+            elif kind == 'while':
+                lines.append(indent + 'while (%s) {' % self.expr())
+                stack.append([level + 1, inner, 2, [indent + '}']])
+            elif kind == 'for':
+                v = self.var()
+                lines.append(indent + 'for (%s = 0; %s < %s; %s++) {' % (v, v, self.var(), v))
+                stack.append([level + 1, inner, 2, [indent + '}']])
+            elif kind == 'do':
+                lines.append(indent + 'do {')
+                stack.append([level + 1, inner, 2, [indent + '} while (%s);' % self.expr()]])
+            elif kind == 'switch':
+                lines.append(indent + 'switch (%s %% 4) {' % self.var())
+                cases = min(inner, 4)
+                share = [inner // cases + (1 if k < inner % cases else 0) for k in range(cases)]
+                # 栈后进先出，倒序压入
+                for k in reversed(range(cases)):
+                    closing = [indent + '    break;'] + ([indent + '}'] if k == cases - 1 else [])
+                    label = 'default:' if k == 3 else 'case %d:' % k
+                    stack.append([level + 2, share[k], min(in_loop, 1), closing])
+                    stack.append([level + 2, 0, 0, [indent + '    ' + label]])
+            else:
+                raise ValueError('unknown statement kind: %s' % kind)
+        return count
+
+
+def render_source(graph):
+    """
+    与Graph.render相同地建立Digraph，只生成DOT文本，不调用dot布局
+    """
+    from graphviz import Digraph
+    graph.dot = Digraph(name=graph.name)
+    for each in graph.g:
+        graph.travel_graph(each)
+    return graph.dot.source
+
+
+def layout(source, engine='dot'):
+    proc = subprocess.run([engine, '-Tsvg'], input=source, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, encoding='utf-8')
+    if proc.returncode != 0:
+        raise RuntimeError('%s failed: %s' % (engine, proc.stderr.strip()))
+
+
+def run_phases(source, name, with_layout=False, trace_memory=False):
+    """
+    依次执行build_graph的各个阶段
+
+    :param source: C代码 str
+    :param name: 图名称
+    :param with_layout: 是否调用dot布局
+    :param trace_memory: 是否用tracemalloc记录每个阶段的峰值内存（会明显变慢，不与计时同时进行）
+    :return: ({阶段: 秒}, {阶段: 峰值字节}, Graph)
+    """
+    seconds = {}
+    peaks = {}
+    state = {}
+    steps = [
+        ('strip', lambda: graph_gen.strip_source(source.encode('utf-8'))),
+        ('preprocess', lambda: graph_gen.preprocess(state['strip'], name + '.c')),
+        ('parse', lambda: graph_gen.parse(state['preprocess'], name + '.c')),
+        ('build', lambda: graph_gen.Graph(state['parse'], name)),
+        ('du', lambda: print_dupath(state['build'])),
+        ('dataflow', lambda: state['build'].dataflow()),
+        ('render', lambda: render_source(state['build'])),
+    ]
+    if with_layout:
+        steps.append(('layout', lambda: layout(state['render'])))
+    for phase, step in steps:
+        if trace_memory:
+            tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        state[phase] = step()
+        seconds[phase] = time.perf_counter() - start
+        if trace_memory:
+            peaks[phase] = tracemalloc.get_traced_memory()[1] - base
+            tracemalloc.stop()
+    return seconds, peaks, state['build']
+
+
+def print_dupath(graph):
+    """
+    与build_graph相同地输出dupath，输出写入内存而不是终端
+    """
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        graph.travel_dupath()
+    return buffer.getvalue()
+
+
+def run_case(name, generator, repeat=3, with_layout=False):
+    """
+    :return: {'params', 'lines', 'nodes', 'phases': {阶段: {'min', 'median', 'peak_kb'}}}
+    """
+    source = generator.source()
+    runs = []
+    graph = None
+    for _ in range(repeat):
+        gc.collect()
+        seconds, _, graph = run_phases(source, name, with_layout)
+        runs.append(seconds)
+    gc.collect()
+    _, peaks, _ = run_phases(source, name, with_layout, trace_memory=True)
+    phases = {}
+    for phase in runs[0]:
+        values = [run[phase] for run in runs]
+        phases[phase] = {'min': round(min(values), 6), 'median': round(statistics.median(values), 6),
+                         'peak_kb': peaks[phase] // 1024}
+    total = [sum(run.values()) for run in runs]
+    return {'params': generator.params(), 'lines': source.count('\n') + 1, 'nodes': graph.node_num,
+            'total': round(min(total), 6), 'phases': phases}
+
+
+# 在新的解释器中运行，分别记录导入、建立CParser和分析一个小文件的时间
+COLD_START = '''
+import json, sys, time
+start = time.perf_counter()
+import graph_gen
+imported = time.perf_counter()
+graph_gen.get_parser()
+ready = time.perf_counter()
+graph_gen.analyze(sys.argv[1], 'cold')
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'parser': ready - imported, 'analyze': done - ready}))
+'''
+
+
+def cold_start(repeat=3):
+    """
+    测量一次性调用的启动时间：tables_cold 为表缓存目录为空（需要生成lex/yacc表），
+    tables_warm 为表已缓存，每项取repeat次中总时间最短的一次
+
+    :return: {情况: {'total' 进程总时间, 'import', 'parser', 'analyze'}}
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'small.c')
+        with open(path, 'w') as f:
+            f.write(Generator(**PRESETS['small']).source())
+        env = dict(os.environ, CFG_PARSER_TABLES=os.path.join(tmp, 'tables'))
+        for case, runs in (('tables_cold', 1), ('tables_warm', repeat)):
+            best = None
+            for _ in range(runs):
+                start = time.perf_counter()
+                proc = subprocess.run([sys.executable, '-c', COLD_START, path], stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE, encoding='utf-8', env=env,
+                                      cwd=os.path.dirname(os.path.abspath(__file__)))
+                total = time.perf_counter() - start
+                if proc.returncode != 0:
+                    raise RuntimeError('cold start failed: %s' % proc.stderr.strip())
+                if best is None or total < best['total']:
+                    best = dict(json.loads(proc.stdout), total=total)
+            results[case] = {key: round(value, 6) for key, value in best.items()}
+    return results
+
+
+def scaling(repeat=3):
+    """
+    检查建图的耗时是否随规模线性增长：SCALING_PAIRS 中每对预设的规模相差一倍，
+    分别在开启和关闭垃圾回收时计时（深层嵌套时大量存活对象使分代回收的开销随规模增长，与建图本身无关）
+
+    :return: [(较小预设, 较大预设, {'gc': (秒, 秒, 倍数), 'no_gc': (秒, 秒, 倍数)})]
+    """
+    rows = []
+    for pair in SCALING_PAIRS:
+        seconds = {'gc': [], 'no_gc': []}
+        for name in pair:
+            source = Generator(**PRESETS[name]).source()
+            path = name + '.c'
+            ast = graph_gen.parse(graph_gen.preprocess(graph_gen.strip_source(source.encode('utf-8')), path), path)
+            for mode in ('gc', 'no_gc'):
+                best = None
+                for _ in range(repeat):
+                    gc.collect()
+                    if mode == 'no_gc':
+                        gc.disable()
+                    try:
+                        start = time.perf_counter()
+                        graph_gen.Graph(ast, name)
+                        elapsed = time.perf_counter() - start
+                    finally:
+                        gc.enable()
+                    best = elapsed if best is None else min(best, elapsed)
+                seconds[mode].append(best)
+        rows.append(pair + ({mode: (small, large, large / small if small > 0 else float('inf'))
+                             for mode, (small, large) in seconds.items()},))
+    return rows
+
+
+def load_revision(rev, module_name='baseline_graph_gen'):
+    """
+    从git中取出某个版本的graph_gen.py，作为单独的模块导入（与当前的graph_gen互不影响）
+
+    :param rev: git版本，如 bfc36ad^
+    :return: module
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(['git', 'show', '%s:graph_gen.py' % rev], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          encoding='utf-8', cwd=here)
+    if proc.returncode != 0:
+        raise RuntimeError('git show %s failed: %s' % (rev, proc.stderr.strip()))
+    module = types.ModuleType(module_name)
+    # fake_libc_include等路径相对于模块文件
+    module.__file__ = os.path.join(here, 'graph_gen.py')
+    exec(compile(proc.stdout, '%s:graph_gen.py' % rev, 'exec'), module.__dict__)
+    return module
+
+
+def snapshot(module, ast, name):
+    """
+    用module中的Graph建图，记录每个节点的 (id, 代码, 连接, d, u, 开始, 终止, 孩子数)、du_path和travel_dupath的输出
+
+    :return: 可以直接比较的tuple
+    """
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        graph = module.Graph(ast, name)
+        graph.travel_dupath()
+    trees = []
+    for root in graph.g:
+        nodes = []
+        stack = [root]
+        while len(stack) > 0:
+            node = stack.pop()
+            nodes.append((node.id, node.code, node.connectTo, node.d, node.u, node.isStart, node.isEnd,
+                          len(node.child)))
+            stack.extend(reversed(node.child))
+        trees.append(nodes)
+    return trees, json.dumps(graph.du_path), buffer.getvalue()
+
+
+def random_generator(seed):
+    """
+    :return: 参数也由seed随机决定的Generator，用于等价性检查
+    """
+    rng = random.Random(seed)
+    mix = {kind: rng.randint(0, 4) for kind in DEFAULT_MIX}
+    mix['assign'] = max(1, mix['assign'])
+    return Generator(functions=rng.randint(1, 4), statements=rng.randint(1, 60), depth=rng.randint(1, 6), mix=mix,
+                     variables=rng.randint(1, 6), expr_depth=rng.randint(0, 3), seed=seed)
+
+
+def equivalence(baseline, programs=900):
+    """
+    在生成的随机程序上比较当前的graph_gen与基准版本的建图结果（节点、边、d/u、du_path和dupath输出）
+    同一个AST分别交给两个版本建图，随机程序的嵌套不深，旧的递归实现也可以处理
+
+    :param baseline: load_revision得到的基准模块
+    :param programs: 程序个数，第i个程序的种子为i
+    :return: [不一致的种子]
+    """
+    mismatches = []
+    for seed in range(programs):
+        path = 'equivalence_%d.c' % seed
+        source = random_generator(seed).source()
+        ast = graph_gen.parse(graph_gen.preprocess(graph_gen.strip_source(source.encode('utf-8')), path), path)
+        if snapshot(graph_gen, ast, path) != snapshot(baseline, ast, path):
+            mismatches.append(seed)
+    return mismatches
+
+
+def metadata():
+    commit = None
+    try:
+        proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, encoding='utf-8',
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode == 0:
+            commit = proc.stdout.strip()
+    except OSError:
+        pass
+    try:
+        import pycparser
+        pycparser_version = pycparser.__version__
+    except (ImportError, AttributeError):
+        pycparser_version = None
+    return {'commit': commit, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+            'pycparser': pycparser_version, 'platform': platform.platform()}
+
+
+def compare(old, new, threshold=0.15, min_seconds=0.01):
+    """
+    比较两次结果的每个阶段最短时间
+
+    :param old: 基准结果 dict
+    :param new: 本次结果 dict
+    :param threshold: 变慢超过该比例视为回归
+    :param min_seconds: 差值小于该秒数时忽略（计时噪声）
+    :return: ([str] 报告行, 回归数)
+    """
+    lines = []
+    regressions = 0
+    for case, result in new.get('cold_start', {}).items():
+        base = old.get('cold_start', {}).get(case)
+        if base is None:
+            continue
+        ratio = result['total'] / base['total'] if base['total'] > 0 else float('inf')
+        mark = ''
+        if result['total'] - base['total'] > min_seconds and ratio > 1 + threshold:
+            mark = '  REGRESSION'
+            regressions += 1
+        lines.append('%-10s %-10s %9.4fs -> %9.4fs  x%.2f%s' % ('startup', case, base['total'], result['total'],
+                                                               ratio, mark))
+    for case, result in new['cases'].items():
+        base = old['cases'].get(case)
+        if base is None:
+            lines.append('%-10s (not in baseline)' % case)
+            continue
+        if base['params'] != result['params']:
+            lines.append('%-10s (parameters changed, skipped)' % case)
+            continue
+        for phase, value in result['phases'].items():
+            if phase not in base['phases']:
+                continue
+            before = base['phases'][phase]['min']
+            after = value['min']
+            ratio = after / before if before > 0 else float('inf')
+            mark = ''
+            if after - before > min_seconds and ratio > 1 + threshold:
+                mark = '  REGRESSION'
+                regressions += 1
+            lines.append('%-10s %-10s %9.4fs -> %9.4fs  x%.2f%s' % (case, phase, before, after, ratio, mark))
+    return lines, regressions
+
+
+def parse_mix(text):
+    """
+    :param text: 'if=3,switch=1,...'
+    :return: {语句类型: 权重}
+    """
+    mix = {}
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError('unknown statement kind: %s' % kind)
+        mix[kind] = float(weight) if weight else 1.0
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark each phase of build_graph on generated c code')
+    parser.add_argument('--preset', default=None,
+                        help='comma separated presets (%s), default %s'
+                             % (','.join(PRESETS), ','.join(DEFAULT_PRESETS)))
+    parser.add_argument('--functions', type=int, default=None, help='run a custom case with this many functions')
+    parser.add_argument('--statements', type=int, default=20, help='statements per function of the custom case')
+    parser.add_argument('--depth', type=int, default=3, help='max nesting depth of the custom case')
+    parser.add_argument('--mix', type=parse_mix, default=None, help='statement weights, e.g. if=3,switch=1')
+    parser.add_argument('--variables', type=int, default=5, help='local variables per function')
+    parser.add_argument('--expr-depth', type=int, default=2, help='depth of generated expressions')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='timing runs per case')
+    parser.add_argument('--layout', action='store_true', help='also time dot layout (needs graphviz dot)')
+    parser.add_argument('-o', '--output', default=None, help='write results to this json file')
+    parser.add_argument('--compare', default=None, help='baseline json file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.15, help='slowdown ratio reported as regression')
+    parser.add_argument('--emit', default=None, help='only write the generated c code of the custom case')
+    parser.add_argument('--no-cold-start', action='store_true', help='skip timing startup in a fresh interpreter')
+    parser.add_argument('--scaling', action='store_true',
+                        help='only compare build time of presets that double in size (%s)'
+                             % ', '.join('%s/%s' % pair for pair in SCALING_PAIRS))
+    parser.add_argument('--equivalence', default=None, metavar='REV',
+                        help='only check that graphs equal those of graph_gen.py at git revision REV')
+    parser.add_argument('--programs', type=int, default=900, help='random programs of --equivalence')
+    args = parser.parse_args(argv)
+
+    if args.equivalence:
+        graph_gen.get_parser()
+        try:
+            baseline = load_revision(args.equivalence)
+        except RuntimeError as e:
+            parser.error(str(e))
+        mismatches = equivalence(baseline, args.programs)
+        print('%d programs, %d differ from %s%s' % (args.programs, len(mismatches), args.equivalence,
+                                                   ': seeds ' + ', '.join(map(str, mismatches)) if mismatches else ''))
+        return 1 if len(mismatches) > 0 else 0
+    if args.scaling:
+        graph_gen.get_parser()
+        for small, large, modes in scaling(args.repeat):
+            print('%-10s -> %-10s' % (small, large))
+            for mode, (before, after, ratio) in modes.items():
+                print('    build %-6s %9.4fs -> %9.4fs  x%.2f' % (mode, before, after, ratio))
+        return 0
+
+    if args.layout and shutil.which('dot') is None:
+        parser.error('--layout needs the graphviz dot program in PATH')
+
+    cases = {}
+    if args.functions is not None or args.emit:
+        cases['custom'] = Generator(args.functions if args.functions is not None else 10, args.statements,
+                                    args.depth, args.mix, args.variables, args.expr_depth, args.seed)
+    if args.emit:
+        with open(args.emit, 'w') as f:
+            f.write(cases['custom'].source())
+        return 0
+    if args.preset is not None or len(cases) == 0:
+        names = args.preset.split(',') if args.preset else DEFAULT_PRESETS
+        for name in names:
+            if name not in PRESETS:
+                parser.error('unknown preset: %s' % name)
+            params = dict(PRESETS[name])
+            params.setdefault('seed', args.seed)
+            cases[name] = Generator(**params)
+
+    result = {'meta': metadata(), 'cases': {}}
+    if not args.no_cold_start:
+        result['cold_start'] = cold_start(args.repeat)
+        for case, value in result['cold_start'].items():
+            print('%-12s total %.3fs  import %.3fs  parser %.3fs  analyze %.3fs'
+                  % (case, value['total'], value['import'], value['parser'], value['analyze']))
+    # 第一次解析时才生成语法表，提前建立parser，不计入parse阶段
+    graph_gen.get_parser()
+    for name, generator in cases.items():
+        case = run_case(name, generator, args.repeat, args.layout)
+        result['cases'][name] = case
+        print('%-10s lines %6d  nodes %6d  total %.3fs' % (name, case['lines'], case['nodes'], case['total']))
+        for phase, value in case['phases'].items():
+            print('    %-10s %9.4fs  peak %8d KB' % (phase, value['min'], value['peak_kb']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(baseline, result, args.threshold)
+        print()
+        print('compared with %s (%s)' % (args.compare, baseline['meta'].get('commit')))
+        for line in lines:
+            print(line)
+        return 1 if regressions > 0 else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
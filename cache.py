@@ -0,0 +1,266 @@
+import contextlib
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def dumps(obj):
+    """
+    序列化对象，深层嵌套的对象需要较大的递归深度，仍然超出时返回None（不缓存）
+    """
+    limit = sys.getrecursionlimit()
+    try:
+        sys.setrecursionlimit(max(limit, 10000))
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    except RecursionError:
+        return None
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+class DiskCache:
+    # 正在写入的临时文件和目录的元数据文件以此开头，不计入缓存条目
+    PRIVATE_PREFIX = '.'
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        """
+        磁盘缓存，按key保存文件，超过容量时按最近使用时间(LRU)淘汰
+        读取时更新文件的修改时间，淘汰时删除修改时间最早的文件
+        多个进程可以同时使用同一目录：总大小记在目录下的.size文件中，在.lock文件锁内更新，
+        没有fcntl的平台上每次写入后重新统计目录
+
+        :param directory: 缓存目录
+        :param max_bytes: 缓存总大小上限
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.size_path = os.path.join(directory, '.size')
+        self.lock_path = os.path.join(directory, '.lock')
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, key[:2], key + suffix)
+
+    def _entries(self):
+        """
+        :return: [(路径, 大小, 修改时间)] 不包括其他进程正在写入的临时文件
+        """
+        entries = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith(self.PRIVATE_PREFIX):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        在目录的文件锁内读写.size，没有fcntl时不加锁
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_size(self):
+        """
+        :return: 所有进程写入后的缓存总大小，.size不存在或损坏时重新统计
+        """
+        if fcntl is not None:
+            try:
+                with open(self.size_path) as f:
+                    return int(f.read())
+            except (OSError, ValueError):
+                pass
+        return sum(size for _, size, _ in self._entries())
+
+    def _write_size(self, size):
+        if fcntl is None:
+            return
+        try:
+            with open(self.size_path, 'w') as f:
+                f.write(str(size))
+        except OSError:
+            pass
+
+    @property
+    def size(self):
+        with self._locked():
+            return self._read_size()
+
+    def get(self, key, suffix):
+        path = self._path(key, suffix)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def contains(self, key, suffix):
+        return os.path.exists(self._path(key, suffix))
+
+    def put(self, key, suffix, data):
+        """
+        写入一个条目，写入失败（磁盘已满、临时文件被删除等）时放弃缓存，不抛出异常
+        """
+        path = self._path(key, suffix)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再替换，多个进程同时写入也不会读到不完整的文件
+            fd, tmp = tempfile.mkstemp(prefix=self.PRIVATE_PREFIX + 'tmp', dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            with self._locked():
+                size = self._read_size()
+                # 覆盖已有的文件时先减去原来的大小
+                try:
+                    size -= os.path.getsize(path)
+                except OSError:
+                    pass
+                os.replace(tmp, path)
+                tmp = None
+                size += len(data)
+                if size > self.max_bytes:
+                    size = self.evict()
+                self._write_size(size)
+        except OSError:
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """
+        淘汰最久未使用的文件，直到总大小不超过上限的90%，在文件锁内调用
+
+        :return: 淘汰后的总大小
+        """
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(e[1] for e in entries)
+        limit = self.max_bytes * 0.9
+        for path, size, _ in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+
+class SourceCache(DiskCache):
+    """
+    以源码内容、文件路径、头文件路径和cpp参数的hash为key，缓存预处理后的代码(.i)和pycparser的FileAST(.ast)
+    预处理时路径写入#line标记，成为AST中节点坐标的文件名，内容相同的不同文件不能共用缓存
+    """
+
+    def key(self, source, include_path, cpp_args, path=''):
+        """
+        :param source: 源文件内容 bytes
+        :param include_path: 头文件目录
+        :param cpp_args: [str] cpp参数
+        :param path: 文件路径（#line标记中的文件名）
+        :return: key str
+        """
+        h = hashlib.sha256()
+        h.update(source)
+        h.update(b'\0' + str(path).encode('utf-8'))
+        h.update(b'\0' + str(include_path).encode('utf-8'))
+        for each in cpp_args:
+            h.update(b'\0' + str(each).encode('utf-8'))
+        return h.hexdigest()
+
+    def get_preprocessed(self, key):
+        data = self.get(key, '.i')
+        return data.decode('utf-8') if data is not None else None
+
+    def put_preprocessed(self, key, text):
+        self.put(key, '.i', text.encode('utf-8'))
+
+    def get_ast(self, key):
+        data = self.get(key, '.ast')
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            # 缓存损坏或pycparser版本不同，当作未命中
+            return None
+
+    def put_ast(self, key, ast):
+        data = dumps(ast)
+        if data is not None:
+            self.put(key, '.ast', data)
+
+
+class UnitCache(DiskCache):
+    """
+    按结构指纹缓存Graph.build_unit的结果 (AstNode, dupath, 节点数, 单元起始行号)，节点id为单元内的局部id
+    """
+    # 建图逻辑改变时增加版本号，使旧的缓存失效
+    version = 5
+
+    def get_unit(self, key):
+        data = self.get(key, '.unit%d' % self.version)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return None
+
+    def has_unit(self, key):
+        return self.contains(key, '.unit%d' % self.version)
+
+    def put_unit(self, key, unit):
+        data = dumps(unit)
+        if data is not None:
+            self.put(key, '.unit%d' % self.version, data)
+
+
+class SummaryCache(DiskCache):
+    """
+    按方法体指纹和被调用方法的摘要key缓存callgraph.Summary，不同文件中相同的方法共用
+    """
+    # 摘要的计算方法改变时增加版本号
+    version = 2
+
+    def get_summary(self, key):
+        data = self.get(key, '.sum%d' % self.version)
+        if data is None:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return None
+
+    def put_summary(self, key, summary):
+        data = dumps(summary)
+        if data is not None:
+            self.put(key, '.sum%d' % self.version, data)
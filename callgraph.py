@@ -0,0 +1,557 @@
+import argparse
+import hashlib
+import sys
+import time
+
+import graph_gen
+from batch import collect_files
+from cache import SummaryCache
+from dataflow import DataFlow, strongly_connected
+from flatcfg import FlatCFG
+from graph_gen import walk
+
+# 不是表达式、其中也没有变量使用的节点，遍历时跳过
+_TYPE_NODES = frozenset(('Typename', 'Typedef', 'TypeDecl', 'PtrDecl', 'ArrayDecl', 'FuncDecl',
+                         'Struct', 'Union', 'Enum', 'IdentifierType'))
+
+def _target(expr):
+    """
+    赋值目标对应的变量，a[i]、*p、p->f 视为通过指针间接赋值，与建图时d的记法相同（都记为基变量）
+
+    :param expr: pycparser 表达式节点
+    :return: (变量名, 是否间接) 或 None
+    """
+    indirect = False
+    while True:
+        kind = expr.__class__.__name__
+        if kind == 'ID':
+            return expr.name, indirect
+        if kind == 'ArrayRef':
+            expr = expr.name
+            indirect = True
+        elif kind == 'UnaryOp' and expr.op == '*':
+            expr = expr.expr
+            indirect = True
+        elif kind == 'StructRef':
+            indirect = indirect or expr.type == '->'
+            expr = expr.name
+        elif kind == 'Cast':
+            expr = expr.expr
+        elif kind == 'BinaryOp' and expr.op in ('+', '-'):
+            # *(p + 1) = ...
+            expr = expr.left
+        else:
+            return None
+
+
+def _lvalue_reads(expr):
+    """
+    :return: [pycparser节点] 赋值目标中除基变量以外被读取的部分（下标等）
+    """
+    reads = []
+    while True:
+        kind = expr.__class__.__name__
+        if kind == 'ArrayRef':
+            reads.append(expr.subscript)
+            expr = expr.name
+        elif kind == 'UnaryOp' or kind == 'Cast':
+            expr = expr.expr
+        elif kind == 'StructRef':
+            expr = expr.name
+        elif kind == 'BinaryOp':
+            reads.append(expr.right)
+            expr = expr.left
+        else:
+            return reads
+
+
+def _argument(expr):
+    """
+    被调用方法通过该实参（指针）赋值时，调用方被赋值的变量：&x 为x本身，p、a、p + 1 为通过p间接赋值
+
+    :return: (变量名, 是否间接) 或 None
+    """
+    if expr.__class__.__name__ == 'UnaryOp' and expr.op == '&':
+        return _target(expr.expr)
+    target = _target(expr)
+    return (target[0], True) if target is not None else None
+
+
+class Facts:
+    __slots__ = ('name', 'params', 'locals', 'reads', 'direct', 'indirect', 'calls', 'aliases')
+
+    def __init__(self, funcdef):
+        """
+        一个方法体内直接可见的读写和调用，不考虑被调用方法
+
+        params: [str] 形参名
+        locals: set 方法内声明的变量（不区分块作用域）
+        reads: set 读取的变量
+        direct / indirect: set 直接赋值 / 通过指针、下标间接赋值的变量，通过局部指针别名的赋值和读取
+                           同时记到别名指向的形参、全局变量上
+        calls: [(被调用方法名或None, [实参 _argument 结果], FuncCall节点)] 按代码顺序
+        aliases: {局部指针变量: [(变量名, 是否间接)]} 局部指针初始化或赋值时的来源，不区分代码位置，
+                 如 int *p = k + 1 记为 (k, True)，p = &x 记为 (x, False)
+
+        :param funcdef: pycparser FuncDef
+        """
+        self.name = funcdef.decl.name
+        self.params = []
+        self.locals = set()
+        self.reads = set()
+        self.direct = set()
+        self.indirect = set()
+        self.calls = []
+        self.aliases = {}
+        pointers = set()
+        assigned = []
+        args = funcdef.decl.type.args
+        if args is not None:
+            for param in args.params:
+                if param.__class__.__name__ == 'Decl' and param.name is not None:
+                    self.params.append(param.name)
+        stack = [funcdef.body]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node is None:
+                continue
+            kind = node.__class__.__name__
+            if kind == 'ID':
+                self.reads.add(node.name)
+            elif kind in _TYPE_NODES:
+                continue
+            elif kind == 'Decl':
+                if node.name is not None:
+                    self.locals.add(node.name)
+                    if node.type.__class__.__name__ == 'PtrDecl':
+                        pointers.add(node.name)
+                        if node.init is not None and node.init.__class__.__name__ != 'InitList':
+                            assigned.append((node.name, node.init))
+                stack.append(node.init)
+            elif kind == 'Assignment':
+                target = _target(node.lvalue)
+                if target is not None:
+                    (self.indirect if target[1] else self.direct).add(target[0])
+                    if not target[1] and node.op == '=':
+                        assigned.append((target[0], node.rvalue))
+                stack.append(node.rvalue)
+                if target is None or node.op != '=':
+                    stack.append(node.lvalue)
+                else:
+                    # 与建图时相同，a[i] = ... 读取i，不读取a
+                    stack.extend(_lvalue_reads(node.lvalue))
+            elif kind == 'UnaryOp' and node.op in ('++', '--', 'p++', 'p--'):
+                target = _target(node.expr)
+                if target is not None:
+                    (self.indirect if target[1] else self.direct).add(target[0])
+                stack.append(node.expr)
+            elif kind == 'FuncCall':
+                exprs = list(node.args.exprs) if node.args is not None else []
+                if node.name.__class__.__name__ == 'ID':
+                    callee = node.name.name
+                else:
+                    # 通过函数指针调用
+                    callee = None
+                    stack.append(node.name)
+                self.calls.append((callee, [_argument(each) for each in exprs], node))
+                stack.extend(reversed(exprs))
+            elif kind == 'StructRef':
+                # field 也是ID节点，不是变量
+                stack.append(node.name)
+            elif kind == 'Cast':
+                stack.append(node.expr)
+            else:
+                stack.extend(child for _, child in reversed(node.children()))
+        # 按代码位置排序
+        self.calls.sort(key=lambda call: (call[2].coord.line, call[2].coord.column) if call[2].coord else (0, 0))
+        for name, expr in assigned:
+            source = _argument(expr) if name in pointers else None
+            if source is not None and source[0] != name:
+                self.aliases.setdefault(name, []).append(source)
+        for name in [each for each in self.indirect if each in self.aliases]:
+            for target, indirect in self.resolve(name, True):
+                (self.indirect if indirect else self.direct).add(target)
+        for name in [each for each in self.reads if each in self.aliases]:
+            self.reads.update(target for target, _ in self.resolve(name, True))
+
+    def resolve(self, name, indirect):
+        """
+        通过局部指针别名间接访问时，实际访问的变量：*p、p[i] 访问p指向的形参或全局变量，
+        别名的来源也是别名时继续展开
+
+        :param name: 变量名
+        :param indirect: 是否通过指针间接访问
+        :return: [(变量名, 是否间接)]
+        """
+        if not indirect or name not in self.aliases:
+            return [(name, indirect)]
+        result = []
+        seen = {name}
+        stack = list(self.aliases[name])
+        while len(stack) > 0:
+            target, target_indirect = stack.pop()
+            if target_indirect and target in self.aliases:
+                if target not in seen:
+                    seen.add(target)
+                    stack.extend(self.aliases[target])
+            elif (target, target_indirect) not in result:
+                result.append((target, target_indirect))
+        return result
+
+    def free(self, names):
+        """
+        :return: names 中不是形参也不是局部变量的名称（全局变量）
+        """
+        return {name for name in names if name not in self.locals and name not in self.params}
+
+
+class Summary:
+    __slots__ = ('name', 'params', 'defs', 'uses', 'global_defs', 'global_uses', 'unknown', 'key')
+
+    def __init__(self, name, params, defs=(), uses=(), global_defs=(), global_uses=(), unknown=(), key=None):
+        """
+        方法对调用方可见的副作用，包含它直接或间接调用的方法
+
+        :param name: 方法名
+        :param params: (形参名, ...)
+        :param defs: frozenset 通过指针被赋值的形参下标
+        :param uses: frozenset 被读取（或通过指针读取）的形参下标
+        :param global_defs: frozenset 被赋值的全局变量
+        :param global_uses: frozenset 被读取的全局变量
+        :param unknown: frozenset 调用到的未知方法（库函数、函数指针记为'*'）
+        :param key: 缓存key
+        """
+        self.name = name
+        self.params = tuple(params)
+        self.defs = frozenset(defs)
+        self.uses = frozenset(uses)
+        self.global_defs = frozenset(global_defs)
+        self.global_uses = frozenset(global_uses)
+        self.unknown = frozenset(unknown)
+        self.key = key
+
+    def show(self):
+        def names(values):
+            values = sorted(values)
+            return ', '.join(values) if len(values) > 0 else '-'
+
+        return 'd: %s | u: %s | global d: %s | global u: %s | unknown: %s' % (
+            names(self.params[i] for i in self.defs), names(self.params[i] for i in self.uses),
+            names(self.global_defs), names(self.global_uses), names(self.unknown))
+
+
+def _apply_call(summary, facts, args, state):
+    """
+    把一次调用的被调用方法摘要合并到调用方的摘要集合中
+
+    :param summary: 被调用方法的Summary
+    :param facts: 调用方Facts
+    :param args: 调用处的实参（_argument 结果）
+    :param state: 调用方的 [defs, uses, global_defs, global_uses, unknown] 集合
+    """
+    defs, uses, global_defs, global_uses, unknown = state
+    for kind, targets in ((0, summary.defs), (1, summary.uses)):
+        for index in targets:
+            if index >= len(args) or args[index] is None:
+                continue
+            for name, indirect in facts.resolve(*args[index]):
+                if name in facts.params:
+                    # 被调用方法通过指针读写调用方的形参所指向的内容
+                    if indirect:
+                        (defs if kind == 0 else uses).add(facts.params.index(name))
+                elif name not in facts.locals:
+                    (global_defs if kind == 0 else global_uses).add(name)
+    global_defs |= summary.global_defs
+    global_uses |= summary.global_uses
+    unknown |= summary.unknown
+
+
+class Function:
+    __slots__ = ('name', 'path', 'static', 'node', 'facts', 'fingerprint', 'callees')
+
+    def __init__(self, path, funcdef):
+        self.name = funcdef.decl.name
+        self.path = path
+        self.static = 'static' in funcdef.decl.storage
+        self.node = funcdef
+        self.facts = Facts(funcdef)
+        self.fingerprint = graph_gen.fingerprint('func', [funcdef])
+        # 与facts.calls对应的被调用方法下标，未知方法为None
+        self.callees = None
+
+
+class CallGraph:
+    def __init__(self, cache=None, memo=None):
+        """
+        多个文件中方法的调用图和每个方法的副作用摘要
+        方法按名称解析，static方法优先在同一文件中查找，未定义的方法（库函数等）记为未知
+
+        functions: [Function]
+        summaries: [Summary] 与functions对应，summarize之后可用
+
+        :param cache: cache.SummaryCache，跨进程复用摘要
+        :param memo: 进程内摘要缓存dict，key见summarize，默认每个CallGraph单独使用；
+                     长时间运行的进程中跨多个CallGraph复用摘要时使用有大小上限的cache
+        """
+        self.cache = cache
+        self.memo = memo if memo is not None else {}
+        self.functions = []
+        self.by_name = {}
+        self.static = {}
+        self.summaries = None
+        self.stats = {'functions': 0, 'components': 0, 'memo_hits': 0, 'cache_hits': 0, 'computed': 0}
+
+    def add_ast(self, ast, path):
+        """
+        加入一个文件的所有方法定义
+        """
+        for node in ast.ext:
+            if node.__class__.__name__ != 'FuncDef':
+                continue
+            function = Function(path, node)
+            index = len(self.functions)
+            self.functions.append(function)
+            if function.static:
+                self.static.setdefault((path, function.name), index)
+            else:
+                self.by_name.setdefault(function.name, index)
+        self.summaries = None
+
+    def add_file(self, path, cache=None, prelude=False):
+        """
+        解析并加入一个c文件
+
+        :param cache: cache.SourceCache
+        :return: pycparser FileAST
+        """
+        with open(path, 'rb') as f:
+            ast = graph_gen.load_ast(f.read(), path, cache, prelude=prelude)
+        self.add_ast(ast, path)
+        return ast
+
+    def resolve(self, path, name):
+        """
+        :return: 方法下标，未定义时为None
+        """
+        index = self.static.get((path, name))
+        return index if index is not None else self.by_name.get(name)
+
+    def __len__(self):
+        return len(self.functions)
+
+    def successors(self, i):
+        return [j for j in self.functions[i].callees if j is not None]
+
+    def summarize(self):
+        """
+        按强连通分量自底向上计算摘要，分量内迭代到不动点
+        分量的key由成员的方法体指纹和分量外被调用方法的摘要key决定，key相同的分量直接复用
+
+        :return: [Summary]
+        """
+        for function in self.functions:
+            function.callees = [self.resolve(function.path, callee) if callee is not None else None
+                                for callee, _, _ in function.facts.calls]
+        comp, count = strongly_connected(self)
+        members = [[] for _ in range(count)]
+        for i, c in enumerate(comp):
+            members[c].append(i)
+        summaries = [None] * len(self.functions)
+        # 分量编号为逆拓扑序，被调用方法所在的分量编号更小，先计算
+        for c in range(count):
+            group = members[c]
+            h = hashlib.sha256()
+            for i in sorted(group, key=lambda i: (self.functions[i].name, self.functions[i].fingerprint)):
+                function = self.functions[i]
+                h.update(('%s\0%s\0' % (function.name, function.fingerprint)).encode('utf-8'))
+                for j, (callee, _, _) in zip(function.callees, function.facts.calls):
+                    if j is None:
+                        h.update(('?%s\0' % callee).encode('utf-8'))
+                    elif comp[j] != c:
+                        h.update(('>%s\0' % summaries[j].key).encode('utf-8'))
+                    else:
+                        h.update(('=%s\0' % self.functions[j].name).encode('utf-8'))
+            key = h.hexdigest()
+            found = self.lookup(key, group)
+            if found is None:
+                found = self.compute(group, summaries, key)
+                self.stats['computed'] += 1
+                self.memo[key] = found
+                if self.cache is not None:
+                    self.cache.put_summary(key, found)
+            for i in group:
+                summaries[i] = found[self.functions[i].name]
+        self.stats['functions'] = len(self.functions)
+        self.stats['components'] = count
+        self.summaries = summaries
+        return summaries
+
+    def lookup(self, key, group):
+        """
+        :return: {方法名: Summary} 或 None
+        """
+        found = self.memo.get(key)
+        if found is not None:
+            self.stats['memo_hits'] += 1
+            return found
+        if self.cache is not None:
+            found = self.cache.get_summary(key)
+            if found is not None and all(self.functions[i].name in found for i in group):
+                self.stats['cache_hits'] += 1
+                self.memo[key] = found
+                return found
+        return None
+
+    def compute(self, group, summaries, key):
+        """
+        计算一个强连通分量中所有方法的摘要
+
+        :return: {方法名: Summary}
+        """
+        states = {}
+        for i in group:
+            facts = self.functions[i].facts
+            callees = {callee for callee, _, _ in facts.calls}
+            states[i] = [{k for k, name in enumerate(facts.params) if name in facts.indirect},
+                         {k for k, name in enumerate(facts.params) if name in facts.reads},
+                         facts.free(facts.direct | facts.indirect),
+                         facts.free(facts.reads - callees),
+                         set()]
+        changed = True
+        while changed:
+            changed = False
+            for i in group:
+                function = self.functions[i]
+                state = states[i]
+                before = sum(len(each) for each in state)
+                for j, (callee, args, _) in zip(function.callees, function.facts.calls):
+                    if j is None:
+                        state[4].add(callee if callee is not None else '*')
+                        continue
+                    callee_summary = summaries[j] if j not in states else self.make_summary(j, states[j], key)
+                    _apply_call(callee_summary, function.facts, args, state)
+                if sum(len(each) for each in state) != before:
+                    changed = True
+        return {self.functions[i].name: self.make_summary(i, states[i], key) for i in group}
+
+    def make_summary(self, i, state, key):
+        function = self.functions[i]
+        return Summary(function.name, function.facts.params, *state, key=key)
+
+    def summary(self, name, path=None):
+        """
+        :return: 名称为name的方法的Summary，未定义时为None
+        """
+        if self.summaries is None:
+            self.summarize()
+        index = self.resolve(path, name)
+        return self.summaries[index] if index is not None else None
+
+    def call_effects(self, graph, path):
+        """
+        把调用处被调用方法的副作用对应到graph的CFG节点上：
+        通过指针被赋值的实参变量、被赋值的全局变量记为调用所在节点的d，被读取的全局变量记为u
+        调用所在节点按节点代码中的调用文本和行号确定
+
+        :param graph: graph_gen.Graph 由同一文件建立
+        :param path: 文件路径（与add_file时相同）
+        :return: [{节点id: (d, u)}] 与graph.g对应
+        """
+        if self.summaries is None:
+            self.summarize()
+        functions = {}
+        for i, function in enumerate(self.functions):
+            if function.path == path:
+                functions.setdefault(function.name, i)
+        effects = []
+        for index, root in enumerate(graph.g):
+            kind, name = graph.units[index][0], graph.units[index][1]
+            extra = {}
+            effects.append(extra)
+            i = functions.get(name) if kind == 'func' else None
+            if i is None:
+                continue
+            function = self.functions[i]
+            nodes = [node for node, _ in walk(root) if node.id != -1 and node.line is not None]
+            for j, (callee, args, call) in zip(function.callees, function.facts.calls):
+                if j is None:
+                    continue
+                node = self.call_node(graph, nodes, call)
+                if node is None:
+                    continue
+                summary = self.summaries[j]
+                facts = function.facts
+                # 同名的局部变量、形参遮蔽全局变量
+                d = {name for name in summary.global_defs if name not in facts.locals and name not in facts.params}
+                u = {name for name in summary.global_uses if name not in facts.locals and name not in facts.params}
+                # 通过指针被赋值的实参变量
+                for k in summary.defs:
+                    if k < len(args) and args[k] is not None:
+                        d.add(args[k][0])
+                if len(d) == 0 and len(u) == 0:
+                    continue
+                old_d, old_u = extra.get(node.id, ((), ()))
+                extra[node.id] = (list(dict.fromkeys(list(old_d) + sorted(d))),
+                                  list(dict.fromkeys(list(old_u) + sorted(u))))
+        return effects
+
+    @staticmethod
+    def call_node(graph, nodes, call):
+        """
+        :return: 包含该调用的CFG节点：代码中含有调用文本、行号不大于调用行号的最后一个节点
+        """
+        text = graph.getComputeStatement_U(call)[0]
+        line = call.coord.line if call.coord is not None else None
+        best = None
+        fallback = None
+        for node in nodes:
+            if line is not None and node.line > line:
+                continue
+            if fallback is None or node.line > fallback.line:
+                fallback = node
+            if any(text in code for code in node.code) and (best is None or node.line > best.line):
+                best = node
+        return best if best is not None else fallback
+
+    def dataflow(self, graph, path):
+        """
+        :return: [dataflow.DataFlow] 与graph.g对应，调用处包含被调用方法的副作用
+        """
+        return [DataFlow(FlatCFG.from_node(root, '%s_%d' % (graph.name, index), extra))
+                for index, (root, extra) in enumerate(zip(graph.g, self.call_effects(graph, path)))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='call graph and side effect summaries of c functions')
+    parser.add_argument('paths', nargs='+', help='directories, files or glob patterns')
+    parser.add_argument('--pattern', default='*.c', help='file name pattern used in directories')
+    parser.add_argument('--func', default=None, help='only print this function')
+    parser.add_argument('--cache-dir', default=None, help='cache directory of function summaries')
+    parser.add_argument('--libc-prelude', action='store_true',
+                        help='predeclare fake libc macros and typedefs (size_t, FILE, NULL, ...)')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    graph = CallGraph(SummaryCache(args.cache_dir) if args.cache_dir else None)
+    for path in collect_files(args.paths, args.pattern):
+        graph.add_file(path, prelude=args.libc_prelude)
+    parsed = time.perf_counter()
+    summaries = graph.summarize()
+    done = time.perf_counter()
+    for function, summary in zip(graph.functions, summaries):
+        if args.func is not None and function.name != args.func:
+            continue
+        callees = [graph.functions[j].name for j in dict.fromkeys(function.callees) if j is not None]
+        print('%s (%s:%s)' % (function.name, function.path, graph_gen.line_of(function.node)))
+        print('    calls: %s' % (', '.join(callees) if len(callees) > 0 else '-'))
+        print('    ' + summary.show())
+    stats = graph.stats
+    print('functions: %d, components: %d, computed: %d, memo hits: %d, cache hits: %d, '
+          'parse %.3fs, summarize %.3fs' % (stats['functions'], stats['components'], stats['computed'],
+                                            stats['memo_hits'], stats['cache_hits'], parsed - start, done - parsed),
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,252 @@
+import heapq
+
+
+def reverse_postorder(cfg, entry=0):
+    """
+    非递归DFS求逆后序，入口不可达的节点按下标顺序追加在最后
+
+    :param cfg: flatcfg.FlatCFG
+    :return: [节点下标]
+    """
+    n = len(cfg)
+    if n == 0:
+        return []
+    visited = bytearray(n)
+    post = []
+    for root in [entry] + list(range(n)):
+        if visited[root]:
+            continue
+        visited[root] = 1
+        stack = [(root, iter(cfg.successors(root)))]
+        while len(stack) > 0:
+            node, it = stack[-1]
+            for succ in it:
+                if not visited[succ]:
+                    visited[succ] = 1
+                    stack.append((succ, iter(cfg.successors(succ))))
+                    break
+            else:
+                stack.pop()
+                post.append(node)
+    post.reverse()
+    return post
+
+
+def strongly_connected(cfg):
+    """
+    非递归Tarjan算法求强连通分量
+
+    :param cfg: flatcfg.FlatCFG
+    :return: (comp, count) comp[i]为节点i的分量编号，编号按逆拓扑序（后继分量编号更小）
+    """
+    n = len(cfg)
+    index = [-1] * n
+    low = [0] * n
+    comp = [-1] * n
+    on_stack = bytearray(n)
+    stack = []
+    counter = 0
+    count = 0
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+        work = [(root, iter(cfg.successors(root)))]
+        while len(work) > 0:
+            node, it = work[-1]
+            for succ in it:
+                if index[succ] == -1:
+                    index[succ] = low[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    on_stack[succ] = 1
+                    work.append((succ, iter(cfg.successors(succ))))
+                    break
+                elif on_stack[succ]:
+                    low[node] = min(low[node], index[succ])
+            else:
+                work.pop()
+                if len(work) > 0:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        comp[member] = count
+                        if member == node:
+                            break
+                    count += 1
+    return comp, count
+
+
+def cyclic_nodes(cfg, comp=None):
+    """
+    :return: bytearray 节点是否位于环上（所在分量多于一个节点或有自环）
+    """
+    if comp is None:
+        comp, _ = strongly_connected(cfg)
+    sizes = {}
+    for c in comp:
+        sizes[c] = sizes.get(c, 0) + 1
+    cyclic = bytearray(len(cfg))
+    for i in range(len(cfg)):
+        if sizes[comp[i]] > 1 or i in cfg.successors(i):
+            cyclic[i] = 1
+    return cyclic
+
+
+def _solve(order, flow_preds, transfer, n):
+    """
+    位向量迭代工作表，按order的优先级取出节点
+
+    :param order: [节点下标] 处理顺序（前向分析为逆后序，后向分析为后序）
+    :param flow_preds: 函数 i -> 数据流方向上的前驱
+    :param transfer: 函数 (i, in) -> out
+    :return: (ins, outs) 每个节点的整数位集合
+    """
+    ins = [0] * n
+    outs = [0] * n
+    rank = [0] * n
+    for position, i in enumerate(order):
+        rank[i] = position
+    # 数据流方向上的后继
+    flow_succs = [[] for _ in range(n)]
+    for i in range(n):
+        for p in flow_preds(i):
+            flow_succs[p].append(i)
+    heap = [(rank[i], i) for i in order]
+    queued = bytearray(b'\x01') * n
+    while len(heap) > 0:
+        _, i = heapq.heappop(heap)
+        queued[i] = 0
+        value = 0
+        for p in flow_preds(i):
+            value |= outs[p]
+        ins[i] = value
+        out = transfer(i, value)
+        if out != outs[i]:
+            outs[i] = out
+            for s in flow_succs[i]:
+                if not queued[s]:
+                    queued[s] = 1
+                    heapq.heappush(heap, (rank[s], s))
+    return ins, outs
+
+
+class DataFlow:
+    def __init__(self, cfg):
+        """
+        在完成的CFG上计算到达定义、du链/ud链和活跃变量
+        同一个AstNode中合并了多条语句，FlatCFG按语句顺序把节点的使用分为向上暴露的使用（cfg.u）
+        和节点内部的du对（cfg.local_pairs），到达定义只作用于前者
+
+        defs: [(节点下标, 变量下标)] 定义编号 -> 定义
+        reach_in / reach_out: [int] 每个节点入口/出口的到达定义位集合（按定义编号）
+        live_in / live_out: [int] 每个节点入口/出口的活跃变量位集合（按变量下标）
+        du_chains: {(定义节点id, 变量名): [使用节点id]}
+        ud_chains: {(使用节点id, 变量名): [定义节点id]}
+
+        :param cfg: flatcfg.FlatCFG
+        """
+        self.cfg = cfg
+        self.defs = []
+        self.reach_in = []
+        self.reach_out = []
+        self.live_in = []
+        self.live_out = []
+        self.du_chains = {}
+        self.ud_chains = {}
+        self.order = reverse_postorder(cfg)
+        self.reaching_definitions()
+        self.chains()
+        self.liveness()
+
+    def reaching_definitions(self):
+        cfg = self.cfg
+        n = len(cfg)
+        gen = [0] * n
+        var_defs = [0] * len(cfg.vars)
+        for i in range(n):
+            for v in cfg.d(i):
+                bit = 1 << len(self.defs)
+                self.defs.append((i, v))
+                gen[i] |= bit
+                var_defs[v] |= bit
+        kill = [0] * n
+        for i in range(n):
+            for v in cfg.d(i):
+                kill[i] |= var_defs[v]
+            kill[i] &= ~gen[i]
+        self.var_defs = var_defs
+        self.reach_in, self.reach_out = _solve(
+            self.order, cfg.predecessors, lambda i, value: gen[i] | (value & ~kill[i]), n)
+
+    def chains(self):
+        # 压缩后的图中一个节点包含多个原节点，du链中使用原节点id（见flatcfg.compact）
+        cfg = self.cfg
+        for i in range(len(cfg)):
+            reach = self.reach_in[i]
+            if reach == 0:
+                continue
+            for v in cfg.u(i):
+                bits = reach & self.var_defs[v]
+                name = cfg.vars[v]
+                use_ids = cfg.use_ids(i, v)
+                while bits:
+                    low = bits & -bits
+                    def_id = cfg.def_id(self.defs[low.bit_length() - 1][0], v)
+                    for use_id in use_ids:
+                        self.du_chains.setdefault((def_id, name), []).append(use_id)
+                        self.ud_chains.setdefault((use_id, name), []).append(def_id)
+                    bits ^= low
+        for name, def_id, use_id in cfg.local_pairs:
+            self.du_chains.setdefault((def_id, name), []).append(use_id)
+            self.ud_chains.setdefault((use_id, name), []).append(def_id)
+
+    def liveness(self):
+        cfg = self.cfg
+        n = len(cfg)
+        use = [0] * n
+        define = [0] * n
+        for i in range(n):
+            for v in cfg.u(i):
+                use[i] |= 1 << v
+            for v in cfg.d(i):
+                define[i] |= 1 << v
+        # 后向分析：按后序处理，"前驱"为CFG后继
+        self.live_out, self.live_in = _solve(
+            self.order[::-1], cfg.successors, lambda i, value: use[i] | (value & ~define[i]), n)
+
+    def pairs(self):
+        """
+        :return: [(变量名, 定义节点id, 使用节点id)] 排序后的du对
+        """
+        result = []
+        for (def_id, name), uses in self.du_chains.items():
+            for use_id in uses:
+                result.append((name, def_id, use_id))
+        result.sort()
+        return result
+
+    def names(self, bits):
+        """
+        :param bits: 变量位集合
+        :return: [变量名]
+        """
+        result = []
+        while bits:
+            low = bits & -bits
+            result.append(self.cfg.vars[low.bit_length() - 1])
+            bits ^= low
+        return result
+
+    def live_at(self, gid):
+        """
+        :param gid: 节点id
+        :return: [变量名] 节点入口处活跃的变量（压缩后的图为所在基本块入口）
+        """
+        return self.names(self.live_in[self.cfg.index[gid]])
@@ -0,0 +1,321 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from difflib import SequenceMatcher
+
+import graph_gen
+from dataflow import DataFlow
+from export import quote
+from flatcfg import FlatCFG
+from graph_gen import AstNode, walk
+
+
+def subtree_hashes(root):
+    """
+    自底向上计算每个AstNode子树的Merkle哈希，包含节点的代码、d/u、开始/终止标记、出边形状和孩子的哈希
+    出边终点在子树内时记为相对子树最小id的偏移，否则只记为子树外，子树整体平移id时哈希不变
+
+    :param root: AstNode g中的一项
+    :return: {id(AstNode): bytes}
+    """
+    hashes = {}
+    members = {}
+    stack = [(root, False)]
+    while len(stack) > 0:
+        node, expanded = stack.pop()
+        if not expanded:
+            stack.append((node, True))
+            stack.extend((each, False) for each in reversed(node.child))
+            continue
+        ids = {node.id} if node.id != -1 else set()
+        for each in node.child:
+            ids |= members.pop(id(each))
+        base = min(ids) if len(ids) > 0 else 0
+        h = hashlib.sha1(repr((node.code, node.d, node.u, node.isStart, node.isEnd)).encode('utf-8'))
+        for target in node.connectTo:
+            h.update(b'>%d' % (target - base) if target in ids else b'>out')
+        for each in node.child:
+            h.update(hashes[id(each)])
+        hashes[id(node)] = h.digest()
+        members[id(node)] = ids
+    return hashes
+
+
+def preorder(node):
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        yield node
+        stack.extend(reversed(node.child))
+
+
+def same_node(a, b):
+    return a.code == b.code and a.d == b.d and a.u == b.u and a.isStart == b.isStart and a.isEnd == b.isEnd
+
+
+def match_nodes(old, new, old_hashes, new_hashes):
+    """
+    自顶向下对应两个版本的节点：哈希相同的子树按先序整体对应，不再比较内部；
+    否则内容相同的节点对应，孩子按哈希序列对齐（difflib）后逐对继续比较，
+    对齐到同一位置但内容不同的节点记为被修改的节点
+
+    :return: ({旧节点id: 新节点id}, {被修改的旧节点id: 新节点id}, 整体对应的节点数)
+    """
+    mapping = {}
+    replaced = {}
+    skipped = 0
+    stack = [(old, new)]
+    while len(stack) > 0:
+        a, b = stack.pop()
+        if old_hashes[id(a)] == new_hashes[id(b)]:
+            for x, y in zip(preorder(a), preorder(b)):
+                if x.id != -1:
+                    mapping[x.id] = y.id
+                    skipped += 1
+            continue
+        if a.id != -1 and b.id != -1:
+            if same_node(a, b):
+                mapping[a.id] = b.id
+            else:
+                replaced[a.id] = b.id
+        keys_a = [old_hashes[id(each)] for each in a.child]
+        keys_b = [new_hashes[id(each)] for each in b.child]
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, keys_a, keys_b, autojunk=False).get_opcodes():
+            # 替换的部分按位置配对，多出来的孩子为新增或删除
+            if tag == 'equal' or tag == 'replace':
+                stack.extend(zip(a.child[i1:i2], b.child[j1:j2]))
+    return mapping, replaced, skipped
+
+
+def _nodes_edges(root):
+    nodes = {}
+    edges = set()
+    if root is None:
+        return nodes, edges
+    for node, node_edges in walk(root):
+        if node.id != -1:
+            nodes[node.id] = node
+        edges.update(node_edges)
+    return nodes, edges
+
+
+def _pairs(root):
+    if root is None:
+        return set()
+    return set(DataFlow(FlatCFG.from_node(root)).pairs())
+
+
+class UnitDiff:
+    __slots__ = ('kind', 'name', 'status', 'old', 'new', 'mapping', 'replaced', 'skipped', 'nodes_added', 'nodes_removed',
+                 'edges_added', 'edges_removed', 'pairs_added', 'pairs_removed')
+
+    def __init__(self, kind, name, old, new):
+        """
+        一个方法（或一组全局变量、typedef）在两个版本之间的变化
+        status: 'same' 根哈希相同，不再比较 / 'changed' / 'added' / 'removed'
+        nodes_added / edges_added / pairs_added 中的节点id为新版本的id，*_removed 为旧版本的id
+        被修改的节点（replaced）本身记为删除和新增，但经过它的边和du对按对应的新节点比较，没有改变的不列出
+
+        :param old: 旧版本的AstNode，新增的单元为None
+        :param new: 新版本的AstNode，删除的单元为None
+        """
+        self.kind = kind
+        self.name = name
+        self.old = old
+        self.new = new
+        self.mapping = {}
+        self.replaced = {}
+        self.skipped = 0
+        self.nodes_added = self.nodes_removed = []
+        self.edges_added = self.edges_removed = []
+        self.pairs_added = self.pairs_removed = []
+        if old is None:
+            self.status = 'added'
+        elif new is None:
+            self.status = 'removed'
+        else:
+            old_hashes = subtree_hashes(old)
+            new_hashes = subtree_hashes(new)
+            self.mapping, self.replaced, self.skipped = match_nodes(old, new, old_hashes, new_hashes)
+            if old_hashes[id(old)] == new_hashes[id(new)]:
+                self.status = 'same'
+                return
+            self.status = 'changed'
+        self.compare()
+
+    def compare(self):
+        old_nodes, old_edges = _nodes_edges(self.old)
+        new_nodes, new_edges = _nodes_edges(self.new)
+        mapped = set(self.mapping.values())
+        self.nodes_removed = [old_nodes[each] for each in old_nodes if each not in self.mapping]
+        self.nodes_added = [new_nodes[each] for each in new_nodes if each not in mapped]
+        mapping = dict(self.replaced)
+        mapping.update(self.mapping)
+        moved = set((mapping.get(start), mapping.get(end), label) for start, end, label in old_edges)
+        self.edges_added = sorted(edge for edge in new_edges if edge not in moved)
+        self.edges_removed = sorted(edge for edge in old_edges
+                                    if (mapping.get(edge[0]), mapping.get(edge[1]), edge[2]) not in new_edges)
+        old_pairs = _pairs(self.old)
+        new_pairs = _pairs(self.new)
+        moved = set((name, mapping.get(d), mapping.get(u)) for name, d, u in old_pairs)
+        self.pairs_added = sorted(pair for pair in new_pairs if pair not in moved)
+        self.pairs_removed = sorted(pair for pair in old_pairs
+                                    if (pair[0], mapping.get(pair[1]), mapping.get(pair[2])) not in new_pairs)
+
+    def to_dict(self):
+        def nodes(each):
+            return [{'id': node.id, 'line': node.line, 'code': node.code} for node in each]
+
+        result = {'kind': self.kind, 'name': self.name, 'status': self.status}
+        if self.status != 'same':
+            result['nodes'] = {'added': nodes(self.nodes_added), 'removed': nodes(self.nodes_removed)}
+            result['edges'] = {'added': [list(each) for each in self.edges_added],
+                               'removed': [list(each) for each in self.edges_removed]}
+            result['pairs'] = {'added': [list(each) for each in self.pairs_added],
+                               'removed': [list(each) for each in self.pairs_removed]}
+            result['matched'] = len(self.mapping)
+            result['skipped'] = self.skipped
+        return result
+
+    def summary(self):
+        return '%-8s %-6s %-24s nodes +%d -%d  edges +%d -%d  du pairs +%d -%d' % (
+            self.status, self.kind, self.name, len(self.nodes_added), len(self.nodes_removed),
+            len(self.edges_added), len(self.edges_removed), len(self.pairs_added), len(self.pairs_removed))
+
+
+def split_declarations(name, root):
+    """
+    全局变量和typedef的单元合并了一组连续的声明，按每条声明拆成单独的节点，以声明的名称对应，
+    增删一个声明时只有这个声明改变；节点没有逐条的定义和使用时不拆分
+
+    :param name: 单元名称
+    :param root: AstNode 单元的根节点
+    :return: [(名称, AstNode)]
+    """
+    if len(root.steps) != len(root.code):
+        return [(name, root)]
+    result = []
+    for code, (d, u) in zip(root.code, root.steps):
+        node = AstNode(root.id, code=[code], d=list(d), u=list(u), line=root.line, steps=[(list(d), list(u))])
+        result.append((', '.join(str(each) for each in d) or code, node))
+    return result
+
+
+def diff_graphs(old, new):
+    """
+    按(类型, 名称)对应两个Graph的单元，同名的单元按出现顺序对应；全局变量和typedef按每条声明的名称对应
+
+    :param old: graph_gen.Graph 旧版本
+    :param new: graph_gen.Graph 新版本
+    :return: [UnitDiff] 新版本的顺序，之后是被删除的单元
+    """
+    def keyed(graph):
+        result = {}
+        seen = {}
+        for unit, root in zip(graph.units, graph.g):
+            entries = [(unit[1], root)] if unit[0] == 'func' else split_declarations(unit[1], root)
+            for name, node in entries:
+                key = (unit[0], name)
+                seen[key] = seen.get(key, 0) + 1
+                result[key + (seen[key],)] = node
+        return result
+
+    old_units = keyed(old)
+    new_units = keyed(new)
+    diffs = [UnitDiff(key[0], key[1], old_units.get(key), root) for key, root in new_units.items()]
+    diffs += [UnitDiff(key[0], key[1], root, None) for key, root in old_units.items() if key not in new_units]
+    return diffs
+
+
+def to_dict(diffs, include_same=False):
+    """
+    :return: {'units': [UnitDiff.to_dict()], 'changed': 改变的单元数}
+    """
+    changed = [each for each in diffs if each.status != 'same']
+    return {'units': [each.to_dict() for each in (diffs if include_same else changed)], 'changed': len(changed)}
+
+
+def write_dot(diffs, fp, name='diff'):
+    """
+    写出改变的单元的DOT，每个单元一个子图，画新版本的图：
+    新增的节点和边为绿色，删除的节点（id前加o）和边为红色虚线，未改变的部分为灰色
+
+    :param diffs: [UnitDiff]
+    :param fp: 文本文件对象
+    """
+    fp.write('digraph %s {\n' % quote(name))
+    fp.write('\tnode [color=gray50 fontcolor=gray30]\n\tedge [color=gray50]\n')
+    for index, each in enumerate(diffs):
+        if each.status == 'same':
+            continue
+        fp.write('\tsubgraph cluster_%d {\n\t\tlabel=%s\n' % (index, quote('%s %s' % (each.status, each.name))))
+        added = set(node.id for node in each.nodes_added)
+        new_nodes, new_edges = _nodes_edges(each.new)
+        for gid, node in new_nodes.items():
+            style = ' color=green4 fontcolor=black style=bold' if gid in added else ''
+            fp.write('\t\t%d [label=%s%s]\n' % (gid, quote(node.show()), style))
+        for node in each.nodes_removed:
+            fp.write('\t\to%d [label=%s color=red fontcolor=red style=dashed]\n' % (node.id, quote(node.show())))
+        edges_added = set(each.edges_added)
+        for start, end, label in sorted(new_edges):
+            style = ' color=green4 style=bold' if (start, end, label) in edges_added else ''
+            fp.write('\t\t%d -> %d [label=%s%s]\n' % (start, end, quote(label or ''), style))
+        for start, end, label in each.edges_removed:
+            start = each.mapping[start] if start in each.mapping else 'o%d' % start
+            end = each.mapping[end] if end in each.mapping else 'o%d' % end
+            fp.write('\t\t%s -> %s [label=%s color=red style=dashed]\n' % (start, end, quote(label or '')))
+        fp.write('\t}\n')
+    fp.write('}\n')
+
+
+def git_source(path, rev):
+    """
+    :return: bytes 文件在git版本rev中的内容
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    return subprocess.run(['git', 'show', '%s:./%s' % (rev, os.path.basename(path))], cwd=directory,
+                          stdout=subprocess.PIPE, check=True).stdout
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='structural diff of the CFGs and du pairs of two versions of a c file')
+    parser.add_argument('old', help='old c file, or the file to compare with --rev')
+    parser.add_argument('new', nargs='?', default=None, help='new c file')
+    parser.add_argument('--rev', default=None, help='compare the working file with this git revision')
+    parser.add_argument('-o', '--output', default=None, help='write the change set as json to this file (- for stdout)')
+    parser.add_argument('--dot', default=None, help='write a highlighted DOT of the changed functions to this file')
+    parser.add_argument('--all', action='store_true', help='also list unchanged functions')
+    args = parser.parse_args(argv)
+
+    if args.rev is not None:
+        path = args.old
+        name = os.path.splitext(os.path.basename(path))[0]
+        old = graph_gen.analyze_source(git_source(path, args.rev), path, name)
+        new = graph_gen.analyze(path, name)
+    elif args.new is not None:
+        old = graph_gen.analyze(args.old, os.path.splitext(os.path.basename(args.old))[0])
+        new = graph_gen.analyze(args.new, os.path.splitext(os.path.basename(args.new))[0])
+    else:
+        parser.error('a new file or --rev is required')
+    diffs = diff_graphs(old, new)
+    for each in diffs:
+        if args.all or each.status != 'same':
+            print(each.summary(), file=sys.stderr if args.output == '-' else sys.stdout)
+    if args.output == '-':
+        json.dump(to_dict(diffs, args.all), sys.stdout, ensure_ascii=False)
+        sys.stdout.write('\n')
+    elif args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(to_dict(diffs, args.all), f, ensure_ascii=False)
+    if args.dot is not None:
+        with open(args.dot, 'w', encoding='utf-8') as f:
+            write_dot(diffs, f, new.name)
+    # 与diff相同：没有改变时退出码为0，有改变时为1
+    return 1 if any(each.status != 'same' for each in diffs) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+from dataflow import DataFlow, cyclic_nodes
+
+
+class DuPathEnumerator:
+    def __init__(self, flow, loop_bound=1, max_length=None, max_paths=None, max_per_pair=None, memo_limit=1024):
+        """
+        按(变量, 定义, 使用)逐条生成def-clear的du路径，不一次性生成全部路径
+        路径从定义节点开始、到使用节点结束，中间节点不再定义该变量
+
+        不在环上的节点，从它到使用节点的后缀与前面走过的路径无关，
+        这些后缀在第一次完整遍历后被缓存，之后同一(变量, 使用)的其他定义直接复用
+
+        :param flow: dataflow.DataFlow 或 flatcfg.FlatCFG
+        :param loop_bound: 每个节点在一条路径中最多重复经过的次数（循环展开次数）
+        :param max_length: 路径最多包含的节点数
+        :param max_paths: 总路径数上限
+        :param max_per_pair: 每个du对的路径数上限
+        :param memo_limit: 每个缓存后缀列表的最大条数，超过则不缓存
+        """
+        if not isinstance(flow, DataFlow):
+            flow = DataFlow(flow)
+        self.flow = flow
+        self.cfg = flow.cfg
+        self.loop_bound = loop_bound
+        self.max_length = max_length
+        self.max_paths = max_paths
+        self.max_per_pair = max_per_pair
+        self.memo_limit = memo_limit
+        self.cyclic = cyclic_nodes(self.cfg)
+        # 变量 -> 定义该变量的节点
+        self.def_nodes = {}
+        for node, v in flow.defs:
+            self.def_nodes.setdefault(v, set()).add(node)
+        self._regions = {}
+        self._memo = {}
+        self.count = 0
+
+    def region(self, v, use):
+        """
+        不经过v的其他定义就能到达use的节点集合（作为路径上use之前的节点），按(变量, 使用)缓存
+        """
+        key = (v, use)
+        allowed = self._regions.get(key)
+        if allowed is None:
+            defs = self.def_nodes.get(v, ())
+            allowed = set()
+            stack = [use]
+            expanded = set()
+            while len(stack) > 0:
+                node = stack.pop()
+                for pred in self.cfg.predecessors(node):
+                    allowed.add(pred)
+                    # 定义v的节点只能作为路径起点，不再向前扩展
+                    if pred not in expanded and pred not in defs:
+                        expanded.add(pred)
+                        stack.append(pred)
+            self._regions[key] = allowed
+        return allowed
+
+    def paths(self, var=None):
+        """
+        :param var: 只生成该变量名的路径，None为全部变量
+        :return: 生成器 (变量名, 定义节点id, 使用节点id, (路径节点id, ...))
+        """
+        cfg = self.cfg
+        # 同一基本块内的du对，路径就是块内的这两个节点；同一节点内的du对，路径只有这个节点
+        local = set(cfg.local_pairs)
+        for name, def_id, use_id in self.flow.pairs():
+            if var is not None and name != var:
+                continue
+            if (name, def_id, use_id) in local:
+                if self.max_paths is not None and self.count >= self.max_paths:
+                    return
+                self.count += 1
+                yield name, def_id, use_id, (def_id, use_id) if def_id != use_id else (def_id,)
+                continue
+            v = cfg.var_index[name]
+            per_pair = 0
+            for path in self.pair_paths(v, cfg.index[def_id], cfg.index[use_id]):
+                if self.max_paths is not None and self.count >= self.max_paths:
+                    return
+                self.count += 1
+                # 首尾为定义和使用所在的原节点，中间为经过的节点（压缩后为基本块的第一个节点）
+                yield name, def_id, use_id, (def_id,) + tuple(cfg.ids[i] for i in path[1:-1]) + (use_id,)
+                per_pair += 1
+                if self.max_per_pair is not None and per_pair >= self.max_per_pair:
+                    break
+
+    def pair_paths(self, v, start, use):
+        """
+        非递归DFS生成一个du对的全部路径
+
+        :param v: 变量下标
+        :param start: 定义节点下标
+        :param use: 使用节点下标
+        :return: 生成器 (节点下标, ...)
+        """
+        allowed = self.region(v, use)
+        if start not in allowed:
+            return
+        defs = self.def_nodes.get(v, ())
+        limit = self.loop_bound + 1
+        max_length = self.max_length
+        successors = self.cfg.successors
+        memo = self._memo
+        path = [start]
+        visits = {start: 1}
+        # frame: [节点, 后继迭代器, 后缀收集列表或None, 是否被截断]
+        frames = [[start, iter(successors(start)), None, False]]
+
+        def emit(result):
+            for depth in range(1, len(frames)):
+                collector = frames[depth][2]
+                if collector is not None:
+                    if len(collector) < self.memo_limit:
+                        collector.append(result[depth:])
+                    else:
+                        frames[depth][2] = None
+            return result
+
+        def truncate():
+            for frame in frames:
+                frame[3] = True
+
+        while len(frames) > 0:
+            frame = frames[-1]
+            pushed = False
+            for succ in frame[1]:
+                if succ == use:
+                    if max_length is None or len(path) + 1 <= max_length:
+                        yield emit(tuple(path) + (use,))
+                    else:
+                        truncate()
+                    continue
+                if succ not in allowed or succ in defs:
+                    continue
+                if visits.get(succ, 0) >= limit:
+                    continue
+                if max_length is not None and len(path) + 2 > max_length:
+                    truncate()
+                    continue
+                suffixes = memo.get((v, use, succ))
+                if suffixes is not None:
+                    prefix = tuple(path)
+                    for suffix in suffixes:
+                        if max_length is None or len(prefix) + len(suffix) <= max_length:
+                            yield emit(prefix + suffix)
+                        else:
+                            truncate()
+                    continue
+                path.append(succ)
+                visits[succ] = visits.get(succ, 0) + 1
+                frames.append([succ, iter(successors(succ)), [] if not self.cyclic[succ] else None, False])
+                pushed = True
+                break
+            if not pushed:
+                node, _, collector, truncated = frames.pop()
+                path.pop()
+                visits[node] -= 1
+                if collector is not None and not truncated:
+                    memo[(v, use, node)] = collector
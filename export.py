@@ -0,0 +1,220 @@
+import argparse
+import gzip
+import io
+import json
+import sys
+
+import graph_gen
+from graph_gen import walk
+
+
+def quote(string):
+    """
+    DOT双引号字符串转义，换行写成\\n
+    """
+    return '"%s"' % string.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def write_dot(graph, fp):
+    """
+    直接流式写出DOT文本，不经过graphviz的Digraph对象
+
+    节点的id属性为 单元名称:局部id（见Graph.local_id），前面增删方法时不变；scoped时d/u显示为符号名称，
+    同名的符号为 name#id（见symbols.SymbolTable.display）
+
+    :param graph: graph_gen.Graph
+    :param fp: 文本文件对象
+    """
+    names = graph.symbols.display if graph.symbols is not None else None
+    fp.write('digraph %s {\n' % quote(graph.name))
+    for index, root in enumerate(graph.g):
+        unit = graph.units[index][1]
+        for node, edges in walk(root):
+            if node.id != -1:
+                if node.isStart:
+                    shape = ' shape=doublecircle'
+                elif node.isEnd:
+                    shape = ' shape=box'
+                else:
+                    shape = ''
+                fp.write('\t%d [label=%s id=%s%s]\n' % (node.id, quote(node.show(names)),
+                                                         quote('%s:%d' % (unit, graph.local_id(index, node.id))),
+                                                         shape))
+            for start, end, label in edges:
+                if label is None:
+                    fp.write('\t%d -> %d\n' % (start, end))
+                else:
+                    fp.write('\t%d -> %d [label=%s]\n' % (start, end, quote(label)))
+    fp.write('}\n')
+
+
+def write_json(graph, fp):
+    """
+    逐个节点写出JSON，格式与Graph.to_dict()相同；scoped时d/u和du_path的key为显示名称
+    （symbols.SymbolTable.display，同名的符号为 name#id）而不是符号id，另附 'symbols' 列表
+
+    :param graph: graph_gen.Graph
+    :param fp: 文本文件对象
+    """
+    def names(values):
+        return values if graph.symbols is None else [graph.symbols.display(each) for each in values]
+
+    fp.write('{"name": %s, "graphs": [' % json.dumps(graph.name))
+    for index, root in enumerate(graph.g):
+        kind, unit, _, base, _ = graph.units[index]
+        fp.write(',\n' if index > 0 else '\n')
+        fp.write('{"unit": %s, "kind": %s, "nodes": [' % (json.dumps(unit, ensure_ascii=False), json.dumps(kind)))
+        edges = []
+        first = True
+        for node, node_edges in walk(root):
+            edges.extend(node_edges)
+            if node.id == -1:
+                continue
+            fp.write('\n' if first else ',\n')
+            first = False
+            json.dump({'id': node.id, 'local': node.id - base, 'code': node.code, 'd': names(node.d),
+                       'u': names(node.u), 'isStart': node.isStart, 'isEnd': node.isEnd, 'line': node.line}, fp, ensure_ascii=False)
+        fp.write('],\n"edges": ')
+        json.dump(edges, fp)
+        fp.write(',\n"du_path": ')
+        dupath = graph.du_path[index]
+        if graph.symbols is not None:
+            dupath = {graph.symbols.display(var): path for var, path in dupath.items()}
+        json.dump(dupath, fp, ensure_ascii=False)
+        fp.write('}')
+    if graph.symbols is not None:
+        fp.write('],\n"symbols": ')
+        json.dump(graph.symbols.to_list(), fp, ensure_ascii=False)
+        fp.write('}\n')
+    else:
+        fp.write(']}\n')
+
+
+class DuWriter:
+    def __init__(self, path, mode='pairs', compress=None, buffer_size=1024 * 1024, **path_kwargs):
+        """
+        以JSONL格式逐个单元写出du信息，每行一条记录，写完一个单元后即可释放该单元
+        mode:
+            'pairs'  每个 (变量, 定义节点, 使用节点) 一条：{"unit", "var", "def", "use"}
+            'paths'  每条def-clear路径一条：{"unit", "var", "def", "use", "path": [节点id]}
+            'dupath' 每个变量一条，内容与travel_dupath相同：{"unit", "var", "dupath": 嵌套列表}
+        scoped时var为符号的显示名称（symbols.SymbolTable.display，同名的符号为 name#id）
+
+        :param path: 输出文件路径，'-' 为标准输出
+        :param mode: 'pairs' / 'paths' / 'dupath'
+        :param compress: 是否gzip压缩，None时按文件名是否以.gz结尾决定
+        :param buffer_size: 写缓冲区大小
+        :param path_kwargs: paths模式下传给dupaths.DuPathEnumerator的限制，如 loop_bound、max_per_pair；
+                            max_paths 为整个输出（所有单元合计）的路径数上限，达到后不再写出路径
+        """
+        if mode not in ('pairs', 'paths', 'dupath'):
+            raise ValueError('unknown du record mode: %s' % mode)
+        self.mode = mode
+        self.path_kwargs = dict(path_kwargs)
+        # 剩余可写出的路径数，None为不限制
+        self.remaining_paths = self.path_kwargs.pop('max_paths', None)
+        self.records = 0
+        if compress is None:
+            compress = path.endswith('.gz')
+        if path == '-':
+            self.raw = None
+            self.fp = sys.stdout
+        elif compress:
+            self.raw = gzip.open(path, 'wb', compresslevel=6)
+            self.fp = io.TextIOWrapper(io.BufferedWriter(self.raw, buffer_size), encoding='utf-8')
+        else:
+            self.raw = None
+            self.fp = open(path, 'w', encoding='utf-8', buffering=buffer_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self.fp is sys.stdout:
+            self.fp.flush()
+            return
+        self.fp.close()
+        if self.raw is not None:
+            self.raw.close()
+
+    def write_unit(self, graph, index):
+        """
+        写出graph中第index个单元的du记录，可直接作为Graph的on_unit回调
+
+        :param graph: graph_gen.Graph
+        :param index: 单元下标
+        """
+        name = graph.units[index][1]
+        show = graph.symbols.display if graph.symbols is not None else (lambda var: var)
+        lines = []
+        if self.mode == 'dupath':
+            for var, path in graph.du_path[index].items():
+                lines.append(json.dumps({'unit': name, 'var': show(var), 'dupath': path},
+                                        ensure_ascii=False))
+        else:
+            from flatcfg import FlatCFG
+            from dataflow import DataFlow
+            flow = DataFlow(FlatCFG.from_node(graph.g[index], name))
+            if self.mode == 'pairs':
+                for var, def_id, use_id in flow.pairs():
+                    lines.append(json.dumps({'unit': name, 'var': show(var), 'def': def_id, 'use': use_id},
+                                            ensure_ascii=False))
+            else:
+                from dupaths import DuPathEnumerator
+                if self.remaining_paths is None or self.remaining_paths > 0:
+                    enumerator = DuPathEnumerator(flow, max_paths=self.remaining_paths, **self.path_kwargs)
+                    for var, def_id, use_id, path in enumerator.paths():
+                        lines.append(json.dumps({'unit': name, 'var': show(var), 'def': def_id, 'use': use_id,
+                                                 'path': path}, ensure_ascii=False))
+                    if self.remaining_paths is not None:
+                        self.remaining_paths -= len(lines)
+        if len(lines) > 0:
+            self.fp.write('\n'.join(lines))
+            self.fp.write('\n')
+            self.records += len(lines)
+
+
+def stream_du(path, output, mode='pairs', compress=None, name=None, **kwargs):
+    """
+    分析c文件并把du信息流式写入JSONL，建立完一个单元就写出并释放，内存占用与最大的方法有关而与文件大小无关
+
+    :param path: c文件路径
+    :param output: 输出文件路径
+    :param mode: 见DuWriter
+    :param compress: 见DuWriter
+    :param name: 图名称
+    :param kwargs: 传给graph_gen.analyze的参数（cache、cpp_path等）或DuPathEnumerator的限制
+    :return: 写出的记录数
+    """
+    limits = {k: kwargs.pop(k) for k in ('loop_bound', 'max_length', 'max_paths', 'max_per_pair')
+              if k in kwargs}
+    with DuWriter(output, mode, compress, **limits) as writer:
+        graph_gen.analyze(path, name or path, on_unit=writer.write_unit, retain=False, **kwargs)
+    return writer.records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='write def-use records of a c file as JSON lines')
+    parser.add_argument('path', help='c file')
+    parser.add_argument('-o', '--output', default='-', help='output file, .gz is compressed, default stdout')
+    parser.add_argument('--mode', choices=['pairs', 'paths', 'dupath'], default='pairs',
+                        help='one record per def-use pair, per def-clear path, or per variable du-path')
+    parser.add_argument('--gzip', action='store_true', default=None, help='compress even without .gz suffix')
+    parser.add_argument('--loop-bound', type=int, default=1, help='loop unrolling of paths mode')
+    parser.add_argument('--max-per-pair', type=int, default=None, help='path limit per def-use pair')
+    parser.add_argument('--max-paths', type=int, default=None, help='path limit of the whole output in paths mode')
+    args = parser.parse_args(argv)
+    kwargs = {}
+    if args.mode == 'paths':
+        kwargs = {'loop_bound': args.loop_bound, 'max_per_pair': args.max_per_pair, 'max_paths': args.max_paths}
+    count = stream_du(args.path, args.output, args.mode, args.gzip, **kwargs)
+    print('%d records' % count, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,406 @@
+import sys
+from array import array
+
+from graph_gen import walk
+
+# 边标签：0 无标签，1 True，2 False
+LABELS = (None, 'True', 'False')
+LABEL_INDEX = {label: index for index, label in enumerate(LABELS)}
+
+START = 1
+END = 2
+
+
+class FlatCFG:
+    __slots__ = ('name', 'ids', 'flags', 'code', 'offsets', 'targets', 'labels',
+                 'vars', 'var_index', 'd_offsets', 'd_vars', 'u_offsets', 'u_vars',
+                 'index', '_preds', 'members', 'def_sites', 'use_sites', 'local_pairs')
+
+    def __init__(self, name=''):
+        """
+        扁平的CFG，一个对象对应g中的一项（方法、全局变量或typedef）
+        节点用下标0..n-1表示，属性保存在平行的数组中；边使用CSR形式保存：
+        节点i的后继为 targets[offsets[i]:offsets[i+1]]，对应标签为 labels[...]
+        变量名驻留在vars中，d/u同样使用CSR形式保存变量下标
+        u只包含节点中在定义之前被使用的变量（向上暴露的使用），节点内部的du对记录在local_pairs中
+
+        ids: array 节点在AstNode中的id
+        flags: array START/END 标记
+        code: [str] 节点代码（多行用\\n连接）
+        """
+        self.name = name
+        self.ids = array('l')
+        self.flags = array('b')
+        self.code = []
+        self.offsets = array('l', [0])
+        self.targets = array('l')
+        self.labels = array('b')
+        self.vars = []
+        self.var_index = {}
+        self.d_offsets = array('l', [0])
+        self.d_vars = array('l')
+        self.u_offsets = array('l', [0])
+        self.u_vars = array('l')
+        # AstNode id -> 下标
+        self.index = {}
+        self._preds = None
+        # 以下只在compact之后使用，见compact
+        self.members = None
+        self.def_sites = None
+        self.use_sites = None
+        # [(变量名, 定义节点id, 使用节点id)] 同一节点（或基本块）内部的du对
+        self.local_pairs = []
+
+    @classmethod
+    def from_node(cls, root, name='', extra=None):
+        """
+        由AstNode树建立，节点顺序与walk一致（第0个节点为Start或全局节点）
+
+        :param root: AstNode g中的一项
+        :param name: 名称
+        :param extra: {节点id: (d, u)} 追加到节点上的定义和使用，如方法调用的副作用（见callgraph），
+                      视为发生在节点的最后一条语句之后
+        :return: FlatCFG
+        """
+        cfg = cls(name)
+        edges = []
+        for node, node_edges in walk(root):
+            if node.id == -1:
+                continue
+            steps = node.steps if len(node.steps) > 0 else [(node.d, node.u)]
+            if extra is not None and node.id in extra:
+                steps = steps + [extra[node.id]]
+            cfg._add_steps(node.id, node.code, steps, node.isStart, node.isEnd)
+            edges.append(node_edges)
+        # 未被遍历到的边终点（理论上不会出现）作为空节点补上
+        for node_edges in edges:
+            for _, end, _ in node_edges:
+                if end not in cfg.index:
+                    cfg._add_node(end, [], [], [], False, False)
+                    edges.append([])
+        for node_edges in edges:
+            for _, end, label in node_edges:
+                cfg.targets.append(cfg.index[end])
+                cfg.labels.append(LABEL_INDEX[label])
+            cfg.offsets.append(len(cfg.targets))
+        return cfg
+
+    def _add_steps(self, gid, code, steps, is_start, is_end):
+        """
+        按语句顺序加入节点：在本节点之前的定义之后被使用的变量不是向上暴露的使用，记为节点内部的du对
+
+        :param steps: [(d, u)] 每条语句的定义和使用，同一语句中先使用后定义
+        """
+        if len(steps) == 1:
+            self._add_node(gid, code, steps[0][0], steps[0][1], is_start, is_end)
+            return
+        d = []
+        u = []
+        local = []
+        for step_d, step_u in steps:
+            for name in step_u:
+                if name in d:
+                    local.append((name, gid, gid))
+                else:
+                    u.append(name)
+            d += step_d
+        self.local_pairs.extend(dict.fromkeys(local))
+        self._add_node(gid, code, d, u, is_start, is_end)
+
+    def _add_node(self, gid, code, d, u, is_start, is_end):
+        self.index[gid] = len(self.ids)
+        self.ids.append(gid)
+        self.flags.append((START if is_start else 0) | (END if is_end else 0))
+        self.code.append('\n'.join(code))
+        # d/u去重并保持顺序
+        for names, offsets, values in ((d, self.d_offsets, self.d_vars), (u, self.u_offsets, self.u_vars)):
+            for name in dict.fromkeys(names):
+                values.append(self.intern(name))
+            offsets.append(len(values))
+
+    def intern(self, name):
+        index = self.var_index.get(name)
+        if index is None:
+            index = len(self.vars)
+            self.var_index[name] = index
+            self.vars.append(name)
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def successors(self, i):
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def out_edges(self, i):
+        """
+        :return: [(终点下标, 标签)]
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return [(self.targets[k], LABELS[self.labels[k]]) for k in range(start, end)]
+
+    def predecessors(self, i):
+        if self._preds is None:
+            self._build_preds()
+        offsets, sources = self._preds
+        return sources[offsets[i]:offsets[i + 1]]
+
+    def _build_preds(self):
+        # 计数排序建立反向CSR
+        n = len(self.ids)
+        counts = array('l', [0]) * (n + 1)
+        for t in self.targets:
+            counts[t + 1] += 1
+        for i in range(n):
+            counts[i + 1] += counts[i]
+        sources = array('l', [0]) * len(self.targets)
+        fill = array('l', counts)
+        for i in range(n):
+            for k in range(self.offsets[i], self.offsets[i + 1]):
+                t = self.targets[k]
+                sources[fill[t]] = i
+                fill[t] += 1
+        self._preds = (counts, sources)
+
+    def d(self, i):
+        return self.d_vars[self.d_offsets[i]:self.d_offsets[i + 1]]
+
+    def u(self, i):
+        return self.u_vars[self.u_offsets[i]:self.u_offsets[i + 1]]
+
+    def def_id(self, i, v):
+        """
+        :return: 节点i中变量v的定义所在的AstNode id（合并后的基本块为块中最后一个定义v的节点）
+        """
+        if self.def_sites is None:
+            return self.ids[i]
+        return self.def_sites.get((i, v), self.ids[i])
+
+    def use_ids(self, i, v):
+        """
+        :return: [AstNode id] 节点i中使用变量v（且之前没有定义v）的节点
+        """
+        if self.use_sites is None:
+            return [self.ids[i]]
+        return self.use_sites.get((i, v), [self.ids[i]])
+
+    def is_start(self, i):
+        return self.flags[i] & START != 0
+
+    def is_end(self, i):
+        return self.flags[i] & END != 0
+
+    def edges(self):
+        """
+        :return: 生成器 (起点下标, 终点下标, 标签)
+        """
+        for i in range(len(self.ids)):
+            for k in range(self.offsets[i], self.offsets[i + 1]):
+                yield i, self.targets[k], LABELS[self.labels[k]]
+
+    def node(self, i):
+        return NodeView(self, i)
+
+    def nbytes(self):
+        """
+        估算占用内存（字节）
+        """
+        size = sum(a.itemsize * len(a) for a in (self.ids, self.flags, self.offsets, self.targets, self.labels,
+                                                  self.d_offsets, self.d_vars, self.u_offsets, self.u_vars))
+        size += sum(sys.getsizeof(each) for each in self.code)
+        size += sum(sys.getsizeof(each) for each in self.vars)
+        return size
+
+
+def compact(cfg, blocks=True):
+    """
+    压缩CFG：去掉没有代码和d/u的直通节点，再把直线执行的节点序列合并为基本块
+    边重定向到去掉的节点的后继，保留True/False标签；开始、终止节点不参与合并
+
+    基本块的d为块中定义的全部变量，u为块中在定义之前被使用的变量（向上暴露的使用），
+    def_sites / use_sites 记录它们来自哪个原节点，块内部的du对记录在local_pairs中，
+    因此在压缩后的图上运行DataFlow得到的du对（节点id为原AstNode id）与压缩前相同
+
+    :param cfg: FlatCFG
+    :param blocks: 为False时只去掉空节点，不合并基本块
+    :return: FlatCFG 新图，members[i]为节点i包含的原AstNode id，index中包含全部原节点id
+    """
+    n = len(cfg)
+
+    def passes_through(i):
+        start, end = cfg.offsets[i], cfg.offsets[i + 1]
+        return (cfg.code[i] == '' and cfg.flags[i] == 0 and end - start == 1 and cfg.labels[start] == 0
+                and cfg.d_offsets[i] == cfg.d_offsets[i + 1] and cfg.u_offsets[i] == cfg.u_offsets[i + 1])
+
+    # 空节点 -> 跳过连续空节点后到达的节点，全部由空节点组成的环保留
+    resolved = list(range(n))
+    state = bytearray(n)  # 0 未处理 1 处理中 2 完成
+    for i in range(n):
+        if state[i] == 2:
+            continue
+        chain = []
+        k = i
+        while state[k] == 0 and passes_through(k):
+            state[k] = 1
+            chain.append(k)
+            k = cfg.targets[cfg.offsets[k]]
+        if state[k] == 1:
+            # 回到了本次经过的节点：空节点环，环上的节点都保留
+            final = None
+        else:
+            final = resolved[k]
+        for each in chain:
+            resolved[each] = final if final is not None else each
+            state[each] = 2
+        state[k] = 2
+    kept = [i for i in range(n) if resolved[i] == i]
+
+    # 重定向后的边
+    succs = {}
+    pred_count = [0] * n
+    for i in kept:
+        edges = []
+        for k in range(cfg.offsets[i], cfg.offsets[i + 1]):
+            t = resolved[cfg.targets[k]]
+            edges.append((t, cfg.labels[k]))
+            pred_count[t] += 1
+        succs[i] = edges
+
+    def linked(i):
+        edges = succs[i]
+        if not blocks or len(edges) != 1 or edges[0][1] != 0 or cfg.flags[i] != 0:
+            return None
+        t = edges[0][0]
+        if t == i or pred_count[t] != 1 or cfg.flags[t] != 0:
+            return None
+        return t
+
+    nexts = {i: linked(i) for i in kept}
+    has_prev = set(t for t in nexts.values() if t is not None)
+    chains = []
+    in_chain = bytearray(n)
+    for i in kept:
+        if i in has_prev:
+            continue
+        chain = [i]
+        in_chain[i] = 1
+        while nexts[chain[-1]] is not None and not in_chain[nexts[chain[-1]]]:
+            chain.append(nexts[chain[-1]])
+            in_chain[chain[-1]] = 1
+        chains.append(chain)
+    # 完全由单入单出节点组成的环，从其中下标最小的节点断开
+    for i in kept:
+        if not in_chain[i]:
+            chain = [i]
+            in_chain[i] = 1
+            while nexts[chain[-1]] is not None and not in_chain[nexts[chain[-1]]]:
+                chain.append(nexts[chain[-1]])
+                in_chain[chain[-1]] = 1
+            chains.append(chain)
+    chains.sort(key=lambda chain: chain[0])
+
+    block_of = [0] * n
+    for b, chain in enumerate(chains):
+        for i in chain:
+            block_of[i] = b
+    result = FlatCFG(cfg.name)
+    result.local_pairs = list(cfg.local_pairs)
+    result.members = []
+    result.def_sites = {}
+    result.use_sites = {}
+    for b, chain in enumerate(chains):
+        code = [cfg.code[i] for i in chain if cfg.code[i] != '']
+        defined = {}
+        d = []
+        u = []
+        use_sites = {}
+        for i in chain:
+            gid = cfg.ids[i]
+            # u为节点中向上暴露的使用，都在节点的定义之前
+            for v in cfg.u(i):
+                name = cfg.vars[v]
+                if name in defined:
+                    result.local_pairs.append((name, defined[name], gid))
+                else:
+                    if name not in use_sites:
+                        u.append(name)
+                    use_sites.setdefault(name, []).append(gid)
+            for v in cfg.d(i):
+                name = cfg.vars[v]
+                if name not in defined:
+                    d.append(name)
+                defined[name] = gid
+        head = chain[0]
+        result._add_node(cfg.ids[head], ['\n'.join(code)] if len(code) > 0 else [], d, u,
+                          cfg.is_start(head), cfg.is_end(head))
+        result.members.append([cfg.ids[i] for i in chain])
+        for name, gid in defined.items():
+            result.def_sites[(b, result.var_index[name])] = gid
+        for name, gids in use_sites.items():
+            result.use_sites[(b, result.var_index[name])] = gids
+    for b, chain in enumerate(chains):
+        for t, label in succs[chain[-1]]:
+            result.targets.append(block_of[t])
+            result.labels.append(label)
+        result.offsets.append(len(result.targets))
+    # 原节点id（包括去掉的空节点）都能找到所在的块
+    for i in range(n):
+        result.index[cfg.ids[i]] = block_of[resolved[i]]
+    return result
+
+
+class NodeView:
+    __slots__ = ('cfg', 'i')
+
+    def __init__(self, cfg, i):
+        """
+        FlatCFG节点的只读视图，属性与AstNode相同，访问时才生成列表
+        """
+        self.cfg = cfg
+        self.i = i
+
+    @property
+    def id(self):
+        return self.cfg.ids[self.i]
+
+    @property
+    def code(self):
+        code = self.cfg.code[self.i]
+        return code.split('\n') if code != '' else []
+
+    @property
+    def connectTo(self):
+        return [self.cfg.ids[t] for t in self.cfg.successors(self.i)]
+
+    @property
+    def child(self):
+        return []
+
+    @property
+    def d(self):
+        return [self.cfg.vars[v] for v in self.cfg.d(self.i)]
+
+    @property
+    def u(self):
+        return [self.cfg.vars[v] for v in self.cfg.u(self.i)]
+
+    @property
+    def isStart(self):
+        return self.cfg.is_start(self.i)
+
+    @property
+    def isEnd(self):
+        return self.cfg.is_end(self.i)
+
+    def show(self):
+        string = self.cfg.code[self.i]
+        string += "\n##############"
+        if self.cfg.members is not None and len(self.cfg.members[self.i]) > 1:
+            string += "\nid: " + ', '.join(str(each) for each in self.cfg.members[self.i])
+        else:
+            string += "\nid: " + str(self.id)
+        string += "\nd: "
+        string += ', '.join(self.d) if len(self.d) > 0 else "None"
+        string += "\nu: "
+        string += ', '.join(self.u) if len(self.u) > 0 else "None"
+        return string
@@ -1,10 +1,27 @@
-from pycparser import parse_file
-from graphviz import Digraph
-from graphviz import escape
+import hashlib
+import io
 import os
+import pickle
+import subprocess
+import tempfile
+import warnings
+
+import profiler
+
+# 预处理器可通过环境变量CPP_PATH指定，例如 C:\MinGW\bin\gcc.exe
+CPP_PATH = os.environ.get('CPP_PATH', 'gcc')
+CPP_INCLUDE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_libc_include')
+CPP_ARGS = ['-E', '-x', 'c', '-I' + CPP_INCLUDE]
+# CParser的lex/yacc表缓存目录，可通过环境变量CFG_PARSER_TABLES指定，设为空字符串时不缓存
+PARSER_TABLES = os.environ.get('CFG_PARSER_TABLES', os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'cfg-dupath'))
+
 
 class AstNode:
-    def __init__(self, gid, code=None, connectTo=None, child=None, d=None, u=None, isStart=False, isEnd=False):
+    __slots__ = ('id', 'code', 'connectTo', 'child', 'd', 'u', 'isStart', 'isEnd', 'attr', 'line', 'steps')
+
+    def __init__(self, gid, code=None, connectTo=None, child=None, d=None, u=None, isStart=False, isEnd=False,
+                 line=None, steps=None):
         """
         AsrNode 保存形式
 
@@ -16,6 +33,8 @@ class AstNode:
         :param u: 变量使用 [str]
         :param isStart: 开始节点 Bool
         :param isEnd: 终止节点 Bool
+        :param line: 源文件中的行号（节点中第一条语句），没有对应代码时为None
+        :param steps: [(d, u)] 合并的每条语句各自的定义和使用，按语句顺序；为空时整个节点视为一条语句（先使用后定义）
         """
         self.id = gid
         self.code = code if code is not None else []
@@ -25,12 +44,20 @@ class AstNode:
         self.u = u if u is not None else []
         self.isStart = isStart
         self.isEnd = isEnd
+        self.line = line
+        self.steps = steps if steps is not None else []
         # self.attr = ('id', 'code', 'connectTo', 'child', 'd', 'u', 'isStart', 'isEnd')
         self.attr = ('id', 'code', 'connectTo', 'd', 'u')
 
-    def show(self):
-        d = list(set(self.d))
-        u = list(set(self.u))
+    def show(self, names=None):
+        """
+        :param names: 把d/u中的符号id转为名称的方法（见symbols.SymbolTable.display），d/u为变量名时为None
+        """
+        d = list(dict.fromkeys(self.d))
+        u = list(dict.fromkeys(self.u))
+        if names is not None:
+            d = [names(each) for each in d]
+            u = [names(each) for each in u]
         string = "\n".join(self.code)
         string += "\n##############"
         string += "\nid: " + str(self.id)
@@ -60,105 +87,518 @@ class ConditionNode(AstNode):
         self.attr = ('id', 'code', 'connectTo', 'd', 'u', 'cond')
 
 
+class UnhandledNodeWarning(UserWarning):
+    """
+    建图时遇到暂不支持的pycparser节点，该节点按空代码处理
+    """
+
+
+def unhandled(message, pycNode):
+    """
+    以warnings报告未处理的节点（默认输出到stderr），库接口不向stdout打印
+
+    :param message: 说明
+    :param pycNode: pycparser节点
+    """
+    coord = getattr(pycNode, 'coord', None)
+    warnings.warn('%s: %s%s' % (message, pycNode.__class__.__name__, ' (%s)' % coord if coord is not None else ''),
+                  UnhandledNodeWarning, stacklevel=3)
+
+
+def _concat_u(values):
+    u = []
+    for _, each_u in values:
+        u += each_u
+    return u
+
+
+def _unary(graph, node, values):
+    inner_str, u = values[0]
+    if node.op == "p++":
+        return inner_str + "++", u
+    return node.op + inner_str, u
+
+
+def _func_call(graph, node, values):
+    string = values[0][0]
+    args = values[1:]
+    return string + '(' + ', '.join(each[0] for each in args) + ')', _concat_u(args)
+
+
+# 表达式节点类型 -> (孩子节点列表, 由孩子结果合并出(codeStr, u))
+EXPR_TABLE = {
+    'UnaryOp': (lambda n: [n.expr], _unary),
+    'BinaryOp': (lambda n: [n.left, n.right],
+                 lambda g, n, v: (v[0][0] + ' %s ' % n.op + v[1][0], v[0][1] + v[1][1])),
+    'TernaryOp': (lambda n: [n.cond, n.iftrue, n.iffalse],
+                  lambda g, n, v: ("%s ? %s : %s" % (v[0][0], v[1][0], v[2][0]), v[0][1] + v[1][1] + v[2][1])),
+    'ArrayRef': (lambda n: [n.name, n.subscript],
+                 lambda g, n, v: ("%s[%s]" % (v[0][0], v[1][0]), v[0][1] + v[1][1])),
+    'Constant': (lambda n: [], lambda g, n, v: (n.value, [])),
+    # 处理Cast的typename
+    'Cast': (lambda n: [n.expr], lambda g, n, v: ("(%s)%s" % (g.getDeclTypeAttr(n.to_type), v[0][0]), v[0][1])),
+    'InitList': (lambda n: list(n.exprs), lambda g, n, v: ("{" + ", ".join(each[0] for each in v) + "}", _concat_u(v))),
+    'ID': (lambda n: [], lambda g, n, v: (n.name, [g.symbol(n)])),
+    'NoneType': (lambda n: [], lambda g, n, v: ("", [])),
+    'FuncCall': (lambda n: [n.name] + list(n.args.exprs), _func_call),
+}
+
+
+def _ptr_decl(node, string):
+    string = string.split(' ')
+    string[-1] = '*' + string[-1]
+    return ' '.join(string)
+
+
+def _array_decl(node, string):
+    if node.dim is None:
+        return string + '[]'
+    return string + '[%s]' % node.dim.value
+
+
+def _type_decl(node, string):
+    if node.declname is not None:
+        string += ' ' + node.declname
+    return string
+
+
+# 只有一个type孩子的类型节点 -> 由内层字符串得到本层字符串
+TYPE_WRAPPERS = {
+    'TypeDecl': _type_decl,
+    'PtrDecl': _ptr_decl,
+    'ArrayDecl': _array_decl,
+    'Typename': lambda node, string: ' '.join(node.quals) + string,
+}
+
+
+class DupathBuilder:
+    __slots__ = ('rev', 'pos', 'front', 'back')
+
+    def __init__(self):
+        """
+        从后向前累加一层代码块的dupath，代替在列表头部反复插入
+        rev: {var: [...]} 倒序保存的路径
+        pos: {var: int} 变量在结果字典中的顺序，插入到前面的变量编号递减，追加到后面的变量编号递增
+        """
+        self.rev = {}
+        self.pos = {}
+        self.front = 0
+        self.back = 0
+
+    def prepend(self, path):
+        """
+        等价于 dupath = combine_dupath(path, dupath)
+        """
+        for key in reversed(list(path.keys())):
+            self.front -= 1
+            self.pos[key] = self.front
+            values = self.rev.get(key)
+            if values is None:
+                self.rev[key] = path[key][::-1]
+            else:
+                values.extend(reversed(path[key]))
+
+    def append_kind(self, kind, wrap=None):
+        """
+        wrap为None等价于 combine_same_kind_dupath(dupath, kind)，
+        wrap为tuple等价于 combine_multiple_dupath(dupath, kind)
+        """
+        for key, value in kind.items():
+            if wrap is not None:
+                value = wrap(value)
+            values = self.rev.get(key)
+            if values is None:
+                self.back += 1
+                self.pos[key] = self.back
+                self.rev[key] = [value]
+            else:
+                values.append(value)
+
+    def result(self):
+        return {key: self.rev[key][::-1] for key in sorted(self.rev, key=self.pos.__getitem__)}
+
+
+class NestedFrame:
+    __slots__ = ('node', 'end', 'otherEnd', 'returnEnd', 'continueEnd', 'child', 'connectTo', 'statement', 'dupath',
+                 'pending')
+
+    def __init__(self, node, end, otherEnd, returnEnd, continueEnd, pending=None):
+        """
+        build_nested_node中一层代码块的状态，child、connectTo、statement均为倒序
+        pending为待处理的pycparser语句，从末尾取出（即从后向前处理）
+        """
+        self.node = node
+        self.end = end
+        self.otherEnd = otherEnd
+        self.returnEnd = returnEnd
+        self.continueEnd = continueEnd
+        self.child = []
+        self.connectTo = []
+        self.statement = []
+        self.dupath = DupathBuilder()
+        self.pending = pending if pending is not None else []
+
+
+def shift_ids(node, dupath, delta, line_delta=0):
+    """
+    原地平移一个单元中所有节点id、connectTo和dupath中的id，以及节点的行号
+
+    :param node: AstNode g中的一项
+    :param dupath: du_path中对应的一项
+    :param delta: 平移量
+    :param line_delta: 行号平移量
+    """
+    if delta == 0 and line_delta == 0:
+        return
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node.id != -1:
+            node.id += delta
+        if node.line is not None:
+            node.line += line_delta
+        node.connectTo = [connect + delta for connect in node.connectTo]
+        stack.extend(node.child)
+    if delta == 0:
+        return
+    # dupath 中为嵌套的列表和元组，[id, 'd'/'u'] 可能被多处引用，只平移一次
+    seen = set()
+    stack = list(dupath.values())
+    while len(stack) > 0:
+        each = stack.pop()
+        if id(each) in seen:
+            continue
+        seen.add(id(each))
+        if len(each) > 0 and isinstance(each[0], int):
+            each[0] += delta
+        else:
+            stack.extend(each)
+
+
+def fingerprint(kind, nodeList):
+    """
+    pycparser节点的结构指纹，与节点类型、属性、孩子结构和单元内的相对行号有关，
+    单元整体移动到其他行时指纹不变
+
+    :param kind: 单元类型
+    :param nodeList: [pycparser Node]
+    :return: str
+    """
+    h = hashlib.sha256(kind.encode('utf-8'))
+    base = line_of(nodeList[0]) or 0
+    stack = [('', each) for each in reversed(nodeList)]
+    while len(stack) > 0:
+        name, node = stack.pop()
+        h.update(('(%s:%s' % (name, node.__class__.__name__)).encode('utf-8'))
+        if node.coord is not None:
+            h.update(b'@%d' % (node.coord.line - base))
+        for attr in node.attr_names:
+            h.update(('\0%r' % (getattr(node, attr),)).encode('utf-8'))
+        children = node.children()
+        h.update(b')%d' % len(children))
+        stack.extend(reversed(children))
+    return h.hexdigest()
+
+
+def unit_key(kind, nodeList, tokens=None):
+    """
+    :param tokens: scoped时单元符号的相对形式（见symbols.SymbolTable.relative），按单元中的顺序排列，
+                   结构相同但引用的符号不同的单元不共用缓存
+    :return: str 方法缓存的key
+    """
+    key = fingerprint(kind, nodeList)
+    if tokens is not None:
+        import symbols
+        key += '-' + symbols.digest(tokens)
+    return key
+
+
+def relabel_symbols(node, dupath, mapping):
+    """
+    原地替换一个单元中d/u、语句的d/u和dupath的key中的符号，不在mapping中的保持不变
+
+    :param mapping: {原符号: 新符号}
+    """
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        node.d = [mapping.get(each, each) for each in node.d]
+        node.u = [mapping.get(each, each) for each in node.u]
+        node.steps = [([mapping.get(each, each) for each in d], [mapping.get(each, each) for each in u])
+                      for d, u in node.steps]
+        stack.extend(node.child)
+    items = list(dupath.items())
+    dupath.clear()
+    for key, value in items:
+        dupath[mapping.get(key, key)] = value
+
+
+def line_of(pycNode):
+    """
+    :return: pycparser节点所在行号，没有位置信息时为None
+    """
+    coord = getattr(pycNode, 'coord', None)
+    return coord.line if coord is not None else None
+
+
+def unit_counters(nodeList, node, dupath):
+    """
+    一个单元的规模，只在启用profiler时计算
+
+    :param nodeList: [pycparser Node]
+    :param node: AstNode g中的一项
+    :param dupath: du_path中对应的一项
+    :return: {'ast_nodes', 'cfg_nodes', 'edges', 'du_entries', 'variables'}
+    """
+    ast_nodes = 0
+    stack = list(nodeList)
+    while len(stack) > 0:
+        each = stack.pop()
+        ast_nodes += 1
+        stack.extend(c for _, c in each.children())
+    cfg_nodes = 0
+    edges = 0
+    for each, each_edges in walk(node):
+        if each.id != -1:
+            cfg_nodes += 1
+        edges += len(each_edges)
+    du_entries = 0
+    seen = set()
+    stack = list(dupath.values())
+    while len(stack) > 0:
+        each = stack.pop()
+        if id(each) in seen:
+            continue
+        seen.add(id(each))
+        if len(each) > 0 and isinstance(each[0], int):
+            du_entries += 1
+        else:
+            stack.extend(each)
+    return {'ast_nodes': ast_nodes, 'cfg_nodes': cfg_nodes, 'edges': edges,
+            'du_entries': du_entries, 'variables': len(dupath)}
+
+
+def walk(node):
+    """
+    非递归遍历一个图(g中的一项)，顺序与travel_graph的绘制顺序一致
+    if节点的孩子为两个id为-1的包装节点，边带有True/False标签，包装节点中没有代码的节点不输出
+
+    :param node: AstNode 方法、全局变量或typedef节点
+    :return: 生成器 (AstNode, [(起点id, 终点id, 标签或None)])
+    """
+    stack = [node]
+    while len(stack) > 0:
+        node = stack.pop()
+        if len(node.child) == 2 and node.child[0].id == -1:
+            children = [c_stmt for c in node.child for c_stmt in c.child if len(c_stmt.code) != 0]
+            edges = [(node.id, node.connectTo[0], 'True'), (node.id, node.connectTo[1], 'False')]
+        else:
+            children = node.child
+            edges = [(node.id, connect, None) for connect in node.connectTo]
+        yield node, edges
+        stack.extend(reversed(children))
+
+
 class Graph:
-    def __init__(self, ast, name="c"):
+    def __init__(self, ast, name="c", unit_cache=None, workers=None, on_unit=None, retain=True, scoped=False):
         """
-        通过ast建立图，列表存储，并记录变量的du情况
+        通过ast建立图，列表存储，并记录变量的du情况，不打印也不绘制
         g: [AstNode] 全局变量、方法或typedef
         du_path: [{global_var: [[id,'d'/'u'], ...]}, {}] 变量声明和使用（一个字典表示一个AstNode节点）
+        units: [(类型, 名称, 结构指纹, 起始id, 节点数)] 与g一一对应
 
         :param ast: pycpaser Ast部分语句节点
         :param name: 图名称
+        :param unit_cache: cache.UnitCache 对象，只重新建立结构指纹改变的方法和全局声明
+        :param workers: 大于1时在多个进程中并行建立各个方法
+        :param on_unit: 每建立完一个单元调用 on_unit(graph, 下标)，例如 export.DuWriter.write_unit
+        :param retain: 为False时回调后不再保留该单元，g和du_path中对应项为None（不能再绘制或输出）
+        :param scoped: 为True时按词法作用域解析变量，d/u和du_path的key为符号id（见symbols.SymbolTable，
+                       保存在symbols中），不同作用域的同名变量分开计算
         """
         self.node_num = 0
         self.g = None
         self.du_path = None
+        self.units = None
         self.dot = None
         self.name = name
+        self.unit_cache = unit_cache
+        self.workers = workers
+        self.on_unit = on_unit
+        self.retain = retain
+        self.symbols = None
+        if scoped:
+            from symbols import SymbolTable
+            self.symbols = SymbolTable()
+        # 正在建立的单元中 id(pycparser节点) -> 符号id
+        self.symbol_of = None
         self.build(ast)
-        if self.g is not None:
-            self.travel_dupath()
-            for graph in self.g:
-                self.travel_graph(graph)
-            self.dot.render(os.path.join('tmp', self.name), view=True)
+
+    def render(self, directory='tmp', view=False):
+        """
+        使用graphviz绘制pdf
+
+        :param directory: 输出目录
+        :param view: 生成pdf后是否打开查看
+        :return: 生成的文件路径
+        """
+        # 只有绘制时才需要graphviz
+        from graphviz import Digraph
+        with profiler.span('render', graph=self.name):
+            self.dot = Digraph(name=self.name)
+            for index, graph in enumerate(self.g):
+                self.travel_graph(graph, index)
+            return self.dot.render(os.path.join(directory, self.name), view=view)
+
+    def local_id(self, index, gid):
+        """
+        节点在单元内的局部id（从0开始），在单元前面增删方法或全局声明时不变，
+        (单元名称, 局部id) 可以跨版本稳定地标识节点；图中的id为单元起始id加局部id
+
+        :param index: 单元下标（g中的下标）
+        :param gid: 图中的节点id
+        :return: int
+        """
+        return gid - self.units[index][3]
+
+    def to_dict(self):
+        """
+        :return: {'name': 图名称, 'graphs': [{'unit': 单元名称, 'kind': 单元类型, 'nodes': [...],
+                  'edges': [[起点, 终点, 标签]], 'du_path': {...}}]}
+                 节点的 'local' 为单元内的局部id（见local_id）
+                 scoped时另有 'symbols': [{'id', 'name', 'kind', 'line'}]
+        """
+        graphs = []
+        for index, graph in enumerate(self.g):
+            nodes = []
+            edges = []
+            base = self.units[index][3]
+            for node, node_edges in walk(graph):
+                if node.id != -1:
+                    nodes.append({'id': node.id, 'local': node.id - base, 'code': node.code, 'd': node.d,
+                                  'u': node.u, 'isStart': node.isStart, 'isEnd': node.isEnd, 'line': node.line})
+                edges.extend([list(edge) for edge in node_edges])
+            graphs.append({'unit': self.units[index][1], 'kind': self.units[index][0], 'nodes': nodes,
+                           'edges': edges, 'du_path': self.du_path[index]})
+        if self.symbols is not None:
+            return {'name': self.name, 'graphs': graphs, 'symbols': self.symbols.to_list()}
+        return {'name': self.name, 'graphs': graphs}
+
+    def flatten(self, compact=False):
+        """
+        :param compact: 是否去掉空节点并合并基本块，见flatcfg.compact
+        :return: [flatcfg.FlatCFG] 与g一一对应的扁平CFG
+        """
+        from flatcfg import FlatCFG, compact as compact_cfg
+        cfgs = [FlatCFG.from_node(graph, '%s_%d' % (self.name, index)) for index, graph in enumerate(self.g)]
+        if compact:
+            cfgs = [compact_cfg(cfg) for cfg in cfgs]
+        return cfgs
+
+    def dataflow(self, compact=False):
+        """
+        :param compact: 在压缩后的CFG上计算，du对与不压缩时相同
+        :return: [dataflow.DataFlow] 与g一一对应的到达定义、du对和活跃变量
+        """
+        from dataflow import DataFlow
+        return [DataFlow(cfg) for cfg in self.flatten(compact)]
+
+    def reachability(self, **kwargs):
+        """
+        :param kwargs: 传给reach.ReachIndex的参数，如 max_closure
+        :return: [reach.ReachIndex] 与g一一对应的可达性索引
+        """
+        from reach import ReachIndex
+        return [ReachIndex(cfg, **kwargs) for cfg in self.flatten()]
+
+    def test_paths(self, criterion='all-uses', **kwargs):
+        """
+        :param criterion: 'all-defs' / 'all-uses' / 'all-du-paths'
+        :param kwargs: 传给testpaths.TestPathGenerator的参数，如 loop_bound、max_paths
+        :return: [testpaths.TestSuite] 与g一一对应的测试路径集合和覆盖率
+        """
+        from testpaths import TestPathGenerator
+        return [TestPathGenerator(flow, **kwargs).select(criterion, self.units[index][1])
+                for index, flow in enumerate(self.dataflow())]
+
+    def iter_du_paths(self, var=None, compact=False, **kwargs):
+        """
+        逐条生成def-clear的du路径，参数见dupaths.DuPathEnumerator
+
+        :param var: 只生成该变量名的路径，None为全部变量
+        :param compact: 在压缩后的CFG上枚举，路径中间的节点为基本块的第一个节点
+        :return: 生成器 (图下标, 变量名, 定义节点id, 使用节点id, (路径节点id, ...))
+        """
+        from dupaths import DuPathEnumerator
+        for index, flow in enumerate(self.dataflow(compact)):
+            for path in DuPathEnumerator(flow, **kwargs).paths(var):
+                yield (index,) + path
 
     def travel_path(self, path):
-        tmp = []
-        for each in path:
-            name = each[0].__class__.__name__
-            if name == 'int':
+        """
+        把dupath的嵌套列表转为文本，元组写成 ( ... )，列表写成 [ ... ]
+        使用显式栈，嵌套深度不受递归深度限制
+        """
+        # 栈中每项: [列表, 下一个下标, 已生成的文本, 本层的包装格式]
+        stack = [[path, 0, [], None]]
+        while True:
+            frame = stack[-1]
+            items, i, tmp, wrap = frame
+            if i == len(items):
+                stack.pop()
+                if len(stack) == 0:
+                    return '-> '.join(tmp)
+                stack[-1][2].append(wrap % '-> '.join(tmp))
+                continue
+            frame[1] += 1
+            each = items[i]
+            if each[0].__class__.__name__ == 'int':
                 tmp.append('%d|%s' % (each[0], each[1]))
             else:
                 # 嵌套列表 或 元组
-                name = each.__class__.__name__
-                if name == 'tuple':
-                    tmp.append('( %s )' % self.travel_path(each))
-                else:
-                    tmp.append('[ %s ]' % self.travel_path(each))
-
-        return '-> '.join(tmp)
+                stack.append([each, 0, [], '( %s )' if each.__class__.__name__ == 'tuple' else '[ %s ]'])
 
     def travel_dupath(self):
-        for i in range(len(self.du_path)):
-            print('=======图%d dupath=======' % i)
-            for k, v in self.du_path[i].items():
-                print("%s:\t\t%s" % (k, self.travel_path(v)))
-            print()
-
-    def travel_graph(self, node):
-        if node.isStart is True:
-            self.dot.attr('node', shape="doublecircle")
-        if node.isEnd is True:
-            self.dot.attr('node', shape="box")
-        if node.id != -1:
-            self.dot.node(str(node.id), escape(node.show()))
-        self.dot.attr('node', shape="ellipse")
-
-        # if节点画true false
-        if len(node.child) == 2 and node.child[0].id == -1:
-            for c in node.child:
-                for c_stmt in c.child:
-                    if len(c_stmt.code) == 0:
-                        continue
-                    self.travel_graph(c_stmt)
-            self.dot.edge(str(node.id), str(node.connectTo[0]), "True")
-            self.dot.edge(str(node.id), str(node.connectTo[1]), "False")
-        else:
-            # 递归
-            for each in node.child:
-                self.travel_graph(each)
-            # 画连接线
-            for connect in node.connectTo:
-                self.dot.edge(str(node.id), str(connect))
+        with profiler.span('travel_dupath', graph=self.name):
+            for i in range(len(self.du_path)):
+                print('=======图%d dupath=======' % i)
+                for k, v in self.du_path[i].items():
+                    if self.symbols is not None:
+                        k = self.symbols.display(k)
+                    print("%s:\t\t%s" % (k, self.travel_path(v)))
+                print()
+
+    def travel_graph(self, node, index=None):
+        """
+        :param node: g中的一项
+        :param index: 单元下标，给出时节点的id属性为 单元名称:局部id（见local_id），在svg中稳定地标识节点
+        """
+        from graphviz import escape
+        for each, edges in walk(node):
+            if each.isStart is True:
+                self.dot.attr('node', shape="doublecircle")
+            if each.isEnd is True:
+                self.dot.attr('node', shape="box")
+            if each.id != -1:
+                attrs = {} if index is None else {'id': '%s:%d' % (self.units[index][1], self.local_id(index, each.id))}
+                self.dot.node(str(each.id), escape(each.show(None if self.symbols is None else self.symbols.display)),
+                              **attrs)
+            self.dot.attr('node', shape="ellipse")
+            # 画连接线，if节点画true false
+            for start, end, label in edges:
+                self.dot.edge(str(start), str(end), label)
 
 
     def getDeclTypeAttr(self, typeNode):
+        # 类型节点是一条链（TypeDecl/PtrDecl/ArrayDecl/Typename 只有一个type孩子），
+        # 先向下找到链尾的IdentifierType或Struct，再从内向外拼接，避免递归
+        chain = []
+        while typeNode.__class__.__name__ in TYPE_WRAPPERS:
+            chain.append(typeNode)
+            typeNode = typeNode.type
         node_name = typeNode.__class__.__name__
-        # FuncDecl 不做考虑
-        # TypeDecl->type:IdentifierType
-        if node_name == 'TypeDecl':
-            string = self.getDeclTypeAttr(typeNode.type)
-            if typeNode.declname is not None:
-                string += ' ' + typeNode.declname
-            return string
-        # PtrDecl->type:TypeDecl->type:IdentifierType
-        elif node_name == 'PtrDecl':
-            string = self.getDeclTypeAttr(typeNode.type)
-            string = string.split(' ')
-            string[-1] = '*' + string[-1]
-            string = ' '.join(string)
-            return string
-        elif node_name == 'ArrayDecl':
-            string = self.getDeclTypeAttr(typeNode.type)
-            if typeNode.dim is None:
-                string += '[]'
-            else:
-                string += '[%s]' % typeNode.dim.value
-            return string
-        elif node_name == 'IdentifierType':
-            return ' '.join(typeNode.names)
-        elif node_name == 'Typename':
-            return ' '.join(typeNode.quals) + self.getDeclTypeAttr(typeNode.type)
+        if node_name == 'IdentifierType':
+            string = ' '.join(typeNode.names)
         elif node_name == 'Struct':
             string = "struct %s{" % typeNode.name
             strings = []
@@ -167,79 +607,60 @@ class Graph:
                 inner_str, _, _ = self.getDecl_DU(each_decl)
                 strings.append(inner_str)
             string += '; '.join(strings) + '}'
-            return string
         else:
-            print('未处理的Decl的type属性')
-            print(typeNode)
-            return ''
+            # FuncDecl 不做考虑
+            unhandled('未处理的Decl的type属性', typeNode)
+            string = ''
+        for each in reversed(chain):
+            string = TYPE_WRAPPERS[each.__class__.__name__](each, string)
+        return string
 
     def getComputeStatement_U(self, node):
         """
-        UnaryOp(* &也算), BinaryOp, TernaryOp, ArrayRef, Constant, Cast, InitList, ID, None
+        UnaryOp(* &也算), BinaryOp, TernaryOp, ArrayRef, Constant, Cast, InitList, ID, FuncCall, None
+        按节点类型查表（EXPR_TABLE），使用显式栈后序计算，嵌套深度不受递归深度限制
 
         :param node: 节点或空节点
         :return: codeStr 和数组 u
         """
-        node_name = node.__class__.__name__
-        string = ""
-        u = []
-        if node_name == 'UnaryOp':
-            inner_str, u = self.getComputeStatement_U(node.expr)
-            if node.op == "p++":
-                string = inner_str + "++"
+        results = []
+        # 栈中为 (节点, None) 表示待展开，(节点, 孩子数) 表示孩子已计算完，待合并
+        stack = [(node, None)]
+        while len(stack) > 0:
+            node, count = stack.pop()
+            entry = EXPR_TABLE.get(node.__class__.__name__)
+            if entry is None:
+                unhandled('未处理的表达式类型', node)
+                results.append(("", []))
+                continue
+            children, combine = entry
+            if count is None:
+                sub = children(node)
+                if len(sub) > 0:
+                    stack.append((node, len(sub)))
+                    stack.extend((each, None) for each in reversed(sub))
+                    continue
+                count = 0
+            if count > 0:
+                values = results[-count:]
+                del results[-count:]
             else:
-                string = node.op + inner_str
-        elif node_name == 'BinaryOp':
-            left_str, left_u = self.getComputeStatement_U(node.left)
-            right_str, right_u = self.getComputeStatement_U(node.right)
-            string = left_str + ' %s ' % node.op + right_str
-            u = left_u + right_u
-        elif node_name == 'TernaryOp':
-            cond_str, cond_u = self.getComputeStatement_U(node.cond)
-            true_str, true_u = self.getComputeStatement_U(node.iftrue)
-            false_str, false_u = self.getComputeStatement_U(node.iffalse)
-            u = cond_u + true_u + false_u
-            string = "%s ? %s : %s" % (cond_str, true_str, false_str)
-        elif node_name == 'ArrayRef':
-            name_str, name_u = self.getComputeStatement_U(node.name)
-            sub_str, sub_u = self.getComputeStatement_U(node.subscript)
-            u = name_u + sub_u
-            string = "%s[%s]" % (name_str, sub_str)
-        elif node_name == 'Constant':
-            string = node.value
-        elif node_name == 'Cast':
-            expr_string, u = self.getComputeStatement_U(node.expr)
-            # 处理Cast的typename
-            string = "(%s)%s" % (self.getDeclTypeAttr(node.to_type), expr_string)
-        elif node_name == 'InitList':
-            string = []
-            for eachNode in node.exprs:
-                inner_str, inner_u = self.getComputeStatement_U(eachNode)
-                string.append(inner_str)
-                u += inner_u
-            string = "{" + ", ".join(string) + "}"
-        elif node_name == 'ID':
-            string = node.name
-            u = [node.name]
-        elif node_name == 'NoneType':
-            pass
-        elif node_name == "FuncCall":
-            string, _ = self.getComputeStatement_U(node.name)
-            exprlist = node.args.exprs
-            strings = []
-            for expr in exprlist:
-                expr_str, expr_u = self.getComputeStatement_U(expr)
-                u += expr_u
-                strings.append(expr_str)
-            string += '(' + ', '.join(strings) + ')'
-        else:
-            print("未处理的表达式类型")
-            print(node)
-        return string, u
+                values = []
+            results.append(combine(self, node, values))
+        return results[0]
+
+    def symbol(self, pycNode):
+        """
+        :param pycNode: ID、Decl 或 Typedef 节点
+        :return: d/u中记录的变量，scoped时为符号id，否则为变量名
+        """
+        if self.symbol_of is None:
+            return pycNode.name
+        return self.symbol_of.get(id(pycNode), pycNode.name)
 
     def getDecl_DU(self, declNode):
         # typedef如果没有声明值，就是None
-        d = [declNode.name] if declNode.name is not None else []
+        d = [self.symbol(declNode)] if declNode.name is not None else []
         string = ' '.join(declNode.storage) + ' ' if len(declNode.storage) != 0 else ''
         string += ' '.join(declNode.quals) + ' ' if len(declNode.quals) != 0 else ''
         string += self.getDeclTypeAttr(declNode.type)
@@ -272,13 +693,14 @@ class Graph:
         string = []
         d = []
         u = []
-        n = AstNode(self.node_num)
+        n = AstNode(self.node_num, line=line_of(nodeList[0]))
         self.node_num += 1
         for eachNode in nodeList:
             inner_str, inner_d, inner_u = self.getDecl_DU(eachNode)
             string.append(inner_str)
             d += inner_d
             u += inner_u
+            n.steps.append((inner_d, inner_u))
         # 完善节点
         n.code = string
         n.d = d
@@ -296,10 +718,11 @@ class Graph:
         :param nodeList: [Node] pycparser全局类型定义节点
         :return: None
         """
-        n = AstNode(self.node_num)
+        n = AstNode(self.node_num, line=line_of(nodeList[0]))
         self.node_num += 1
         for each_typedef in nodeList:
-            n.d.append(each_typedef.name)
+            n.d.append(self.symbol(each_typedef))
+            n.steps.append(([n.d[-1]], []))
             string = ' '.join(each_typedef.storage) + ' ' if len(each_typedef.storage) != 0 else ''
             string += ' '.join(each_typedef.quals) + ' ' if len(each_typedef.quals) != 0 else ''
             string += self.getDeclTypeAttr(each_typedef.type)
@@ -327,19 +750,19 @@ class Graph:
             if node_name == "Decl":
                 string, d, u = self.getDecl_DU(pycNode)
             elif node_name == "Assignment":
-                l_str, l_d = self.getComputeStatement_U(pycNode.lvalue)
-                # 总会有人嵌套Assignment
-                if pycNode.rvalue.__class__.__name__ == "Assignment":
-                    tmpNode = AstNode(-1)
-                    tmpNode, _= self.build_statement([pycNode.rvalue], tmpNode)
-                    r_str = tmpNode.code[0]
-                    r_u = tmpNode.u
-                else:
-                    r_str, r_u = self.getComputeStatement_U(pycNode.rvalue)
-                d = [l_d[0]] if len(l_d) > 0 else []
-                u = l_d[1:] if len(l_d) > 1 else []
-                u += r_u
-                string = l_str + ' ' + pycNode.op + ' ' + r_str
+                # 总会有人嵌套Assignment，a = b = c 从内向外合并，内层的d不计入
+                chain = [pycNode]
+                while chain[-1].rvalue.__class__.__name__ == "Assignment":
+                    chain.append(chain[-1].rvalue)
+                lefts = [self.getComputeStatement_U(each.lvalue) for each in chain]
+                r_str, r_u = self.getComputeStatement_U(chain[-1].rvalue)
+                for each, (l_str, l_d) in zip(reversed(chain), reversed(lefts)):
+                    d = [l_d[0]] if len(l_d) > 0 else []
+                    u = l_d[1:] if len(l_d) > 1 else []
+                    u += r_u
+                    r_str = l_str + ' ' + each.op + ' ' + r_str
+                    r_u = u
+                string = r_str
             elif node_name == "FuncCall":
                 string, _ = self.getComputeStatement_U(pycNode.name)
                 exprlist = pycNode.args.exprs
@@ -354,12 +777,12 @@ class Graph:
             elif node_name in ('UnaryOp', 'BinaryOp', 'TernaryOp'):
                 string, u = self.getComputeStatement_U(pycNode)
             else:
-                print('未处理的statement')
-                print(pycNode)
+                unhandled('未处理的statement', pycNode)
             # 保存数据，还原dupath
             astn.code.append(string)
             astn.d += d
             astn.u += u
+            astn.steps.append((d, u))
 
         # 计算du路径
         dupath = self.combine_du_to_dict(astn.id, d=d, u=u)
@@ -369,6 +792,8 @@ class Graph:
     def build_nested_node(self, node, children, end, otherEnd=None, returnEnd=None, continueEnd=None):
         """
         建立带有内部嵌套节点的 child属性 （这里忽略Goto、Label）
+        每一层嵌套由nested_frame生成器处理，需要建立内层节点时yield参数，
+        这里用显式栈驱动各层生成器，嵌套深度不受递归深度限制
 
         :param node: AstNode对象
         :param children: AstNode对象的孩子节点
@@ -379,318 +804,319 @@ class Graph:
         :return node: AstNode 对象
         :return dupath: {var: [id, 'd'/'u'], ...} du-path
         """
-        dupath = {}
-        special_node_name = ('Switch', 'Case', 'Default', 'If', 'DoWhile',
-                             'While', 'For', 'Break', 'Continue', 'Return')
-        statement = []
+        stack = [self.nested_frame(node, children, end, otherEnd, returnEnd, continueEnd)]
+        result = None
+        while len(stack) > 0:
+            try:
+                request = stack[-1].send(result)
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+                continue
+            stack.append(self.nested_frame(*request))
+            result = None
+        return result
+
+    def nested_frame(self, node, children, end, otherEnd, returnEnd, continueEnd):
+        """
+        处理一层代码块：从后向前遍历children，按节点类型查表（NESTED_TABLE）分发，
+        普通statement先收集，遇到特殊节点时合并为一个节点
+        孩子节点、连接和dupath都先倒序追加，结束时再还原顺序
 
+        :return: 生成器，yield (node, children, end, otherEnd, returnEnd, continueEnd)，结束时返回 (node, dupath)
+        """
         # 无子节点，添加空节点
         if children is None:
             n = AstNode(self.node_num, connectTo=[end.id])
             self.node_num += 1
             node.child.insert(0, n)
-            return node, dupath
-
-        for i in range(len(children)-1,-1,-1):
-            nodename = children[i].__class__.__name__
-
-            # 处理statement代码段
-            if nodename in special_node_name and len(statement) > 0:
-                n = AstNode(gid=self.node_num, connectTo=[end.id])
-                self.node_num += 1
-                # 完善子节点，并把节点添加到child，合并path
-                n, path = self.build_statement(statement, n)
-                node.child.insert(0, n)
-                # 从后向前添加dupath，所以是dupath = path <- dupath
-                dupath = self.combine_dupath(path, dupath)
-                # 维护计算后的结果
-                statement = []
-                end = n
-
-            # 1. Switch及其子节点
-            if nodename == 'Switch':
-                # 建立节点
-                n = AstNode(self.node_num)
-                self.node_num += 1
-                # 获取switch条件，计算dupath
-                cond_str, cond_u = self.getComputeStatement_U(children[i].cond)
-                n.code = ['switch(%s)' % cond_str]
-                n.u = cond_u
-                switch_dupath = self.combine_du_to_dict(n.id, u=n.u)
-                # 从后向前添加
-                dupath = self.combine_dupath(switch_dupath, dupath)
-
-                # 节点加入条件 和 子节点的dupath
-                n, stmt_path = self.build_nested_node(n, children[i].stmt.block_items, end, otherEnd=end, returnEnd=returnEnd)
-                # n.connectTo.insert(0, n.child[0].id) # switch不仅链接此节点
-
-                # 添加多孩子节点
-                dupath = self.combine_multiple_dupath(dupath, stmt_path)
-                node.child.insert(0, n)
-                # print(n.code, n.id, n.connectTo)
-                # for each in n.child:
-                #     print(each.code, each.id, each.connectTo)
-
-            elif nodename == 'Case':
-                # 父节点是 Switch（该节点不需要设置connectTo）
-                n = AstNode(self.node_num)
-                self.node_num += 1
-                # 获取条件的字符串和u
-                expr_str, expr_u = self.getComputeStatement_U(children[i].expr)
-                n.code.append('case %s :' % expr_str)
-                n.u = expr_u
-                case_dupath = self.combine_du_to_dict(n.id, n.u)
-
-                # 整理子节点，合并du路径
-                n, stmt_dupath = self.build_nested_node(n, children[i].stmts, end, otherEnd, returnEnd)
-                n.connectTo.append(n.child[0].id)
-                # 添加
-                case_dupath = self.combine_dupath(case_dupath, stmt_dupath)
-                dupath = self.combine_same_kind_dupath(dupath, case_dupath)
-                node.child.insert(0, n)
-                node.connectTo.insert(0, n.id)
-                # 更新end
-                end = n.child[0]
-                # print(n.code, n.id, n.connectTo)
-                # for each in n.child:
-                #     print(each.code, each.id, each.connectTo)
-
-            elif nodename == 'Default':
-                # 父节点是 Switch（该节点不需要设置connectTo）
-                n = AstNode(self.node_num)
-                self.node_num += 1
-                # 添加条件
-                n.code.append('default :')
-
-                # 整理子节点，合并du路径
-                n, default_dupath = self.build_nested_node(n, children[i].stmts, end, otherEnd, returnEnd)
-                n.connectTo.append(n.child[0].id)
-                # 添加
-                dupath = self.combine_same_kind_dupath(dupath, default_dupath)
-                node.child.insert(0, n)
-                node.connectTo.insert(0, n.id)
-                # 更新end
-                end = n.child[0]
-                # print(n.code, n.id, n.connectTo)
-                # for each in n.child:
-                #     print(each.code, each.id, each.connectTo)
-
-            # 2. 条件节点
-            elif nodename == 'If':
-                # 该节点有iftrue和iffalse，两者可取：None, EmptyStatement, Compound, If
-                n = AstNode(self.node_num)
-                self.node_num += 1
-                # 建立条件节点
-                cond_str, cond_u = self.getComputeStatement_U(children[i].cond)
-                n.code.append("if(%s)" % cond_str)
-                n.u = cond_u
-                # 先添加孩子的节点，再添加父节点的dupath
-                cond_dupath = self.combine_du_to_dict(n.id, u=n.u)
-
-                # 建立孩子节点    0: iftrue 1: iffalse if的child形式为 [AstNode1, AstNode2]
-                if_child_dupath = {}
-                child_list = [children[i].iftrue, children[i].iffalse]
-                for each_child in child_list:
-                    child_name = each_child.__class__.__name__
-                    tmp = None
-                    child_n = AstNode(-1)
-                    if child_name == "Compound":
-                        tmp = each_child.block_items
-                    elif child_name != "NoneType":
-                        tmp = [each_child]
-                    child_n, child_dupath = self.build_nested_node(child_n, tmp, end, returnEnd=returnEnd)
-                    if_child_dupath = self.combine_same_kind_dupath(if_child_dupath, child_dupath)
-                    # 添加孩子节点
-                    n.child.append(child_n)
-                    if tmp is None:
-                        n.connectTo.append(end.id)
-                    else:
-                        n.connectTo.append(child_n.child[0].id)
-                dupath = self.combine_multiple_dupath(dupath, if_child_dupath)
-                dupath = self.combine_dupath(cond_dupath, dupath)
-
-                # 添加到主节点中
-                node.child.insert(0, n)
-                end = n
-                # print(n.code, n.connectTo)
-                # for e in n.child:
-                #     for each in e.child:
-                #         print(each.code, each.id, each.connectTo)
-
-            # 作为普通表达式来看
-            # elif nodename == 'TernaryOp':
-            #     pass
-
-            # 3. 循环节点
-            elif nodename == 'DoWhile':
-                # 建立节点，获取条件节点的u
-                n = AstNode(self.node_num)
-                self.node_num += 1
-                cond_str, cond_u = self.getComputeStatement_U(children[i].cond)
-                n.code = ["do{ ... } while(%s)" % cond_str]
-                n.u = cond_u
-                # 先添加到dupath中
-                dowhile_dupath = self.combine_du_to_dict(n.id, u=n.u)
-                dupath = self.combine_dupath(dowhile_dupath, dupath)
-
-                # 该节点配置：connectTo: 0True 1False
-                # 配置False节点
-                n.connectTo.insert(0, end.id)
-                # 扩充stmt子节点
-                tmp = None
-                if children[i].stmt.__class__.__name__ == "Compound":
-                    tmp = children[i].stmt.block_items
-                n, stmt_path = self.build_nested_node(n, tmp, n, end, returnEnd, n)
-                # 配置True节点
-                n.connectTo.insert(0, n.child[0].id)
-                # 循环体dupath，先扩展成列表形式，再添加到主节点中
-                stmt_dupath = self.combine_same_kind_dupath({},stmt_path)
-                dupath = self.combine_dupath(stmt_dupath, dupath)
-
-                # 维护
-                node.child.insert(0, n)
-                end = n.child[0]
-                # print(n.code, n.id, n.connectTo)
-                # for each in n.child:
-                #     print(each.code, each.id, each.connectTo)
-
-            elif nodename == 'While':
-                n = AstNode(self.node_num, connectTo=[end.id])
-                self.node_num += 1
-                # 获取while的条件和u
-                cond_str, cond_u = self.getComputeStatement_U(children[i].cond)
-                n.code = ["while (%s)" % cond_str]
-                n.u = cond_u
-                # 后添加到dupath中
-                while_dupath = self.combine_du_to_dict(n.id, u=n.u)
-
-                # 获取节点信息
-                tmp = None
-                if children[i].stmt.__class__.__name__ == "Compound":
-                    tmp = children[i].stmt.block_items
-                n, stmt_path = self.build_nested_node(n, tmp, n, end, returnEnd, n)
-                # 配置True节点
-                n.connectTo.insert(0, n.child[0].id)
-                # 循环体dupath，先扩展成列表形式，再添加到主节点中
-                stmt_dupath = self.combine_same_kind_dupath({},stmt_path)
-                dupath = self.combine_dupath(stmt_dupath, dupath)
-                dupath = self.combine_dupath(while_dupath, dupath)
-
-                # 维护
-                node.child.insert(0, n)
-                end = n # Dowhile不同之处
-                # print(n.code, n.id, n.connectTo)
-                # for each in n.child:
-                #     print(each.code, each.id, each.connectTo)
-
-            elif nodename == 'For':
-                n = AstNode(self.node_num, connectTo=[end.id])
-                self.node_num += 1
-                init_str = ""
-                cond_str = ""
-                next_str = ""
-                # For的init属性是DeclList或Assignment或None
-                if children[i].init.__class__.__name__ == "DeclList":
-                    strings = []
-                    d = []
-                    u = []
-                    for each_decl in children[i].init.decls:
-                        decl_str, decl_d, decl_u = self.getDecl_DU(each_decl)
-                        strings.append(decl_str)
-                        d += decl_d
-                        u += decl_u
-                    n.d = d
-                    n.u = u
-                    init_str = ", ".join(strings)
-                elif children[i].init.__class__.__name__ == "Assignment":
-                    tmpNode = AstNode(-1)
-                    tmpNode, _ = self.build_statement([children[i].init], tmpNode)
-                    init_str = tmpNode.code[0]
-                    n.u = tmpNode.u
-                # For的cond属性
-                if children[i].cond is not None:
-                    cond_str, cond_u = self.getComputeStatement_U(children[i].cond)
-                    n.u += cond_u
-                # For的next属性
-                if children[i].next is not None:
-                    next_str, next_u = self.getComputeStatement_U(children[i].next)
-                    n.u += next_u
-                n.code.append("for(%s;%s;%s)" % (init_str, cond_str, next_str))
-                for_dupath = self.combine_du_to_dict(n.id, d=n.d, u=n.u)
-
-                # 完善stmt孩子节点
-                tmp = None
-                stmt_name = children[i].stmt.__class__.__name__
-                if stmt_name == "Compound":
-                    tmp = children[i].stmt.block_items
-                elif stmt_name != "NoneType":
-                    tmp = [children[i].stmt]
-                n, stmt_path = self.build_nested_node(n, tmp, n, end, returnEnd, n)
-
-                n.connectTo.insert(0, n.child[0].id)
-                # 循环体dupath，先扩展成列表形式，再添加到主节点中
-                stmt_dupath = self.combine_same_kind_dupath({},stmt_path)
-                dupath = self.combine_dupath(stmt_dupath, dupath)
-                dupath = self.combine_dupath(for_dupath, dupath)
-                # 维护节点
-                node.child.insert(0, n)
-                end = n
-                # print(n.code, n.id, n.connectTo)
-                # for each in n.child:
-                #     print(each.code, each.id, each.connectTo)
-
-            # 4. 特殊节点
-            elif nodename == 'Break':
-                n = AstNode(self.node_num, code=["break"])
-                self.node_num += 1
-                # otherEnd > end
-                if otherEnd is not None:
-                    n.connectTo.append(otherEnd.id)
-                else:
-                    n.connectTo.append(end.id)
-                # 维护节点
-                node.child.insert(0, n)
-                end = n
-
-            elif nodename == 'Continue':
-                n = AstNode(self.node_num, code=["continue"], connectTo=[continueEnd.id])
-                self.node_num += 1
-                # 维护节点
-                node.child.insert(0, n)
-                end = n
-
-            elif nodename == 'Return':
-                n = AstNode(self.node_num, connectTo=[returnEnd.id])
-                self.node_num += 1
-                expr_str, expr_u = self.getComputeStatement_U(children[i].expr)
-                n.u = expr_u
-                n.code.append("return %s" % expr_str)
-                # 维护节点
-                return_dupath = self.combine_du_to_dict(n.id, u=n.u)
-                dupath = self.combine_dupath(return_dupath, dupath)
-                node.child.insert(0, n)
-                end = n
-
+            return node, {}
 
+        frame = NestedFrame(node, end, otherEnd, returnEnd, continueEnd, list(children))
+        while len(frame.pending) > 0:
+            stmt = frame.pending.pop()
+            handler = NESTED_TABLE.get(stmt.__class__.__name__)
             # 5. 普通的数据流节点
-            else:
-                statement.insert(0, children[i])
+            if handler is None:
+                frame.statement.append(stmt)
+                continue
+            # 处理statement代码段
+            if len(frame.statement) > 0:
+                self.nested_statement(frame)
+            count = len(frame.child)
+            nested = handler(self, frame, stmt)
+            if nested is not None:
+                yield from nested
+            # 处理函数最后把该语句的节点添加到child
+            if len(frame.child) > count:
+                frame.child[-1].line = line_of(stmt)
 
         # 维护循环结束后的节点
-        if len(statement) > 0:
-            n = AstNode(gid=self.node_num, connectTo=[end.id])
-            self.node_num += 1
-            # 完善子节点，并把节点添加到child，合并path
-            n, path = self.build_statement(statement, n)
-            node.child.insert(0, n)
-            dupath = self.combine_dupath(path, dupath)
+        if len(frame.statement) > 0:
+            self.nested_statement(frame)
+        node.child[:0] = frame.child[::-1]
+        node.connectTo[:0] = frame.connectTo[::-1]
 
         # 如果child代码块为空，添加空节点
         if len(node.child) == 0:
-            n = AstNode(self.node_num, connectTo=[end.id])
+            n = AstNode(self.node_num, connectTo=[frame.end.id])
             self.node_num += 1
             node.child.insert(0, n)
-        return node, dupath
+        return node, frame.dupath.result()
+
+    def nested_statement(self, frame):
+        n = AstNode(gid=self.node_num, connectTo=[frame.end.id], line=line_of(frame.statement[-1]))
+        self.node_num += 1
+        # 完善子节点，并把节点添加到child，合并path
+        n, path = self.build_statement(frame.statement[::-1], n)
+        frame.child.append(n)
+        # 从后向前添加dupath，所以是dupath = path <- dupath
+        frame.dupath.prepend(path)
+        # 维护计算后的结果
+        frame.statement = []
+        frame.end = n
+
+    # 1. Switch及其子节点
+    def nested_switch(self, frame, stmt):
+        # 建立节点
+        n = AstNode(self.node_num)
+        self.node_num += 1
+        # 获取switch条件，计算dupath
+        cond_str, cond_u = self.getComputeStatement_U(stmt.cond)
+        n.code = ['switch(%s)' % cond_str]
+        n.u = cond_u
+        switch_dupath = self.combine_du_to_dict(n.id, u=n.u)
+        # 从后向前添加
+        frame.dupath.prepend(switch_dupath)
+
+        # 节点加入条件 和 子节点的dupath
+        n, stmt_path = yield n, stmt.stmt.block_items, frame.end, frame.end, frame.returnEnd, None
+        # n.connectTo.insert(0, n.child[0].id) # switch不仅链接此节点
+
+        # 添加多孩子节点
+        frame.dupath.append_kind(stmt_path, tuple)
+        frame.child.append(n)
+
+    def nested_case(self, frame, stmt):
+        # 父节点是 Switch（该节点不需要设置connectTo）
+        n = AstNode(self.node_num)
+        self.node_num += 1
+        # 获取条件的字符串和u
+        expr_str, expr_u = self.getComputeStatement_U(stmt.expr)
+        n.code.append('case %s :' % expr_str)
+        n.u = expr_u
+        case_dupath = self.combine_du_to_dict(n.id, n.u)
+
+        # 整理子节点，合并du路径
+        n, stmt_dupath = yield n, stmt.stmts, frame.end, frame.otherEnd, frame.returnEnd, None
+        n.connectTo.append(n.child[0].id)
+        # 添加
+        case_dupath = self.combine_dupath(case_dupath, stmt_dupath)
+        frame.dupath.append_kind(case_dupath)
+        frame.child.append(n)
+        frame.connectTo.append(n.id)
+        # 更新end
+        frame.end = n.child[0]
+
+    def nested_default(self, frame, stmt):
+        # 父节点是 Switch（该节点不需要设置connectTo）
+        n = AstNode(self.node_num)
+        self.node_num += 1
+        # 添加条件
+        n.code.append('default :')
+
+        # 整理子节点，合并du路径
+        n, default_dupath = yield n, stmt.stmts, frame.end, frame.otherEnd, frame.returnEnd, None
+        n.connectTo.append(n.child[0].id)
+        # 添加
+        frame.dupath.append_kind(default_dupath)
+        frame.child.append(n)
+        frame.connectTo.append(n.id)
+        # 更新end
+        frame.end = n.child[0]
+
+    # 2. 条件节点
+    def nested_if(self, frame, stmt):
+        # 该节点有iftrue和iffalse，两者可取：None, EmptyStatement, Compound, If
+        n = AstNode(self.node_num)
+        self.node_num += 1
+        # 建立条件节点
+        cond_str, cond_u = self.getComputeStatement_U(stmt.cond)
+        n.code.append("if(%s)" % cond_str)
+        n.u = cond_u
+        # 先添加孩子的节点，再添加父节点的dupath
+        cond_dupath = self.combine_du_to_dict(n.id, u=n.u)
+
+        # 建立孩子节点    0: iftrue 1: iffalse if的child形式为 [AstNode1, AstNode2]
+        if_child_dupath = {}
+        for each_child in (stmt.iftrue, stmt.iffalse):
+            child_name = each_child.__class__.__name__
+            tmp = None
+            child_n = AstNode(-1)
+            if child_name == "Compound":
+                tmp = each_child.block_items
+            elif child_name != "NoneType":
+                tmp = [each_child]
+            child_n, child_dupath = yield child_n, tmp, frame.end, None, frame.returnEnd, None
+            if_child_dupath = self.combine_same_kind_dupath(if_child_dupath, child_dupath)
+            # 添加孩子节点
+            n.child.append(child_n)
+            if tmp is None:
+                n.connectTo.append(frame.end.id)
+            else:
+                n.connectTo.append(child_n.child[0].id)
+        frame.dupath.append_kind(if_child_dupath, tuple)
+        frame.dupath.prepend(cond_dupath)
+
+        # 添加到主节点中
+        frame.child.append(n)
+        frame.end = n
+
+    # 3. 循环节点
+    def nested_do_while(self, frame, stmt):
+        # 建立节点，获取条件节点的u
+        n = AstNode(self.node_num)
+        self.node_num += 1
+        cond_str, cond_u = self.getComputeStatement_U(stmt.cond)
+        n.code = ["do{ ... } while(%s)" % cond_str]
+        n.u = cond_u
+        # 先添加到dupath中
+        dowhile_dupath = self.combine_du_to_dict(n.id, u=n.u)
+        frame.dupath.prepend(dowhile_dupath)
+
+        # 该节点配置：connectTo: 0True 1False
+        # 配置False节点
+        n.connectTo.insert(0, frame.end.id)
+        # 扩充stmt子节点
+        tmp = None
+        if stmt.stmt.__class__.__name__ == "Compound":
+            tmp = stmt.stmt.block_items
+        n, stmt_path = yield n, tmp, n, frame.end, frame.returnEnd, n
+        # 配置True节点
+        n.connectTo.insert(0, n.child[0].id)
+        # 循环体dupath，先扩展成列表形式，再添加到主节点中
+        stmt_dupath = self.combine_same_kind_dupath({}, stmt_path)
+        frame.dupath.prepend(stmt_dupath)
+
+        # 维护
+        frame.child.append(n)
+        frame.end = n.child[0]
+
+    def nested_while(self, frame, stmt):
+        n = AstNode(self.node_num, connectTo=[frame.end.id])
+        self.node_num += 1
+        # 获取while的条件和u
+        cond_str, cond_u = self.getComputeStatement_U(stmt.cond)
+        n.code = ["while (%s)" % cond_str]
+        n.u = cond_u
+        # 后添加到dupath中
+        while_dupath = self.combine_du_to_dict(n.id, u=n.u)
+
+        # 获取节点信息
+        tmp = None
+        if stmt.stmt.__class__.__name__ == "Compound":
+            tmp = stmt.stmt.block_items
+        n, stmt_path = yield n, tmp, n, frame.end, frame.returnEnd, n
+        # 配置True节点
+        n.connectTo.insert(0, n.child[0].id)
+        # 循环体dupath，先扩展成列表形式，再添加到主节点中
+        stmt_dupath = self.combine_same_kind_dupath({}, stmt_path)
+        frame.dupath.prepend(stmt_dupath)
+        frame.dupath.prepend(while_dupath)
+
+        # 维护
+        frame.child.append(n)
+        frame.end = n # Dowhile不同之处
+
+    def nested_for(self, frame, stmt):
+        n = AstNode(self.node_num, connectTo=[frame.end.id])
+        self.node_num += 1
+        init_str = ""
+        cond_str = ""
+        next_str = ""
+        # For的init属性是DeclList或Assignment或None
+        if stmt.init.__class__.__name__ == "DeclList":
+            strings = []
+            d = []
+            u = []
+            for each_decl in stmt.init.decls:
+                decl_str, decl_d, decl_u = self.getDecl_DU(each_decl)
+                strings.append(decl_str)
+                d += decl_d
+                u += decl_u
+            n.d = d
+            n.u = u
+            init_str = ", ".join(strings)
+        elif stmt.init.__class__.__name__ == "Assignment":
+            tmpNode = AstNode(-1)
+            tmpNode, _ = self.build_statement([stmt.init], tmpNode)
+            init_str = tmpNode.code[0]
+            n.u = tmpNode.u
+        # For的cond属性
+        if stmt.cond is not None:
+            cond_str, cond_u = self.getComputeStatement_U(stmt.cond)
+            n.u += cond_u
+        # For的next属性
+        if stmt.next is not None:
+            next_str, next_u = self.getComputeStatement_U(stmt.next)
+            n.u += next_u
+        n.code.append("for(%s;%s;%s)" % (init_str, cond_str, next_str))
+        for_dupath = self.combine_du_to_dict(n.id, d=n.d, u=n.u)
+
+        # 完善stmt孩子节点
+        tmp = None
+        stmt_name = stmt.stmt.__class__.__name__
+        if stmt_name == "Compound":
+            tmp = stmt.stmt.block_items
+        elif stmt_name != "NoneType":
+            tmp = [stmt.stmt]
+        n, stmt_path = yield n, tmp, n, frame.end, frame.returnEnd, n
+
+        n.connectTo.insert(0, n.child[0].id)
+        # 循环体dupath，先扩展成列表形式，再添加到主节点中
+        stmt_dupath = self.combine_same_kind_dupath({}, stmt_path)
+        frame.dupath.prepend(stmt_dupath)
+        frame.dupath.prepend(for_dupath)
+        # 维护节点
+        frame.child.append(n)
+        frame.end = n
+
+    # 4. 特殊节点
+    def nested_break(self, frame, stmt):
+        n = AstNode(self.node_num, code=["break"])
+        self.node_num += 1
+        # otherEnd > end
+        if frame.otherEnd is not None:
+            n.connectTo.append(frame.otherEnd.id)
+        else:
+            n.connectTo.append(frame.end.id)
+        # 维护节点
+        frame.child.append(n)
+        frame.end = n
+
+    def nested_continue(self, frame, stmt):
+        n = AstNode(self.node_num, code=["continue"], connectTo=[frame.continueEnd.id])
+        self.node_num += 1
+        # 维护节点
+        frame.child.append(n)
+        frame.end = n
+
+    def nested_return(self, frame, stmt):
+        n = AstNode(self.node_num, connectTo=[frame.returnEnd.id])
+        self.node_num += 1
+        expr_str, expr_u = self.getComputeStatement_U(stmt.expr)
+        n.u = expr_u
+        n.code.append("return %s" % expr_str)
+        # 维护节点
+        return_dupath = self.combine_du_to_dict(n.id, u=n.u)
+        frame.dupath.prepend(return_dupath)
+        frame.child.append(n)
+        frame.end = n
+
+    # 6. 嵌套的代码块 { ... }，语句展开到当前层继续处理，块内声明的变量按语句记入d/u
+    def nested_compound(self, frame, stmt):
+        if stmt.block_items is not None:
+            frame.pending.extend(stmt.block_items)
 
     def combine_same_kind_dupath(self, dupath, kind):
         # 注意：这是把kind的属性值添加到dupath列表中
@@ -710,8 +1136,9 @@ class Graph:
         return dupath
 
     def combine_du_to_dict(self, uid, d=[], u=[]):
-        d = list(set(d))
-        u = list(set(u))
+        # 去重并保持出现顺序，使不同进程中的结果一致
+        d = list(dict.fromkeys(d))
+        u = list(dict.fromkeys(u))
         dic = {each_d: [[uid, 'd']] for each_d in d}
         for each_u in u:
             if each_u in dic:
@@ -746,12 +1173,168 @@ class Graph:
                 return last_c
 
 
+    def build_unit(self, kind, nodeList, ids=None):
+        """
+        建立一组全局变量、一组typedef或一个方法，添加到g和dupath，并记录到units
+        使用unit_cache时，单元内的节点id从0开始分配（局部id）并按结构指纹缓存，
+        加上单元的起始id(base)即为图中的id，指纹未变的单元直接取缓存平移id，
+        缓存中同时保存单元的起始行号，单元移动到其他行时平移节点行号
+        scoped时缓存中的d/u为符号的相对形式（见symbols.SymbolTable.relative），取出时换回当前的符号id，
+        指纹后附加相对形式的摘要，前面增加全局变量或方法使符号id整体改变时仍然命中
+
+        :param kind: 'decl' / 'typedef' / 'func'
+        :param nodeList: [pycparser Node]
+        :param ids: 已解析的单元符号id（见symbols.SymbolTable.resolve），scoped时为None则在这里解析
+        :return: None
+        """
+        with profiler.span('build_unit', kind=kind) as args:
+            base = self.node_num
+            key = None
+            cached = None
+            if ids is None and self.symbols is not None:
+                self.symbol_of = {}
+                ids = self.symbols.resolve(nodeList, self.symbol_of)
+            elif ids is not None:
+                import symbols
+                self.symbol_of = symbols.bind(nodeList, ids)
+            if self.unit_cache is not None:
+                key, relative = self.cache_key(kind, nodeList, ids)
+                cached = self.get_cached(key, relative)
+            if cached is not None:
+                astn, dupath, count, line = cached
+                shift_ids(astn, dupath, base, (line_of(nodeList[0]) or 0) - line)
+                self.g.append(astn)
+                self.du_path.append(dupath)
+            else:
+                if key is not None:
+                    self.node_num = 0
+                if kind == 'decl':
+                    self.build_decl(nodeList)
+                elif kind == 'typedef':
+                    self.build_typedef(nodeList)
+                else:
+                    self.build(nodeList[0])
+                if key is not None:
+                    count = self.node_num
+                    self.put_cached(key, relative, (self.g[-1], self.du_path[-1], count, line_of(nodeList[0]) or 0))
+                    shift_ids(self.g[-1], self.du_path[-1], base)
+                else:
+                    count = self.node_num - base
+            self.symbol_of = None
+            self.add_unit(kind, nodeList, key, base, count)
+            if profiler.enabled():
+                args['unit'] = self.units[-1][1]
+                args['cached'] = cached is not None
+                args.update(unit_counters(nodeList, self.g[-1], self.du_path[-1]))
+        self.flush_unit()
+
+    def build_parallel(self, units, workers):
+        """
+        在多个进程中建立单元，每个进程使用从0开始的局部id，
+        之后按原顺序平移id并合并，结果与顺序建立相同
+
+        :param units: [(类型, [pycparser Node])]
+        :param workers: 进程数
+        :return: None
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        keys = [None] * len(units)
+        relatives = [None] * len(units)
+        hits = [False] * len(units)
+        # 符号表需要按顺序解析，在主进程中完成，子进程只对应回节点
+        if self.symbols is not None:
+            units = [(kind, nodeList, self.symbols.resolve(nodeList)) for kind, nodeList in units]
+        else:
+            units = [(kind, nodeList, None) for kind, nodeList in units]
+        if self.unit_cache is not None:
+            for i, (kind, nodeList, ids) in enumerate(units):
+                keys[i], relatives[i] = self.cache_key(kind, nodeList, ids)
+                hits[i] = self.unit_cache.has_unit(keys[i])
+        pending = [i for i in range(len(units)) if not hits[i]]
+        executor = ProcessPoolExecutor(max_workers=workers) if len(pending) > 0 else None
+        try:
+            with profiler.span('build_parallel', units=len(pending), workers=workers):
+                # map按提交顺序返回结果，每个单元轮到时立即合并并交给on_unit，不等待全部单元完成
+                built = iter(())
+                if executor is not None:
+                    # 子进程中的build_unit等事件随结果返回，合并到当前进程的profiler
+                    built = executor.map(_build_in_worker, [units[i] for i in pending],
+                                         [profiler.enabled()] * len(pending),
+                                         chunksize=max(1, len(pending) // (workers * 4)))
+                for i, (kind, nodeList, _) in enumerate(units):
+                    if hits[i]:
+                        result = self.get_cached(keys[i], relatives[i])
+                    else:
+                        result, events = next(built)
+                        if profiler.enabled():
+                            profiler.current().merge(events)
+                    if result is None:
+                        # 缓存文件在检查之后被淘汰
+                        result = build_local_unit(units[i])
+                    if keys[i] is not None and not hits[i]:
+                        self.put_cached(keys[i], relatives[i], result)
+                    astn, dupath, count, line = result
+                    base = self.node_num
+                    shift_ids(astn, dupath, base, (line_of(nodeList[0]) or 0) - line)
+                    self.g.append(astn)
+                    self.du_path.append(dupath)
+                    self.add_unit(kind, nodeList, keys[i], base, count)
+                    self.flush_unit()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def cache_key(self, kind, nodeList, ids):
+        """
+        :return: (单元缓存的key, scoped时符号id到相对形式的对应 否则为None)
+        """
+        if ids is None or self.symbols is None:
+            return unit_key(kind, nodeList), None
+        relative = self.symbols.relative(ids)
+        return unit_key(kind, nodeList, [relative[each] for each in ids]), relative
+
+    def get_cached(self, key, relative):
+        cached = self.unit_cache.get_unit(key)
+        if cached is not None and relative is not None:
+            relabel_symbols(cached[0], cached[1], {token: sid for sid, token in relative.items()})
+        return cached
+
+    def put_cached(self, key, relative, unit):
+        # 缓存中保存相对形式，写入后换回符号id
+        if relative is not None:
+            relabel_symbols(unit[0], unit[1], relative)
+        self.unit_cache.put_unit(key, unit)
+        if relative is not None:
+            relabel_symbols(unit[0], unit[1], {token: sid for sid, token in relative.items()})
+
+    def flush_unit(self):
+        """
+        把刚建立的单元交给on_unit，retain为False时释放该单元
+        """
+        if self.on_unit is None:
+            return
+        index = len(self.g) - 1
+        with profiler.span('on_unit', unit=self.units[index][1]):
+            self.on_unit(self, index)
+        if not self.retain:
+            self.g[index] = None
+            self.du_path[index] = None
+
+    def add_unit(self, kind, nodeList, key, base, count):
+        self.node_num = base + count
+        if kind == 'func':
+            name = nodeList[0].decl.name
+        else:
+            name = ', '.join(each.name for each in nodeList if each.name is not None)
+        self.units.append((kind, name, key, base, count))
+
     def build(self, node):
         nodeName = node.__class__.__name__
         if nodeName == 'FileAST':
             self.g = []
             self.du_path = []
-            self.dot = Digraph(name=self.name)
+            self.units = []
+            units = []
             flag = 0
             decl = []
             typedef = []
@@ -760,7 +1343,7 @@ class Graph:
                 if eachNode.__class__.__name__ == "Decl":
                     # 如果存在连续的typedef声明，优先处理
                     if flag == 2:
-                        self.build_typedef(typedef)
+                        units.append(('typedef', typedef))
                         typedef = []
                     # 处理decl的连续标记
                     flag = 1
@@ -768,24 +1351,29 @@ class Graph:
                 elif eachNode.__class__.__name__ == "Typedef":
                     # 如果存在连续的decl声明，优先处理
                     if flag == 1:
-                        self.build_decl(decl)
+                        units.append(('decl', decl))
                         decl = []
                     flag = 2
                     typedef.append(eachNode)
                 elif eachNode.__class__.__name__ == "FuncDef":
                     if flag == 1:
-                        self.build_decl(decl)
+                        units.append(('decl', decl))
                         decl = []
                     elif flag == 2:
-                        self.build_typedef(typedef)
+                        units.append(('typedef', typedef))
                         typedef = []
                     flag = 0
-                    self.build(eachNode)
+                    units.append(('func', [eachNode]))
             # 结尾控制
             if flag == 1:
-                self.build_decl(decl)
+                units.append(('decl', decl))
             elif flag == 2:
-                self.build_typedef(typedef)
+                units.append(('typedef', typedef))
+            if self.workers is not None and self.workers > 1 and len(units) > 1:
+                self.build_parallel(units, self.workers)
+            else:
+                for kind, nodeList in units:
+                    self.build_unit(kind, nodeList)
         elif nodeName == "FuncDef":
             # 处理Decl节点下的 FuncDecl
             code = ''
@@ -797,7 +1385,7 @@ class Graph:
             code += self.getDeclTypeAttr(funcdecl.type) + ' ' + code_str
 
             # 建立节点，然后处理节点内部的Compound对象
-            astn = AstNode(self.node_num, code=['Start', code], d=d, u=u, isStart=True)
+            astn = AstNode(self.node_num, code=['Start', code], d=d, u=u, isStart=True, line=line_of(node.decl))
             dupath = self.combine_du_to_dict(astn.id, d=d, u=u)
             self.node_num += 1
 
@@ -819,24 +1407,273 @@ class Graph:
             self.du_path.append(dupath)
 
 
-def build_graph(path, name="test"):
-    # 处理‘#include’标签
+# 代码块中的特殊节点类型 -> 处理函数，需要建立内层代码块的函数为生成器
+NESTED_TABLE = {
+    'Switch': Graph.nested_switch,
+    'Case': Graph.nested_case,
+    'Default': Graph.nested_default,
+    'If': Graph.nested_if,
+    'DoWhile': Graph.nested_do_while,
+    'While': Graph.nested_while,
+    'For': Graph.nested_for,
+    'Break': Graph.nested_break,
+    'Continue': Graph.nested_continue,
+    'Return': Graph.nested_return,
+    'Compound': Graph.nested_compound,
+}
+
+
+def strip_source(source):
+    """
+    去除‘#include’、‘using’行和‘//’注释，去除的行保留为空行，保证行号不变
+
+    :param source: 源文件内容 bytes 或 str
+    :return: str
+    """
+    if isinstance(source, bytes):
+        source = source.decode('utf-8')
+    txt = []
+    for each in io.StringIO(source, newline=None):
+        if each.find('#include') != -1 or each.find('using') == 0:
+            txt.append('\n')
+        elif each.find('//') != -1:
+            txt.append(each[:each.find('//')] + '\n')
+        else:
+            txt.append(each)
+    return ''.join(txt)
+
+
+def preprocess(text, filename='<stdin>', cpp_path=None, cpp_args=None):
+    """
+    通过管道把代码交给预处理器，不写临时文件
+
+    :param text: 去除include后的代码
+    :param filename: 用于行号标记的文件名
+    :param cpp_path: 预处理器路径，默认CPP_PATH
+    :param cpp_args: [str] 预处理器参数，默认CPP_ARGS
+    :return: 预处理后的代码 str
+    """
+    cpp_path = cpp_path if cpp_path is not None else CPP_PATH
+    cpp_args = cpp_args if cpp_args is not None else CPP_ARGS
+    text = '#line 1 "%s"\n' % filename.replace('\\', '/') + text
+    proc = subprocess.run([cpp_path] + list(cpp_args) + ['-'], input=text, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, encoding='utf-8')
+    if proc.returncode != 0:
+        raise RuntimeError('preprocess %s failed: %s' % (filename, proc.stderr.strip()))
+    return proc.stdout
+
+
+_parser = None
+# 生成表时使用的模块名，不能与pycparser自带的lextab/yacctab相同
+_TABLE_MODULES = ('cfg_lextab', 'cfg_yacctab')
+
+
+def _read_table(path):
+    """
+    执行PLY写出的表模块，返回其中的变量
+    """
+    namespace = {}
     with open(path, encoding='utf-8') as f:
-        txt_list = f.readlines()
-        txt = ''
-        for each in txt_list:
-            if each.find('#include') != -1 or each.find('using') == 0:
-                continue
-            elif each.find('//') != -1:
-                txt += each[:each.find('//')] + '\n'
-            else:
-                txt += each
-    with open('tmp/c_processfile.c', 'w', encoding='utf-8') as f:
-        f.write(txt)
-    ast = parse_file('tmp/c_processfile.c', use_cpp=True, cpp_path=r'C:\MinGW\bin\gcc.exe', cpp_args=['-E', r'-I utils/fake_libc_include'])
+        exec(compile(f.read(), path, 'exec'), namespace)
+    return {key: value for key, value in namespace.items() if not key.startswith('__')}
+
+
+def make_parser(directory=None):
+    """
+    建立使用优化lex/yacc表的CParser，表以pickle保存在directory中，
+    之后的进程直接读取，不依赖pycparser自带的表模块是否存在、是否与PLY版本一致以及.pyc缓存
+
+    :param directory: 表缓存目录，None或空字符串时使用pycparser自带的表
+    :return: CParser
+    """
+    import pycparser
+    from pycparser import CParser
+    if not directory:
+        return CParser()
+    path = os.path.join(directory, 'pycparser-%s.tables' % pycparser.__version__)
+    tables = None
+    try:
+        with open(path, 'rb') as f:
+            tables = pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        # 文件损坏时重新生成
+        tables = None
+    if tables is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            parser = CParser(lex_optimize=True, yacc_optimize=True, lextab=_TABLE_MODULES[0],
+                             yacctab=_TABLE_MODULES[1], taboutputdir=tmp)
+            tables = {name: _read_table(os.path.join(tmp, name + '.py')) for name in _TABLE_MODULES}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # 先写临时文件再替换，多个进程同时生成时不会读到不完整的文件
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(tables, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+        return parser
+    modules = []
+    for name in _TABLE_MODULES:
+        module = type(os)(name)
+        module.__dict__.update(tables[name])
+        modules.append(module)
+    return CParser(lex_optimize=True, yacc_optimize=True, lextab=modules[0], yacctab=modules[1],
+                   taboutputdir=directory)
+
+
+def get_parser():
+    """
+    每个进程只建立一次CParser，避免重复生成lex/yacc表
+    """
+    global _parser
+    if _parser is None:
+        with profiler.span('parser_init'):
+            _parser = make_parser(PARSER_TABLES)
+    return _parser
+
+
+def parse(text, filename='<stdin>', prelude=None):
+    """
+    :param prelude: prelude.Prelude 预先声明其中的typedef名称，None为不使用
+    """
+    if prelude is None:
+        return get_parser().parse(text, filename)
+    prefix, count = prelude.prefix(text)
+    # 行号标记使prefix之后的代码仍从filename的第1行开始
+    ast = get_parser().parse(prefix + '#line 1 "%s"\n' % filename.replace('\\', '/') + text, filename)
+    # prefix中的typedef不属于这个文件
+    del ast.ext[:count]
+    return ast
+
+
+def analyze(path, name="test", cache=None, cpp_path=None, cpp_args=None, unit_cache=None, workers=None,
+            on_unit=None, retain=True, prelude=False, scoped=False):
+    """
+    分析c文件并返回Graph，不打印、不绘制
+
+    :param path: c文件路径
+    :param name: 图名称
+    :param cache: cache.SourceCache 对象，命中时跳过预处理和解析
+    :param cpp_path: 预处理器路径，默认CPP_PATH
+    :param cpp_args: [str] 预处理器参数，默认CPP_ARGS
+    :param unit_cache: cache.UnitCache 对象，只重新建立改变的方法和全局声明
+    :param workers: 大于1时在多个进程中并行建立各个方法
+    :param on_unit: 每建立完一个单元的回调，见Graph
+    :param retain: 为False时回调后释放单元，见Graph
+    :param prelude: 为True时使用fake libc头文件的宏定义和typedef（见prelude.load），
+                    被去掉的#include引用的size_t、FILE、NULL等可以直接使用
+    :param scoped: 为True时d/u为按作用域解析的符号id，见Graph
+    :return: Graph
+    """
+    with open(path, 'rb') as f:
+        source = f.read()
+    return analyze_source(source, path, name, cache, cpp_path, cpp_args, unit_cache, workers, on_unit, retain,
+                          prelude, scoped)
+
+
+def analyze_source(source, path='<stdin>', name="test", cache=None, cpp_path=None, cpp_args=None, unit_cache=None,
+                   workers=None, on_unit=None, retain=True, prelude=False, scoped=False):
+    """
+    分析c代码并返回Graph，参数见analyze
+
+    :param source: bytes 或 str 代码
+    :param path: 用于行号标记和错误信息的文件名
+    :return: Graph
+    """
+    ast = load_ast(source, path, cache, cpp_path, cpp_args, prelude)
     # ast.show()
     # print(ast)
-    graph = Graph(ast, name)
+    with profiler.span('build', file=path) as args:
+        graph = Graph(ast, name, unit_cache, workers, on_unit, retain, scoped)
+        args['nodes'] = graph.node_num
+    return graph
+
+
+def load_ast(source, path='<stdin>', cache=None, cpp_path=None, cpp_args=None, prelude=False):
+    """
+    去除注释、预处理并解析c代码，参数见analyze
+
+    :param source: bytes 或 str 代码
+    :param path: 用于行号标记和错误信息的文件名
+    :return: pycparser FileAST
+    """
+    cpp_path = cpp_path if cpp_path is not None else CPP_PATH
+    cpp_args = cpp_args if cpp_args is not None else CPP_ARGS
+    snapshot = None
+    if prelude:
+        import prelude as prelude_module
+        with profiler.span('prelude'):
+            snapshot = prelude_module.load(cpp_path, cpp_args)
+        # 宏定义通过-imacros导入，也作为缓存key的一部分
+        cpp_args = list(cpp_args) + snapshot.cpp_args
+    if isinstance(source, str):
+        source = source.encode('utf-8')
+    ast = None
+    text = None
+    if cache is not None:
+        with profiler.span('cache_get', file=path) as args:
+            key = cache.key(source, CPP_INCLUDE, [cpp_path] + list(cpp_args), path)
+            ast = cache.get_ast(key)
+            if ast is None:
+                text = cache.get_preprocessed(key)
+            args['hit'] = 'ast' if ast is not None else 'preprocessed' if text is not None else 'miss'
+    if ast is None:
+        if text is None:
+            with profiler.span('strip', file=path):
+                text = strip_source(source)
+            with profiler.span('preprocess', file=path):
+                text = preprocess(text, path, cpp_path, cpp_args)
+            if cache is not None:
+                cache.put_preprocessed(key, text)
+        with profiler.span('parse', file=path):
+            ast = parse(text, path, snapshot)
+        if cache is not None:
+            with profiler.span('cache_put', file=path):
+                cache.put_ast(key, ast)
+    return ast
+
+
+def build_local_unit(unit):
+    """
+    建立一个单元，节点id从0开始
+
+    :param unit: (类型, [pycparser Node], 符号id或None)
+    :return: (AstNode, dupath, 节点数, 单元起始行号)
+    """
+    kind, nodeList, ids = unit
+    graph = Graph(None)
+    graph.g = []
+    graph.du_path = []
+    graph.units = []
+    graph.build_unit(kind, nodeList, ids)
+    return graph.g[0], graph.du_path[0], graph.units[0][4], line_of(nodeList[0]) or 0
+
+
+def _build_in_worker(unit, profile=False):
+    """
+    在build_parallel的子进程中建立一个单元
+
+    :param profile: 为True时记录建立单元的事件并随结果返回
+    :return: (build_local_unit的结果, [profiler事件])
+    """
+    # fork出的子进程继承了主进程的Profiler和其中的事件，换成新的，只返回本单元的事件
+    profiler.disable()
+    if profile:
+        profiler.enable()
+    return build_local_unit(unit), profiler.take_events()
+
+
+def build_graph(path, name="test", view=True, cache=None, cpp_path=None, cpp_args=None):
+    """
+    分析c文件，打印dupath并绘制pdf
+    """
+    graph = analyze(path, name, cache, cpp_path, cpp_args)
+    if graph.g is not None:
+        graph.travel_dupath()
+        graph.render(view=view)
 
     # dot = Digraph(name='test1', comment='t1')
     # dot.node('a','a1')
@@ -846,4 +1683,4 @@ def build_graph(path, name="test"):
     # dot.render('c_file.gv', view=True)
 
 if __name__ == '__main__':
-    build_graph(r'tmp/c_processfile.c')
\ No newline at end of file
+    build_graph(r'tmp/c_processfile.c')
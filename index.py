@@ -0,0 +1,303 @@
+import argparse
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import graph_gen
+from batch import collect_files
+from graph_gen import walk
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    hash TEXT NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS functions (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    line INTEGER,
+    first_node INTEGER NOT NULL,
+    node_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    node INTEGER NOT NULL,
+    function_id INTEGER NOT NULL,
+    code TEXT NOT NULL,
+    line INTEGER,
+    is_start INTEGER NOT NULL,
+    is_end INTEGER NOT NULL,
+    PRIMARY KEY (file_id, node)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS edges (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    src INTEGER NOT NULL,
+    dst INTEGER NOT NULL,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS defuse (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    node INTEGER NOT NULL,
+    function_id INTEGER NOT NULL,
+    var TEXT NOT NULL,
+    kind TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS functions_name ON functions(name);
+CREATE INDEX IF NOT EXISTS functions_file ON functions(file_id);
+CREATE INDEX IF NOT EXISTS nodes_function ON nodes(function_id);
+CREATE INDEX IF NOT EXISTS edges_src ON edges(file_id, src);
+CREATE INDEX IF NOT EXISTS edges_dst ON edges(file_id, dst);
+CREATE INDEX IF NOT EXISTS defuse_var ON defuse(var, kind);
+CREATE INDEX IF NOT EXISTS defuse_file ON defuse(file_id);
+'''
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def file_rows(path):
+    """
+    分析一个文件，生成写入数据库的行（可在子进程中运行）
+
+    :param path: c文件路径
+    :return: {'functions': [(名称, 类型, 行号, 起始id, 节点数)],
+              'nodes': [(函数下标, 节点id, 代码, 行号, 是否开始, 是否终止)],
+              'edges': [(起点, 终点, 标签)],
+              'defuse': [(函数下标, 节点id, 变量, 'd'/'u')]}
+    """
+    graph = graph_gen.analyze(path, os.path.basename(path))
+    functions = []
+    nodes = []
+    edges = []
+    defuse = []
+    for index, root in enumerate(graph.g):
+        kind, name, _, base, count = graph.units[index]
+        functions.append((name, kind, root.line, base, count))
+        for node, node_edges in walk(root):
+            edges.extend(node_edges)
+            if node.id == -1:
+                continue
+            nodes.append((index, node.id, '\n'.join(node.code), node.line, int(node.isStart), int(node.isEnd)))
+            for var in dict.fromkeys(node.d):
+                defuse.append((index, node.id, var, 'd'))
+            for var in dict.fromkeys(node.u):
+                defuse.append((index, node.id, var, 'u'))
+    return {'functions': functions, 'nodes': nodes, 'edges': edges, 'defuse': defuse}
+
+
+def _index_job(job):
+    path, digest = job
+    try:
+        return path, digest, file_rows(path), None
+    except Exception as e:
+        return path, digest, None, '%s: %s' % (e.__class__.__name__, e)
+
+
+class Index:
+    def __init__(self, db_path):
+        """
+        CFG节点、边和变量定义/使用的SQLite索引，按文件增量更新
+
+        :param db_path: 数据库文件路径
+        """
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.execute('PRAGMA journal_mode = WAL')
+        self.conn.execute('PRAGMA synchronous = NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def stale(self, path, digest):
+        """
+        :return: 文件内容与索引中的不同（或未索引）时为True
+        """
+        row = self.conn.execute('SELECT hash FROM files WHERE path = ?', (path,)).fetchone()
+        return row is None or row[0] != digest
+
+    def store(self, path, digest, rows):
+        """
+        在一个事务中替换一个文件的全部行
+        """
+        with self.conn:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+            file_id = self.conn.execute('INSERT INTO files (path, hash, indexed_at) VALUES (?, ?, ?)',
+                                        (path, digest, time.time())).lastrowid
+            function_ids = []
+            for name, kind, line, base, count in rows['functions']:
+                function_ids.append(self.conn.execute(
+                    'INSERT INTO functions (file_id, name, kind, line, first_node, node_count) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', (file_id, name, kind, line, base, count)).lastrowid)
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO nodes (file_id, node, function_id, code, line, is_start, is_end) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((file_id, node, function_ids[index], code, line, is_start, is_end)
+                 for index, node, code, line, is_start, is_end in rows['nodes']))
+            self.conn.executemany('INSERT INTO edges (file_id, src, dst, label) VALUES (?, ?, ?, ?)',
+                                  ((file_id, src, dst, label) for src, dst, label in rows['edges']))
+            self.conn.executemany('INSERT INTO defuse (file_id, node, function_id, var, kind) VALUES (?, ?, ?, ?, ?)',
+                                  ((file_id, node, function_ids[index], var, kind)
+                                   for index, node, var, kind in rows['defuse']))
+
+    def update(self, paths, pattern='*.c', workers=None, prune=False):
+        """
+        索引文件，内容未改变的文件跳过，分析在进程池中进行，写入在当前进程中进行
+
+        :param paths: [str] 目录、文件或通配符
+        :param pattern: 目录下匹配的文件名模式
+        :param workers: 进程数，1为在当前进程中分析
+        :param prune: 删除索引中已不存在的文件
+        :return: (更新的文件数, 跳过的文件数, [(path, 错误信息)])
+        """
+        files = [os.path.normpath(os.path.abspath(f)) for f in collect_files(paths, pattern)]
+        jobs = []
+        for path in files:
+            digest = file_hash(path)
+            if self.stale(path, digest):
+                jobs.append((path, digest))
+        errors = []
+        updated = 0
+        if workers == 1 or len(jobs) <= 1:
+            results = map(_index_job, jobs)
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(_index_job, jobs)
+        try:
+            for path, digest, rows, error in results:
+                if error is not None:
+                    errors.append((path, error))
+                    continue
+                self.store(path, digest, rows)
+                updated += 1
+        finally:
+            if not (workers == 1 or len(jobs) <= 1):
+                executor.shutdown()
+        if prune:
+            with self.conn:
+                for (path,) in self.conn.execute('SELECT path FROM files').fetchall():
+                    if not os.path.exists(path):
+                        self.conn.execute('DELETE FROM files WHERE path = ?', (path,))
+        return updated, len(files) - len(jobs), errors
+
+    def variable(self, var, kind=None):
+        """
+        :param var: 变量名
+        :param kind: 'd' 只查定义，'u' 只查使用，None 全部
+        :return: [(文件, 函数, 节点id, 单元内的局部id, 行号, 'd'/'u', 代码)]
+        """
+        sql = ('SELECT f.path, fn.name, x.node, x.node - fn.first_node, n.line, x.kind, n.code FROM defuse x '
+               'JOIN files f ON f.id = x.file_id JOIN functions fn ON fn.id = x.function_id '
+               'JOIN nodes n ON n.file_id = x.file_id AND n.node = x.node WHERE x.var = ?')
+        args = [var]
+        if kind is not None:
+            sql += ' AND x.kind = ?'
+            args.append(kind)
+        return self.conn.execute(sql + ' ORDER BY f.path, n.line, x.node', args).fetchall()
+
+    def functions(self, name):
+        """
+        :return: [(函数id, 文件, 类型, 行号, 起始节点id, 节点数)]
+        """
+        return self.conn.execute(
+            'SELECT fn.id, f.path, fn.kind, fn.line, fn.first_node, fn.node_count FROM functions fn '
+            'JOIN files f ON f.id = fn.file_id WHERE fn.name = ? ORDER BY f.path, fn.line', (name,)).fetchall()
+
+    def function_nodes(self, function_id):
+        """
+        :return: [(节点id, 单元内的局部id, 行号, 代码, 是否开始, 是否终止)]
+                 局部id为节点id减去单元的起始id，前面增删方法时不变（见graph_gen.Graph.local_id）
+        """
+        return self.conn.execute(
+            'SELECT n.node, n.node - fn.first_node, n.line, n.code, n.is_start, n.is_end FROM nodes n '
+            'JOIN functions fn ON fn.id = n.function_id WHERE n.function_id = ? ORDER BY n.node',
+            (function_id,)).fetchall()
+
+    def function_edges(self, function_id):
+        """
+        :return: [(起点, 终点, 标签)]
+        """
+        return self.conn.execute(
+            'SELECT e.src, e.dst, e.label FROM edges e JOIN nodes n ON n.file_id = e.file_id AND n.node = e.src '
+            'WHERE n.function_id = ?', (function_id,)).fetchall()
+
+    def edges(self, path, node):
+        """
+        :return: ([(后继, 标签)], [(前驱, 标签)])
+        """
+        row = self.conn.execute('SELECT id FROM files WHERE path = ?',
+                                (os.path.normpath(os.path.abspath(path)),)).fetchone()
+        if row is None:
+            return [], []
+        succs = self.conn.execute('SELECT dst, label FROM edges WHERE file_id = ? AND src = ?', (row[0], node))
+        preds = self.conn.execute('SELECT src, label FROM edges WHERE file_id = ? AND dst = ?', (row[0], node))
+        return succs.fetchall(), preds.fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='index CFG nodes, edges and defs/uses of c files in sqlite')
+    parser.add_argument('db', help='sqlite database file')
+    sub = parser.add_subparsers(dest='command', required=True)
+    build = sub.add_parser('update', help='index changed files')
+    build.add_argument('paths', nargs='+', help='directories, files or glob patterns')
+    build.add_argument('-j', '--workers', type=int, default=None, help='number of worker processes')
+    build.add_argument('--pattern', default='*.c', help='file name pattern used in directories')
+    build.add_argument('--prune', action='store_true', help='drop files that no longer exist')
+    var = sub.add_parser('var', help='where a variable is defined and used')
+    var.add_argument('name')
+    var.add_argument('--kind', choices=['d', 'u'], default=None, help='only definitions or only uses')
+    func = sub.add_parser('func', help='nodes and edges of a function')
+    func.add_argument('name')
+    edge = sub.add_parser('edges', help='successors and predecessors of a node')
+    edge.add_argument('path')
+    edge.add_argument('node', type=int)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    with Index(args.db) as index:
+        if args.command == 'update':
+            updated, skipped, errors = index.update(args.paths, args.pattern, args.workers, args.prune)
+            for path, error in errors:
+                print('[error] %s %s' % (path, error))
+            print('updated: %d, unchanged: %d, failed: %d' % (updated, skipped, len(errors)))
+        elif args.command == 'var':
+            for path, function, node, local, line, kind, code in index.variable(args.name, args.kind):
+                print('%s:%s\t%s:%d\t%s\t%d\t%s' % (path, line, function, local, kind, node,
+                                                   code.replace('\n', '; ')))
+        elif args.command == 'func':
+            for function_id, path, kind, line, first, count in index.functions(args.name):
+                print('%s:%s %s (%s, %d nodes)' % (path, line, args.name, kind, count))
+                for node, local, node_line, code, is_start, is_end in index.function_nodes(function_id):
+                    print('\t%d\t%s:%d\tline %s\t%s' % (node, args.name, local, node_line, code.replace('\n', '; ')))
+                for src, dst, label in index.function_edges(function_id):
+                    print('\t%d -> %d%s' % (src, dst, ' [%s]' % label if label else ''))
+        else:
+            succs, preds = index.edges(args.path, args.node)
+            print('successors: %s' % ', '.join('%d%s' % (n, ' [%s]' % l if l else '') for n, l in succs))
+            print('predecessors: %s' % ', '.join('%d%s' % (n, ' [%s]' % l if l else '') for n, l in preds))
+    print('%.1f ms' % ((time.perf_counter() - start) * 1000), file=sys.stderr)
+    return 1 if args.command == 'update' and len(errors) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
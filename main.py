@@ -1,4 +1,5 @@
 import os
+import sys
 import traceback
 
 import graph_gen
@@ -17,4 +18,8 @@ def main(path='.'):
 
 
 if __name__ == '__main__':
+    # 带参数时进入批量模式：python main.py dir1 dir2/*.c -j 32
+    if len(sys.argv) > 1:
+        import batch
+        sys.exit(batch.main(sys.argv[1:]))
     main()
@@ -0,0 +1,254 @@
+import argparse
+import asyncio
+import io
+import multiprocessing
+import os
+import signal
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import export
+import graph_gen
+from batch import FileTimeout, collect_files, output_name, summary
+
+STAGES = ('preprocess', 'analyze', 'render')
+
+
+def _on_timeout(signum, frame):
+    raise FileTimeout()
+
+
+def _init_worker():
+    """
+    分析进程初始化：提前建立CParser
+    """
+    graph_gen.get_parser()
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _on_timeout)
+
+
+def _warm():
+    return os.getpid()
+
+
+def _analyze(path, name, text, timeout):
+    """
+    在分析进程中解析、建图并生成DOT文本，只把文本传回主进程
+
+    :return: DOT文本
+    """
+    use_alarm = timeout and hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        graph = graph_gen.Graph(graph_gen.parse(text, path), name)
+        out = io.StringIO()
+        export.write_dot(graph, out)
+        return out.getvalue()
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+async def communicate(args, data, timeout=None):
+    """
+    启动外部进程，通过管道写入data并读取输出，超时时结束进程
+
+    :return: (退出码, stdout bytes, stderr bytes)
+    """
+    stdin = asyncio.subprocess.PIPE if data is not None else asyncio.subprocess.DEVNULL
+    proc = await asyncio.create_subprocess_exec(*args, stdin=stdin,
+                                                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(data), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise
+    return proc.returncode, out, err
+
+
+class Pipeline:
+    def __init__(self, cpp_jobs=2, workers=1, render_jobs=2, queue_size=4, timeout=None, directory='tmp',
+                 fmt='pdf', engine='dot', cpp_path=None, cpp_args=None, render=True):
+        """
+        预处理、分析、绘制三个阶段通过有界队列连接，同时处理不同的文件：
+        gcc和dot作为asyncio子进程运行，解析和建图在进程池中进行，
+        文件N分析时，文件N+1在预处理，文件N-1在绘制；下游队列满时上游暂停（背压）
+
+        :param cpp_jobs: 同时运行的gcc进程数
+        :param workers: 分析进程数
+        :param render_jobs: 同时运行的dot进程数
+        :param queue_size: 阶段之间队列的长度上限
+        :param timeout: 每个阶段处理一个文件的超时时间（秒）
+        :param directory: 输出目录，写出 名称.gv 和 名称.格式
+        :param fmt: dot输出格式
+        :param engine: graphviz布局程序
+        :param cpp_path: 预处理器路径，默认CPP_PATH
+        :param cpp_args: [str] 预处理器参数，默认CPP_ARGS
+        :param render: 为False时只写出.gv文件
+        """
+        self.jobs = {'preprocess': cpp_jobs, 'analyze': workers, 'render': render_jobs}
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.directory = directory
+        self.fmt = fmt
+        self.engine = engine
+        self.cpp_path = cpp_path if cpp_path is not None else graph_gen.CPP_PATH
+        self.cpp_args = list(cpp_args) if cpp_args is not None else list(graph_gen.CPP_ARGS)
+        self.render = render
+        self.executor = None
+        self.results = []
+        # 各阶段处理文件的累计时间（秒），大于墙钟时间的部分即为重叠
+        self.busy = dict.fromkeys(STAGES, 0.0)
+
+    def run(self, files):
+        """
+        :param files: [str] c文件路径
+        :return: [(path, status, seconds, message)] 与batch.run_batch相同
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.results = []
+        self.executor = self.new_executor(self.jobs['analyze'])
+        try:
+            futures = [self.executor.submit(_warm) for _ in range(self.jobs['analyze'])]
+            for future in futures:
+                future.result()
+            asyncio.run(self.main(files))
+        finally:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        return self.results
+
+    @staticmethod
+    def new_executor(workers):
+        # 分析进程不能直接由事件循环所在的进程fork：会继承gcc的stdin管道，使gcc读不到EOF；
+        # 进程池损坏后在运行中重建，因此使用forkserver（Windows下为spawn，同样不继承）
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, mp_context=context)
+
+    async def main(self, files):
+        inbox = asyncio.Queue(self.queue_size)
+        analyze_queue = asyncio.Queue(self.queue_size)
+        render_queue = asyncio.Queue(self.queue_size)
+
+        async def feed():
+            for path in files:
+                await inbox.put((path, output_name(path), time.time()))
+            for _ in range(self.jobs['preprocess']):
+                await inbox.put(None)
+
+        await asyncio.gather(
+            feed(),
+            self.stage('preprocess', self.preprocess, inbox, analyze_queue, self.jobs['analyze']),
+            self.stage('analyze', self.analyze, analyze_queue, render_queue, self.jobs['render']),
+            self.stage('render', self.draw, render_queue, None, 0))
+
+    async def stage(self, name, handler, inbox, outbox, consumers):
+        """
+        启动一个阶段的并发任务，从inbox取出文件处理后放入outbox，None表示结束
+
+        :param consumers: 下一个阶段的任务数，结束时向outbox放入同样个数的None
+        """
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is None:
+                    return
+                path, start = item[0], item[2]
+                begin = time.perf_counter()
+                try:
+                    result = await handler(*item)
+                except BrokenProcessPool:
+                    self.results.append((path, 'crashed', time.time() - start, 'worker process died'))
+                    continue
+                except (asyncio.TimeoutError, FileTimeout):
+                    self.results.append((path, 'timeout', time.time() - start,
+                                         '%s exceeded %ss' % (name, self.timeout)))
+                    continue
+                except Exception as e:
+                    # 分析进程的异常带有进程池的远程traceback，只保留异常本身
+                    self.results.append((path, 'error', time.time() - start,
+                                         ''.join(traceback.format_exception_only(type(e), e))))
+                    continue
+                finally:
+                    self.busy[name] += time.perf_counter() - begin
+                if outbox is not None:
+                    await outbox.put(result)
+
+        await asyncio.gather(*[worker() for _ in range(self.jobs[name])])
+        for _ in range(consumers):
+            await outbox.put(None)
+
+    async def preprocess(self, path, name, start):
+        with open(path, 'rb') as f:
+            text = graph_gen.strip_source(f.read())
+        text = '#line 1 "%s"\n' % path.replace('\\', '/') + text
+        code, out, err = await communicate([self.cpp_path] + self.cpp_args + ['-'], text.encode('utf-8'),
+                                           self.timeout)
+        if code != 0:
+            raise RuntimeError('preprocess %s failed: %s' % (path, err.decode('utf-8', 'replace').strip()))
+        return path, name, start, out.decode('utf-8')
+
+    async def analyze(self, path, name, start, text):
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            dot = await loop.run_in_executor(executor, _analyze, path, name, text, self.timeout)
+        except BrokenProcessPool:
+            # 一个进程退出使整个进程池损坏，同时在分析的文件都会失败：换一个进程池给之后的文件，
+            # 这个文件在单独的进程中重新分析，再次失败的才是使进程退出的文件
+            if self.executor is executor:
+                executor.shutdown(wait=False)
+                self.executor = self.new_executor(self.jobs['analyze'])
+            alone = self.new_executor(1)
+            try:
+                dot = await loop.run_in_executor(alone, _analyze, path, name, text, self.timeout)
+            finally:
+                alone.shutdown(wait=False)
+        return path, name, start, dot
+
+    async def draw(self, path, name, start, dot):
+        source = os.path.join(self.directory, name + '.gv')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write(dot)
+        if self.render:
+            output = os.path.join(self.directory, '%s.%s' % (name, self.fmt))
+            code, _, err = await communicate([self.engine, '-T' + self.fmt, '-o', output, source], None,
+                                             self.timeout)
+            if code != 0:
+                raise RuntimeError('%s failed: %s' % (self.engine, err.decode('utf-8', 'replace').strip()))
+        self.results.append((path, 'ok', time.time() - start, ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='analyze and render c files with overlapping pipeline stages')
+    parser.add_argument('paths', nargs='+', help='directories, files or glob patterns')
+    parser.add_argument('-j', '--workers', type=int, default=1, help='analysis processes')
+    parser.add_argument('--cpp-jobs', type=int, default=2, help='concurrent preprocessor processes')
+    parser.add_argument('--render-jobs', type=int, default=2, help='concurrent dot processes')
+    parser.add_argument('--queue', type=int, default=4, help='files buffered between two stages')
+    parser.add_argument('-t', '--timeout', type=float, default=None, help='per-stage timeout of a file in seconds')
+    parser.add_argument('--pattern', default='*.c', help='file name pattern used in directories')
+    parser.add_argument('-d', '--directory', default='tmp', help='output directory')
+    parser.add_argument('-T', '--format', default='pdf', help='output format of dot')
+    parser.add_argument('--no-render', action='store_true', help='only write the .gv files')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    pipeline = Pipeline(args.cpp_jobs, args.workers, args.render_jobs, args.queue, args.timeout, args.directory,
+                        args.format, render=not args.no_render)
+    results = pipeline.run(collect_files(args.paths, args.pattern))
+    code = summary(results)
+    wall = time.time() - start
+    print('wall time: %.2fs, stage time: %s' % (
+        wall, ', '.join('%s %.2fs' % (stage, pipeline.busy[stage]) for stage in STAGES)))
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
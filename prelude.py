@@ -0,0 +1,57 @@
+import os
+import re
+
+import graph_gen
+
+# fake_libc_include 中每个头文件都只包含这两个文件
+PRELUDE_DEFINES = os.path.join(graph_gen.CPP_INCLUDE, '_fake_defines.h')
+PRELUDE_TYPEDEFS = os.path.join(graph_gen.CPP_INCLUDE, '_fake_typedefs.h')
+
+_WORD = re.compile(r'[A-Za-z_]\w*')
+
+# 每个进程只解析一次，键为 (cpp_path, cpp_args)
+_snapshots = {}
+
+
+class Prelude:
+    __slots__ = ('typedefs', 'cpp_args')
+
+    def __init__(self, typedefs, cpp_args):
+        """
+        fake libc头文件的快照，代替每个文件重新预处理、解析头文件
+        解析器只需要知道哪些名称是类型，不需要头文件中类型的定义，
+        所以只保留typedef名称，解析时写成 typedef int 名称; 放在代码之前（见graph_gen.parse）
+
+        :param typedefs: frozenset 头文件中的typedef名称
+        :param cpp_args: [str] 预处理文件时追加的参数，只导入宏定义
+        """
+        self.typedefs = typedefs
+        self.cpp_args = cpp_args
+
+    def prefix(self, text):
+        """
+        :param text: 预处理后的代码
+        :return: (代码中出现的typedef名称的声明, 声明数)
+        """
+        names = sorted(self.typedefs.intersection(_WORD.findall(text)))
+        return ''.join('typedef int %s;\n' % name for name in names), len(names)
+
+
+def load(cpp_path=None, cpp_args=None):
+    """
+    预处理并解析一次_fake_typedefs.h，之后直接返回快照
+
+    :return: Prelude
+    """
+    cpp_path = cpp_path if cpp_path is not None else graph_gen.CPP_PATH
+    cpp_args = list(cpp_args) if cpp_args is not None else list(graph_gen.CPP_ARGS)
+    key = (cpp_path, tuple(cpp_args))
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+        with open(PRELUDE_TYPEDEFS, encoding='utf-8') as f:
+            text = graph_gen.preprocess(f.read(), PRELUDE_TYPEDEFS, cpp_path, cpp_args)
+        ast = graph_gen.parse(text, PRELUDE_TYPEDEFS)
+        typedefs = frozenset(decl.name for decl in ast.ext if decl.__class__.__name__ == 'Typedef')
+        snapshot = Prelude(typedefs, ['-imacros', PRELUDE_DEFINES])
+        _snapshots[key] = snapshot
+    return snapshot
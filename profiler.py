@@ -0,0 +1,214 @@
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows 下没有resource模块，不记录峰值内存
+    resource = None
+
+# 当前进程的Profiler，None表示未启用，此时span几乎没有开销
+_profiler = None
+
+
+def peak_rss_kb():
+    """
+    :return: 当前进程的峰值常驻内存（KB），不支持时返回None
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 的单位是字节，Linux 是KB
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class Span:
+    __slots__ = ('profiler', 'name', 'args', 'ts', 'start', 'cpu')
+
+    def __init__(self, profiler, name, args):
+        """
+        一个计时区间，进入时记录墙钟和CPU时间，退出时记录为一个事件
+        args 在区间内可以继续添加计数信息
+
+        :param profiler: Profiler
+        :param name: 阶段名称
+        :param args: dict 附加信息
+        """
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.ts = time.time()
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+        return self.args
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        self.profiler.events.append({'name': self.name, 'ts': self.ts, 'wall': wall, 'cpu': cpu,
+                                     'rss_kb': peak_rss_kb(), 'pid': os.getpid(),
+                                     'tid': threading.get_ident(), 'args': self.args})
+        return False
+
+
+class _NullSpan:
+    """
+    未启用时的span，不记录任何信息
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class Profiler:
+    def __init__(self):
+        """
+        收集各阶段的计时事件
+        events: [{'name', 'ts' 开始时间戳(秒), 'wall' 墙钟秒, 'cpu' CPU秒, 'rss_kb' 结束时的峰值内存,
+                  'pid', 'tid', 'args' 计数等附加信息}]
+        """
+        self.events = []
+
+    def span(self, name, **args):
+        return Span(self, name, args)
+
+    def merge(self, events):
+        """
+        合并其他进程导出的事件
+        """
+        self.events.extend(events)
+
+    def summary(self, top=5):
+        """
+        按阶段汇总，计数信息中的数值按阶段求和
+
+        :param top: 每个阶段列出的最慢事件个数
+        :return: {'phases': {阶段: {'count', 'wall', 'cpu', 'max_rss_kb', 'counters': {名称: 和},
+                                     'slowest': [{'wall', 'cpu', 附加信息...}]}},
+                  'processes': 进程数}
+        """
+        phases = {}
+        slowest = {}
+        for event in self.events:
+            slowest.setdefault(event['name'], []).append(event)
+            phase = phases.setdefault(event['name'], {'count': 0, 'wall': 0.0, 'cpu': 0.0,
+                                                      'max_rss_kb': None, 'counters': {}})
+            phase['count'] += 1
+            phase['wall'] += event['wall']
+            phase['cpu'] += event['cpu']
+            if event['rss_kb'] is not None:
+                phase['max_rss_kb'] = max(phase['max_rss_kb'] or 0, event['rss_kb'])
+            for key, value in event['args'].items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    phase['counters'][key] = phase['counters'].get(key, 0) + value
+        for name, phase in phases.items():
+            phase['wall'] = round(phase['wall'], 6)
+            phase['cpu'] = round(phase['cpu'], 6)
+            events = sorted(slowest[name], key=lambda e: e['wall'], reverse=True)[:top]
+            phase['slowest'] = [dict(e['args'], wall=round(e['wall'], 6), cpu=round(e['cpu'], 6)) for e in events]
+        return {'phases': phases, 'processes': len(set(event['pid'] for event in self.events))}
+
+    def trace(self):
+        """
+        :return: Chrome trace-event 格式（chrome://tracing、Perfetto可直接打开）
+        """
+        events = []
+        origin = min((event['ts'] for event in self.events), default=0)
+        pids = {}
+        for event in self.events:
+            pids.setdefault(event['pid'], len(pids))
+            args = dict(event['args'])
+            args['cpu_ms'] = round(event['cpu'] * 1000, 3)
+            if event['rss_kb'] is not None:
+                args['peak_rss_kb'] = event['rss_kb']
+            events.append({'name': event['name'], 'ph': 'X', 'pid': event['pid'], 'tid': event['tid'],
+                           'ts': round((event['ts'] - origin) * 1e6, 1), 'dur': round(event['wall'] * 1e6, 1),
+                           'args': args})
+        for pid, index in pids.items():
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                           'args': {'name': 'main' if pid == os.getpid() else 'worker %d' % index}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, prefix):
+        """
+        写出 <prefix>.json 汇总和 <prefix>.trace.json 事件文件
+
+        :return: (汇总文件路径, trace文件路径)
+        """
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        summary_path = prefix + '.json'
+        trace_path = prefix + '.trace.json'
+        with open(summary_path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        with open(trace_path, 'w') as f:
+            json.dump(self.trace(), f)
+        return summary_path, trace_path
+
+
+def enable():
+    """
+    在当前进程启用记录，已启用时返回原来的Profiler
+    """
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    """
+    停止记录
+
+    :return: 停止前的Profiler或None
+    """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler
+
+
+def enabled():
+    return _profiler is not None
+
+
+def current():
+    return _profiler
+
+
+def span(name, **args):
+    """
+    with profiler.span('parse', file=path) as args:
+        ...
+        args['nodes'] = n
+
+    未启用时返回空操作对象
+    """
+    if _profiler is None:
+        return _null_span
+    return _profiler.span(name, **args)
+
+
+def take_events():
+    """
+    取出并清空当前进程的事件，用于子进程把事件交给主进程合并
+    """
+    if _profiler is None:
+        return []
+    events = _profiler.events
+    _profiler.events = []
+    return events
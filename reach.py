@@ -0,0 +1,216 @@
+import argparse
+import random
+import sys
+import time
+from array import array
+
+import graph_gen
+from dataflow import strongly_connected
+
+# 分量数不超过该值时保存完整的传递闭包（分量数^2/8 字节），超过时使用区间标号
+MAX_CLOSURE = 20000
+
+
+class ReachIndex:
+    __slots__ = ('cfg', 'comp', 'count', 'cyclic', 'dag', 'mode', 'rows', 'pre', 'post', 'low', 'rank')
+
+    def __init__(self, cfg, max_closure=MAX_CLOSURE, seed=0):
+        """
+        一个方法CFG的可达性索引，建立后查询不再遍历图
+        先求强连通分量缩点得到DAG：
+            分量数不超过max_closure时在DAG上计算传递闭包，每个分量一行位集合（bytes），查询为O(1)
+            否则为每个分量保存DFS树区间（确定可达）和包含子孙的区间（确定不可达），其余情况在DAG上剪枝搜索
+
+        :param cfg: flatcfg.FlatCFG
+        :param max_closure: 使用传递闭包的最大分量数
+        :param seed: 区间标号时遍历顺序的随机种子
+        """
+        self.cfg = cfg
+        # 分量编号为逆拓扑序：u可以到达v时 comp[u] >= comp[v]
+        comp, count = strongly_connected(cfg)
+        self.comp = array('l', comp)
+        self.count = count
+        sizes = [0] * count
+        for c in comp:
+            sizes[c] += 1
+        self.cyclic = bytearray(len(cfg))
+        dag = [set() for _ in range(count)]
+        for i in range(len(cfg)):
+            for j in cfg.successors(i):
+                if comp[i] != comp[j]:
+                    dag[comp[i]].add(comp[j])
+                elif i == j or sizes[comp[i]] > 1:
+                    self.cyclic[i] = 1
+            if sizes[comp[i]] > 1:
+                self.cyclic[i] = 1
+        self.dag = [sorted(succs) for succs in dag]
+        self.rows = None
+        self.pre = self.post = self.low = self.rank = None
+        if count <= max_closure:
+            self.mode = 'closure'
+            self.build_closure()
+        else:
+            self.mode = 'interval'
+            self.build_intervals(random.Random(seed))
+
+    def build_closure(self):
+        width = (self.count + 7) // 8
+        bits = [0] * self.count
+        rows = [None] * self.count
+        # 后继分量编号更小，按编号从小到大计算
+        for c in range(self.count):
+            value = 1 << c
+            for s in self.dag[c]:
+                value |= bits[s]
+            bits[c] = value
+            rows[c] = value.to_bytes(width, 'little')
+        self.rows = rows
+
+    def build_intervals(self, rng):
+        """
+        从入度为0的分量开始后序遍历DAG：
+        pre/post 为DFS树上的先序、后序编号，v是u在树上的子孙则u可以到达v
+        low 为u能到达的所有分量中最小的后序编号，v可达时 low[u] <= post[v] <= post[u]
+        """
+        count = self.count
+        indegree = [0] * count
+        for succs in self.dag:
+            for s in succs:
+                indegree[s] += 1
+        pre = array('l', [-1]) * count
+        post = array('l', [0]) * count
+        low = array('l', [0]) * count
+        roots = [c for c in range(count) if indegree[c] == 0]
+        rng.shuffle(roots)
+        pre_counter = 0
+        post_counter = 0
+        for root in roots:
+            pre[root] = pre_counter
+            pre_counter += 1
+            children = list(self.dag[root])
+            rng.shuffle(children)
+            stack = [(root, iter(children))]
+            while len(stack) > 0:
+                node, it = stack[-1]
+                for succ in it:
+                    if pre[succ] == -1:
+                        pre[succ] = pre_counter
+                        pre_counter += 1
+                        children = list(self.dag[succ])
+                        rng.shuffle(children)
+                        stack.append((succ, iter(children)))
+                        break
+                else:
+                    stack.pop()
+                    post[node] = post_counter
+                    value = post_counter
+                    post_counter += 1
+                    for s in self.dag[node]:
+                        if low[s] < value:
+                            value = low[s]
+                    low[node] = value
+        self.pre = pre
+        self.post = post
+        self.low = low
+
+    def comp_reaches(self, a, b):
+        """
+        :param a: 分量编号
+        :param b: 分量编号
+        :return: 分量a能否到达分量b
+        """
+        if self.rows is not None:
+            return (self.rows[a][b >> 3] >> (b & 7)) & 1 == 1
+        if a == b:
+            return True
+        # 逆拓扑序和区间包含可以直接判断大部分情况
+        if a < b or not (self.low[a] <= self.post[b] <= self.post[a]):
+            return False
+        if self.pre[a] <= self.pre[b] and self.post[b] <= self.post[a]:
+            return True
+        stack = [a]
+        seen = {a}
+        while len(stack) > 0:
+            c = stack.pop()
+            for s in self.dag[c]:
+                if s == b:
+                    return True
+                if s in seen or s < b or not (self.low[s] <= self.post[b] <= self.post[s]):
+                    continue
+                seen.add(s)
+                stack.append(s)
+        return False
+
+    def reaches(self, source, target):
+        """
+        :param source: 节点id（AstNode.id）
+        :param target: 节点id
+        :return: 是否存在从source到target的路径（source == target 时为True）
+        """
+        index = self.cfg.index
+        return self.comp_reaches(self.comp[index[source]], self.comp[index[target]])
+
+    def in_loop(self, node):
+        """
+        :return: 节点是否位于环上
+        """
+        return self.cyclic[self.cfg.index[node]] == 1
+
+    def loop_nodes(self, node):
+        """
+        :return: [节点id] 与node位于同一个强连通分量（最外层循环）中的节点，不在环上时为空
+        """
+        i = self.cfg.index[node]
+        if not self.cyclic[i]:
+            return []
+        c = self.comp[i]
+        return [self.cfg.ids[k] for k in range(len(self.cfg)) if self.comp[k] == c]
+
+    def nbytes(self):
+        """
+        :return: 索引占用的字节数（不含cfg本身）
+        """
+        total = self.comp.itemsize * len(self.comp) + len(self.cyclic)
+        total += sum(sys.getsizeof(succs) + 8 * len(succs) for succs in self.dag)
+        if self.rows is not None:
+            total += sum(sys.getsizeof(row) for row in self.rows)
+        else:
+            total += sum(each.itemsize * len(each) for each in (self.pre, self.post, self.low))
+        return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='build reachability indexes of the CFGs of a c file')
+    parser.add_argument('path', help='c file')
+    parser.add_argument('--max-closure', type=int, default=MAX_CLOSURE,
+                        help='components up to which the full transitive closure is stored')
+    parser.add_argument('--queries', type=int, default=0, help='time this many random queries per function')
+    parser.add_argument('--min-nodes', type=int, default=0, help='only list functions with at least this many nodes')
+    args = parser.parse_args(argv)
+
+    graph = graph_gen.analyze(args.path, args.path)
+    rng = random.Random(0)
+    total = 0
+    for cfg in graph.flatten():
+        start = time.perf_counter()
+        index = ReachIndex(cfg, args.max_closure)
+        elapsed = time.perf_counter() - start
+        total += index.nbytes()
+        if len(cfg) < args.min_nodes:
+            continue
+        line = '%-24s nodes %6d  components %6d  %-8s %9.1f KB  build %8.2f ms' % (
+            cfg.name, len(cfg), index.count, index.mode, index.nbytes() / 1024, elapsed * 1000)
+        if args.queries > 0 and len(cfg) > 0:
+            pairs = [(cfg.ids[rng.randrange(len(cfg))], cfg.ids[rng.randrange(len(cfg))])
+                     for _ in range(args.queries)]
+            start = time.perf_counter()
+            for source, target in pairs:
+                index.reaches(source, target)
+            line += '  %.2f us/query' % ((time.perf_counter() - start) / args.queries * 1e6)
+        print(line)
+    print('total %.1f KB' % (total / 1024))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import graph_gen
+import profiler
+from export import quote
+from flatcfg import FlatCFG, compact as compact_cfg
+
+
+def collapse_chains(cfg, min_chain=3):
+    """
+    找出可以合并显示的直线链：链中相邻节点之间只有一条无标签的边（前一个只有这一个后继，后一个只有这一个前驱），
+    开始、终止节点不参与合并
+
+    :param cfg: flatcfg.FlatCFG
+    :param min_chain: 少于该节点数的链不合并
+    :return: [[节点下标, ...]] 每条链按执行顺序排列
+    """
+    n = len(cfg)
+
+    def linked(i):
+        # i 的唯一后继与 i 可以合并，返回该后继，否则None
+        start, end = cfg.offsets[i], cfg.offsets[i + 1]
+        if end - start != 1 or cfg.labels[start] != 0 or cfg.flags[i] != 0:
+            return None
+        succ = cfg.targets[start]
+        if succ == i or cfg.flags[succ] != 0 or len(cfg.predecessors(succ)) != 1:
+            return None
+        return succ
+
+    nexts = [linked(i) for i in range(n)]
+    has_prev = bytearray(n)
+    for succ in nexts:
+        if succ is not None:
+            has_prev[succ] = 1
+    chains = []
+    visited = bytearray(n)
+    for i in range(n):
+        # 从没有链内前驱的节点开始，环形的链不合并
+        if has_prev[i] or nexts[i] is None:
+            continue
+        chain = [i]
+        visited[i] = 1
+        while nexts[chain[-1]] is not None and not visited[nexts[chain[-1]]]:
+            chain.append(nexts[chain[-1]])
+            visited[chain[-1]] = 1
+        if len(chain) >= min_chain:
+            chains.append(chain)
+    return chains
+
+
+def unit_dot(cfg, collapse=200, min_chain=3, base=None):
+    """
+    生成一个单元（方法、全局变量或typedef）的DOT文本
+
+    :param cfg: flatcfg.FlatCFG
+    :param collapse: 节点数超过该值时合并直线链，None为不合并
+    :param min_chain: 合并的最短链长度
+    :param base: 单元的起始id，给出时节点的id属性为 单元名称:局部id（见graph_gen.Graph.local_id）
+    :return: (DOT文本, 显示的节点数)
+    """
+    def stable(gid):
+        return '' if base is None else ' id=%s' % quote('%s:%d' % (cfg.name, gid - base))
+
+    n = len(cfg)
+    # 被合并的节点 -> 代表节点（链的第一个节点）
+    owner = list(range(n))
+    chains = {}
+    if collapse is not None and n > collapse:
+        for chain in collapse_chains(cfg, min_chain):
+            for i in chain:
+                owner[i] = chain[0]
+            chains[chain[0]] = chain
+    out = ['digraph %s {' % quote(cfg.name)]
+    shown = 0
+    for i in range(n):
+        if owner[i] != i:
+            continue
+        shown += 1
+        if i in chains:
+            chain = chains[i]
+            node = cfg.node(i)
+            last = cfg.node(chain[-1])
+            d = dict.fromkeys(name for k in chain for name in cfg.node(k).d)
+            u = dict.fromkeys(name for k in chain for name in cfg.node(k).u)
+            label = '%s\n...\n%s\n##############\n%d nodes: %d - %d\nd: %s\nu: %s' % (
+                cfg.code[i], cfg.code[chain[-1]], len(chain), node.id, last.id,
+                ', '.join(d) if len(d) > 0 else 'None', ', '.join(u) if len(u) > 0 else 'None')
+            out.append('\t%d [label=%s shape=box style=dashed%s]' % (node.id, quote(label), stable(node.id)))
+            continue
+        if cfg.is_start(i):
+            shape = ' shape=doublecircle'
+        elif cfg.is_end(i):
+            shape = ' shape=box'
+        else:
+            shape = ''
+        out.append('\t%d [label=%s%s%s]' % (cfg.ids[i], quote(cfg.node(i).show()), shape, stable(cfg.ids[i])))
+    for start, end, label in cfg.edges():
+        # 链内部的边省略（链中间的节点只有来自链内的一条入边）
+        if owner[end] != end:
+            continue
+        source = cfg.ids[owner[start]]
+        target = cfg.ids[owner[end]]
+        if label is None:
+            out.append('\t%d -> %d' % (source, target))
+        else:
+            out.append('\t%d -> %d [label=%s]' % (source, target, quote(label)))
+    out.append('}')
+    return '\n'.join(out) + '\n', shown
+
+
+def file_name(index, name):
+    """
+    单元的输出文件名，去掉文件名中不能使用的字符
+    """
+    name = re.sub(r'[^\w.-]+', '_', name)[:64].strip('_')
+    return '%03d_%s' % (index, name) if name != '' else '%03d' % index
+
+
+def layout(source_path, output_path, engine='dot', fmt='pdf', timeout=None):
+    """
+    调用graphviz布局程序
+
+    :return: (状态 'ok'/'timeout'/'error', 错误信息)
+    """
+    try:
+        proc = subprocess.run([engine, '-T' + fmt, '-o', output_path, source_path], stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, encoding='utf-8', timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return 'timeout', 'exceeded %ss' % timeout
+    except OSError as e:
+        return 'error', str(e)
+    if proc.returncode != 0:
+        return 'error', proc.stderr.strip()
+    return 'ok', ''
+
+
+def render_graph(graph, directory='tmp', fmt='pdf', workers=None, collapse=200, min_chain=3,
+                 fallback_limit=1000, fallback_engine='sfdp', skip_limit=5000, timeout=None, compact=False):
+    """
+    每个单元单独写一个DOT文件并在多个dot进程中并行布局，代替把整个文件画在一张图中
+
+    :param graph: graph_gen.Graph
+    :param directory: 输出目录，文件写入 directory/图名称.units/
+    :param fmt: 输出格式
+    :param workers: 同时运行的布局进程数，默认CPU核数
+    :param collapse: 节点数超过该值时合并直线链，None为不合并
+    :param min_chain: 合并的最短链长度
+    :param fallback_limit: （合并后）节点数超过该值时改用fallback_engine布局
+    :param fallback_engine: 大图使用的布局程序，如sfdp
+    :param skip_limit: 节点数超过该值时只写DOT文件不布局
+    :param timeout: 单个布局进程的超时时间（秒），超时只保留DOT文件
+    :param compact: 先去掉空节点并合并基本块（flatcfg.compact）再绘制
+    :return: [(单元名称, DOT文件, 输出文件或None, 布局程序或None, 状态 'ok'/'skipped'/'timeout'/'error', 信息)]
+    """
+    # Graph.render 的DOT文件为 directory/图名称，不能再用作目录名
+    out_dir = os.path.join(directory, graph.name + '.units')
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = []
+    results = []
+    with profiler.span('render_dot', graph=graph.name) as args:
+        for index, root in enumerate(graph.g):
+            name = graph.units[index][1] if graph.units is not None else str(index)
+            cfg = FlatCFG.from_node(root, name)
+            if compact:
+                cfg = compact_cfg(cfg)
+            source, shown = unit_dot(cfg, collapse, min_chain,
+                                     graph.units[index][3] if graph.units is not None else None)
+            base = os.path.join(out_dir, file_name(index, name))
+            source_path = base + '.gv'
+            with open(source_path, 'w', encoding='utf-8') as f:
+                f.write(source)
+            if skip_limit is not None and shown > skip_limit:
+                results.append((name, source_path, None, None, 'skipped', '%d nodes' % shown))
+                continue
+            engine = fallback_engine if fallback_limit is not None and shown > fallback_limit else 'dot'
+            jobs.append((name, source_path, base + '.' + fmt, engine))
+        args['units'] = len(graph.g)
+    with profiler.span('render_layout', graph=graph.name, jobs=len(jobs)):
+        # 布局在子进程中进行，线程只负责等待
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            statuses = executor.map(lambda job: layout(job[1], job[2], job[3], fmt, timeout), jobs)
+            for (name, source_path, output_path, engine), (status, message) in zip(jobs, statuses):
+                results.append((name, source_path, output_path if status == 'ok' else None, engine, status, message))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='render one graph per function of a c file')
+    parser.add_argument('path', help='c file')
+    parser.add_argument('-d', '--directory', default='tmp', help='output directory')
+    parser.add_argument('-T', '--format', default='pdf', help='output format of dot')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='parallel layout processes')
+    parser.add_argument('--collapse', type=int, default=200, help='collapse chains above this many nodes, -1 never')
+    parser.add_argument('--min-chain', type=int, default=3, help='shortest chain that is collapsed')
+    parser.add_argument('--fallback-limit', type=int, default=1000, help='use the fallback engine above this size')
+    parser.add_argument('--fallback-engine', default='sfdp', help='layout engine for large graphs')
+    parser.add_argument('--skip-limit', type=int, default=5000, help='only write the .gv file above this size')
+    parser.add_argument('-t', '--timeout', type=float, default=None, help='timeout of each layout process')
+    parser.add_argument('--compact', action='store_true', help='merge basic blocks and drop empty nodes first')
+    args = parser.parse_args(argv)
+
+    name = os.path.splitext(os.path.basename(args.path))[0]
+    graph = graph_gen.analyze(args.path, name)
+    results = render_graph(graph, args.directory, args.format, args.workers,
+                           args.collapse if args.collapse >= 0 else None, args.min_chain,
+                           args.fallback_limit, args.fallback_engine, args.skip_limit, args.timeout, args.compact)
+    failed = 0
+    for name, source_path, output_path, engine, status, message in results:
+        if status != 'ok':
+            failed += status != 'skipped'
+            print('[%s] %s %s' % (status, source_path, message))
+    print('units: %d, rendered: %d' % (len(results), sum(1 for r in results if r[4] == 'ok')))
+    return 1 if failed > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
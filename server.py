@@ -0,0 +1,314 @@
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import graph_gen
+from cache import SourceCache, UnitCache
+
+# JSON-RPC 2.0 错误码
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+ANALYSIS_ERROR = -32000
+# stats 的延迟分位数按最近的这些请求计算，常驻进程中内存不随请求数增长
+LATENCY_WINDOW = 10000
+
+_cache = None
+_unit_cache = None
+
+
+class RequestTimeout(Exception):
+    pass
+
+
+class _RpcError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def _on_timeout(signum, frame):
+    raise RequestTimeout()
+
+
+def _init_worker(cache_dir=None, cache_size=None):
+    """
+    进程池初始化：建立CParser（生成lex/yacc表），打开源码缓存和方法缓存，之后的请求不再付出这些开销
+    子进程的标准输出指向stderr，分析中的任何输出都不会混进标准输入输出模式的JSON-RPC响应
+    """
+    global _cache, _unit_cache
+    sys.stdout.flush()
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+    graph_gen.get_parser()
+    if cache_dir:
+        _cache = SourceCache(cache_dir, cache_size * 1024 * 1024) if cache_size else SourceCache(cache_dir)
+        _unit_cache = UnitCache(cache_dir, _cache.max_bytes)
+    if hasattr(signal, 'SIGALRM'):
+        signal.signal(signal.SIGALRM, _on_timeout)
+
+
+def _warm():
+    return os.getpid()
+
+
+def _analyze(params, timeout):
+    """
+    在子进程中处理一个analyze请求
+
+    :param params: {'path' 或 'source', 'name', 'pairs', 'prelude'}
+    :param timeout: 超时时间（秒），None为不限制
+    :return: (结果dict, 分析耗时毫秒)
+    """
+    start = time.perf_counter()
+    use_alarm = timeout and hasattr(signal, 'setitimer')
+    if use_alarm:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        if 'source' in params:
+            path = params.get('path', '<request>')
+            graph = graph_gen.analyze_source(params['source'], path, params.get('name', 'request'),
+                                             _cache, unit_cache=_unit_cache, prelude=bool(params.get('prelude')))
+        else:
+            path = params['path']
+            name = params.get('name', os.path.splitext(os.path.basename(path))[0])
+            graph = graph_gen.analyze(path, name, _cache, unit_cache=_unit_cache,
+                                      prelude=bool(params.get('prelude')))
+        result = graph.to_dict()
+        if params.get('pairs'):
+            for entry, flow in zip(result['graphs'], graph.dataflow()):
+                entry['pairs'] = [list(pair) for pair in flow.pairs()]
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return result, (time.perf_counter() - start) * 1000
+
+
+class Server:
+    def __init__(self, workers=2, cache_dir=None, cache_size=None, timeout=None, log=sys.stderr):
+        """
+        常驻的分析服务，子进程中保持CParser和缓存，按行接收JSON-RPC 2.0请求
+
+        方法:
+            analyze  {'path': 文件路径} 或 {'source': 代码, 'path': 显示用文件名}，可选 'name'、'pairs'(是否附带du对)、
+                     'prelude'(使用fake libc头文件快照)
+                     返回 Graph.to_dict()，每个图附带 'unit'、'kind'
+            stats    请求数、错误数和延迟分位数
+            ping     返回 'pong'
+            shutdown 停止服务（标准输入模式下读到下一行或EOF时退出）
+
+        每个响应附带 'latency_ms'（收到请求到发出响应）和 'analysis_ms'（子进程中的分析时间）
+
+        :param workers: 子进程数
+        :param cache_dir: 预处理、ast和方法建图结果的缓存目录，None表示不使用缓存
+        :param cache_size: 缓存大小上限（MB）
+        :param timeout: 单个请求的超时时间（秒）
+        :param log: 每个请求输出一行日志的流，None为不输出
+        """
+        self.workers = workers
+        self.timeout = timeout
+        self.log = log
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(cache_dir, cache_size))
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.stopped = threading.Event()
+
+    def warm_up(self):
+        """
+        提前启动子进程并完成初始化，使第一个请求不需要等待
+
+        :return: 启动的子进程数
+        """
+        futures = [self.executor.submit(_warm) for _ in range(self.workers)]
+        return len(set(future.result() for future in futures))
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+    def handle(self, line):
+        """
+        处理一行请求
+
+        :param line: str JSON文本
+        :return: 响应dict，通知（没有id）时为None
+        """
+        start = time.perf_counter()
+        request_id = None
+        analysis_ms = None
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            response = self.error(None, PARSE_ERROR, 'parse error: %s' % e)
+        else:
+            if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+                response = self.error(None, INVALID_REQUEST, 'invalid request')
+            else:
+                request_id = request.get('id')
+                try:
+                    result, analysis_ms = self.call(request['method'], request.get('params') or {})
+                    response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+                except _RpcError as e:
+                    response = self.error(request_id, e.code, e.message)
+                except RequestTimeout:
+                    response = self.error(request_id, ANALYSIS_ERROR, 'exceeded %ss' % self.timeout)
+                except Exception as e:
+                    response = self.error(request_id, ANALYSIS_ERROR, '%s: %s' % (e.__class__.__name__, e))
+                if 'id' not in request:
+                    response = None
+        latency = (time.perf_counter() - start) * 1000
+        with self.lock:
+            self.latencies.append(latency)
+            self.requests += 1
+            if response is not None and 'error' in response:
+                self.errors += 1
+        if response is not None:
+            response['latency_ms'] = round(latency, 3)
+            if analysis_ms is not None:
+                response['analysis_ms'] = round(analysis_ms, 3)
+        if self.log is not None:
+            status = 'error' if response is not None and 'error' in response else 'ok'
+            print('[%s] id=%s %.1f ms' % (status, request_id, latency), file=self.log, flush=True)
+        return response
+
+    def call(self, method, params):
+        """
+        :return: (结果, 分析耗时毫秒或None)
+        """
+        if not isinstance(params, dict):
+            raise _RpcError(INVALID_PARAMS, 'params must be an object')
+        if method == 'analyze':
+            if 'path' not in params and 'source' not in params:
+                raise _RpcError(INVALID_PARAMS, 'path or source is required')
+            return self.executor.submit(_analyze, params, self.timeout).result()
+        if method == 'stats':
+            return self.stats(), None
+        if method == 'ping':
+            return 'pong', None
+        if method == 'shutdown':
+            self.stopped.set()
+            return 'bye', None
+        raise _RpcError(METHOD_NOT_FOUND, 'method not found: %s' % method)
+
+    @staticmethod
+    def error(request_id, code, message):
+        return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+    def stats(self):
+        """
+        :return: {'requests', 'errors', 'workers', 'latency_ms': {'p50', 'p90', 'p99', 'max'}}
+                 延迟为最近LATENCY_WINDOW个请求的分位数
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+            requests = self.requests
+            errors = self.errors
+
+        def percentile(p):
+            if len(latencies) == 0:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3)
+
+        return {'requests': requests, 'errors': errors, 'workers': self.workers,
+                'latency_ms': {'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99),
+                               'max': round(latencies[-1], 3) if len(latencies) > 0 else None}}
+
+    def serve_stdio(self, stdin=sys.stdin, stdout=sys.stdout):
+        """
+        从标准输入逐行读取请求，响应写到标准输出；多个请求同时交给进程池，响应按完成顺序写出
+        """
+        write_lock = threading.Lock()
+        threads = []
+
+        def run(line):
+            response = self.handle(line)
+            if response is not None:
+                with write_lock:
+                    stdout.write(json.dumps(response, ensure_ascii=False) + '\n')
+                    stdout.flush()
+
+        for line in stdin:
+            if line.strip() == '':
+                continue
+            thread = threading.Thread(target=run, args=(line,))
+            thread.start()
+            threads.append(thread)
+            threads = [t for t in threads if t.is_alive()]
+            if self.stopped.is_set():
+                break
+        for thread in threads:
+            thread.join()
+
+    def serve_unix(self, socket_path):
+        """
+        在Unix socket上接收连接，每个连接一个线程，连接内按行收发
+        """
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    line = line.decode('utf-8')
+                    if line.strip() == '':
+                        continue
+                    response = server.handle(line)
+                    if response is not None:
+                        self.wfile.write((json.dumps(response, ensure_ascii=False) + '\n').encode('utf-8'))
+                        self.wfile.flush()
+                    if server.stopped.is_set():
+                        break
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as unix_server:
+            unix_server.daemon_threads = True
+            thread = threading.Thread(target=unix_server.serve_forever)
+            thread.start()
+            try:
+                self.stopped.wait()
+            finally:
+                unix_server.shutdown()
+                thread.join()
+                os.unlink(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='serve CFG and du-path analysis over JSON-RPC')
+    parser.add_argument('--socket', default=None, help='listen on this unix socket instead of stdin/stdout')
+    parser.add_argument('-j', '--workers', type=int, default=2, help='number of worker processes')
+    parser.add_argument('-t', '--timeout', type=float, default=None, help='per-request timeout in seconds')
+    parser.add_argument('--cache-dir', default=None, help='cache directory of preprocessed source and ast')
+    parser.add_argument('--cache-size', type=int, default=None, help='cache size limit in MB')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not log each request to stderr')
+    args = parser.parse_args(argv)
+
+    server = Server(args.workers, args.cache_dir, args.cache_size, args.timeout, None if args.quiet else sys.stderr)
+    start = time.perf_counter()
+    server.warm_up()
+    print('ready: %d workers, %.0f ms' % (args.workers, (time.perf_counter() - start) * 1000),
+          file=sys.stderr, flush=True)
+    try:
+        if args.socket:
+            server.serve_unix(args.socket)
+        else:
+            server.serve_stdio()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
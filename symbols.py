@@ -0,0 +1,218 @@
+import hashlib
+from array import array
+
+# 遍历单元时产生的事件
+PUSH = 0
+POP = 1
+DECL = 2
+DECL_PARAM = 3
+DECL_FILE = 4
+USE = 5
+
+_POP = object()
+# 只有类型、其中的声明不是变量的节点（结构体成员等），遍历时跳过
+_SKIP = frozenset(('Struct', 'Union', 'IdentifierType', 'Constant'))
+
+
+def _events(nodeList):
+    """
+    按先序遍历一个单元，产生作用域和名字事件，resolve和bind使用同一顺序
+    FuncDef: 方法名在文件作用域声明，形参和方法体最外层的声明在同一个作用域
+    Compound、For（init中的声明）、ParamList（函数原型的形参）各自开启一个作用域
+
+    :param nodeList: [pycparser Node]
+    :return: 生成器 (事件, 节点或None)
+    """
+    stack = list(reversed(nodeList))
+    # 与方法共用作用域的方法体和形参列表
+    shared = set()
+    params = set()
+    while len(stack) > 0:
+        node = stack.pop()
+        if node is _POP:
+            yield POP, None
+            continue
+        kind = node.__class__.__name__
+        if kind == 'ID':
+            yield USE, node
+            continue
+        if kind in _SKIP:
+            continue
+        if kind == 'FuncDef':
+            yield DECL_FILE, node.decl
+            yield PUSH, None
+            stack.append(_POP)
+            args = getattr(node.decl.type, 'args', None)
+            if args is not None:
+                shared.add(id(args))
+            shared.add(id(node.body))
+            children = [c for _, c in node.decl.children()]
+            if node.param_decls is not None:
+                children += node.param_decls
+            children.append(node.body)
+            stack.extend(reversed(children))
+            continue
+        if kind == 'StructRef':
+            # 成员名不是变量
+            stack.append(node.name)
+            continue
+        elif kind in ('Decl', 'Typedef', 'Enumerator'):
+            if node.name is not None:
+                yield (DECL_PARAM if id(node) in params else DECL), node
+        if kind == 'ParamList':
+            params.update(id(each) for each in node.params)
+        if kind in ('Compound', 'For', 'ParamList') and id(node) not in shared:
+            yield PUSH, None
+            stack.append(_POP)
+        children = node.children()
+        if len(children) > 0:
+            stack.extend([c for _, c in reversed(children)])
+
+
+def bind(nodeList, ids):
+    """
+    把resolve的结果对应回节点，用于另一个进程中反序列化后的同一单元
+
+    :param nodeList: [pycparser Node]
+    :param ids: resolve返回的符号id，与遍历顺序一一对应
+    :return: {id(pycparser节点): 符号id}
+    """
+    symbol_of = {}
+    i = 0
+    for event, node in _events(nodeList):
+        if event >= DECL:
+            symbol_of[id(node)] = ids[i]
+            i += 1
+    return symbol_of
+
+
+def digest(tokens):
+    """
+    :param tokens: relative的结果按单元中的顺序排列
+    :return: str 单元符号的摘要，作为方法缓存key的一部分
+    """
+    return hashlib.sha1(repr(tokens).encode('utf-8')).hexdigest()[:16]
+
+
+class SymbolTable:
+    __slots__ = ('names', 'kinds', 'lines', 'depths', 'scopes', 'visible', 'counts')
+
+    def __init__(self):
+        """
+        一个文件的符号表，每个声明（全局变量、方法、形参、局部变量、for的init、typedef、枚举常量）
+        按出现顺序得到一个从0开始的连续id，同名变量在不同作用域中是不同的符号
+        没有声明就使用的名字（库函数、其他文件的全局变量）在第一次使用时作为文件作用域的'extern'符号
+
+        names/kinds/lines/depths: 以符号id为下标的名称、类型、声明行号和声明所在作用域的深度（0为文件作用域）
+        """
+        self.names = []
+        self.kinds = []
+        self.lines = []
+        self.depths = array('l')
+        # 每层作用域中声明的 {名称: 符号id}，单元之间只剩文件作用域
+        self.scopes = [{}]
+        # 名称 -> [符号id]，内层作用域的声明在后，查找不需要逐层遍历
+        self.visible = {}
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def declare(self, name, kind, line, depth=-1):
+        # 同一作用域中重复声明（原型和定义、extern）为同一个符号
+        scope = self.scopes[depth]
+        sid = scope.get(name)
+        if sid is None:
+            sid = len(self.names)
+            self.names.append(name)
+            self.kinds.append(kind)
+            self.lines.append(line)
+            self.depths.append(depth if depth >= 0 else len(self.scopes) + depth)
+            self.counts[name] = self.counts.get(name, 0) + 1
+            scope[name] = sid
+            shadow = self.visible.setdefault(name, [])
+            if depth == 0:
+                shadow.insert(0, sid)
+            else:
+                shadow.append(sid)
+        return sid
+
+    def lookup(self, name):
+        shadow = self.visible.get(name)
+        if shadow:
+            return shadow[-1]
+        return self.declare(name, 'extern', None, 0)
+
+    def pop(self):
+        for name in self.scopes.pop():
+            self.visible[name].pop()
+
+    def resolve(self, nodeList, symbol_of=None):
+        """
+        按词法作用域解析一个单元中的声明和名字使用，单元需按文件中的顺序依次解析
+
+        :param nodeList: [pycparser Node] build_unit的一个单元
+        :param symbol_of: 不为None时同时填入 {id(pycparser节点): 符号id}，与bind的结果相同
+        :return: [int] 按遍历顺序的符号id，见bind
+        """
+        ids = []
+        scopes = self.scopes
+        for event, node in _events(nodeList):
+            if event == PUSH:
+                scopes.append({})
+            elif event == POP:
+                self.pop()
+            elif event == USE:
+                ids.append(self.lookup(node.name))
+                if symbol_of is not None:
+                    symbol_of[id(node)] = ids[-1]
+            else:
+                kind = node.__class__.__name__
+                if event == DECL_FILE or kind == 'Decl' and node.type.__class__.__name__ == 'FuncDecl':
+                    kind = 'function'
+                elif kind == 'Typedef':
+                    kind = 'typedef'
+                elif kind == 'Enumerator':
+                    kind = 'constant'
+                elif event == DECL_PARAM:
+                    kind = 'param'
+                else:
+                    kind = 'global' if len(scopes) == 1 else 'local'
+                coord = node.coord
+                ids.append(self.declare(node.name, kind, coord.line if coord is not None else None,
+                                        0 if event == DECL_FILE else -1))
+                if symbol_of is not None:
+                    symbol_of[id(node)] = ids[-1]
+        return ids
+
+    def relative(self, ids):
+        """
+        把一个单元的符号id转为与其他单元无关的形式：文件作用域的符号为 (名称,)，
+        单元内的局部符号为它在单元的局部符号中的序号；前面增加全局变量或方法使id整体改变时结果不变
+
+        :param ids: resolve返回的符号id
+        :return: {符号id: 相对形式}
+        """
+        result = {}
+        count = 0
+        for sid in sorted(set(ids)):
+            if self.depths[sid] == 0:
+                result[sid] = (self.names[sid],)
+            else:
+                result[sid] = count
+                count += 1
+        return result
+
+    def display(self, sid):
+        """
+        :return: 输出用的名称，同名的符号不止一个时附带id（name#id）
+        """
+        name = self.names[sid]
+        return name if self.counts[name] == 1 else '%s#%d' % (name, sid)
+
+    def to_list(self):
+        """
+        :return: [{'id', 'name', 'kind', 'line'}]
+        """
+        return [{'id': sid, 'name': name, 'kind': kind, 'line': line}
+                for sid, (name, kind, line) in enumerate(zip(self.names, self.kinds, self.lines))]
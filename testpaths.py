@@ -0,0 +1,370 @@
+import argparse
+import heapq
+import sys
+import time
+from collections import deque
+
+import graph_gen
+from dataflow import DataFlow
+from dupaths import DuPathEnumerator
+
+CRITERIA = ('all-defs', 'all-uses', 'all-du-paths')
+
+
+class TestSuite:
+    __slots__ = ('name', 'criterion', 'paths', 'coverage', 'uncovered')
+
+    def __init__(self, name, criterion, paths, coverage, uncovered):
+        """
+        一个方法的测试路径集合
+
+        :param name: 名称
+        :param criterion: 覆盖准则，见CRITERIA
+        :param paths: [(节点id, ...)] 从Start到End的完整路径
+        :param coverage: {准则: (覆盖数, 可覆盖数, 总数)}，定义在Start不可达或使用到不了End的代码中（如break之后）
+                         的需求没有完整路径可以覆盖，不计入可覆盖数
+        :param uncovered: [需求] 按所选准则可以覆盖但没有被覆盖的需求：
+                          all-defs (变量, 定义节点id)，all-uses (变量, 定义节点id, 使用节点id)，
+                          all-du-paths (变量, (路径节点id, ...))
+        """
+        self.name = name
+        self.criterion = criterion
+        self.paths = paths
+        self.coverage = coverage
+        self.uncovered = uncovered
+
+    def ratio(self, criterion=None):
+        """
+        :return: 可覆盖需求的覆盖率，没有需求时为1.0
+        """
+        covered, feasible, _ = self.coverage[criterion or self.criterion]
+        return covered / feasible if feasible > 0 else 1.0
+
+
+def index_du_paths(requirements):
+    """
+    扫描路径时先按 (变量, 起点, 终点, 长度) 查找，只有可能相同时才截取子路径比较
+
+    :param requirements: 可迭代的 (变量下标, (节点下标, ...))
+    :return: {(变量下标, 起点, 终点, 节点数): {(节点下标, ...)}}
+    """
+    index = {}
+    for v, path in requirements:
+        index.setdefault((v, path[0], path[-1], len(path)), set()).add(path)
+    return index
+
+
+class TestPathGenerator:
+    def __init__(self, flow, loop_bound=1, max_length=None, max_per_pair=None, max_paths=None):
+        """
+        由du对生成满足 all-defs / all-uses / all-du-paths 的较小的完整测试路径集合
+
+        每个需求先得到一条def-clear的子路径（all-defs/all-uses 为定义到使用的最短路径，
+        all-du-paths 为DuPathEnumerator按循环展开次数枚举的每条路径），
+        补上Start到定义的最短路径和使用到End的最短路径成为候选测试路径；
+        沿候选路径扫描一遍即可得到它覆盖的全部需求（每个变量记录最近的定义位置），
+        再用惰性贪心集合覆盖每次选择新覆盖需求最多的候选路径
+
+        :param flow: dataflow.DataFlow 或 flatcfg.FlatCFG（不压缩的CFG）
+        :param loop_bound: all-du-paths 中每个节点在一条du路径中最多重复经过的次数
+        :param max_length: all-du-paths 中du路径最多包含的节点数
+        :param max_per_pair: all-du-paths 中每个du对最多枚举的路径数
+        :param max_paths: all-du-paths 中最多枚举的du路径总数，嵌套很深的循环中du路径数按指数增长，需要限制
+        """
+        if not isinstance(flow, DataFlow):
+            flow = DataFlow(flow)
+        self.flow = flow
+        self.cfg = flow.cfg
+        self.loop_bound = loop_bound
+        self.max_length = max_length
+        self.max_per_pair = max_per_pair
+        self.max_paths = max_paths
+        cfg = self.cfg
+        n = len(cfg)
+        self.entry = 0
+        self.exits = [i for i in range(n) if cfg.is_end(i)] or [i for i in range(n) if len(cfg.successors(i)) == 0]
+        # Start到各节点、各节点到End的最短路径树
+        self.prefix_parent = self._bfs([self.entry], cfg.successors)
+        self.suffix_next = self._bfs(self.exits, cfg.predecessors)
+        # 扫描路径时反复读取，预先从CSR中取出
+        self.node_d = [tuple(cfg.d(i)) for i in range(n)]
+        self.node_u = [tuple(cfg.u(i)) for i in range(n)]
+        self.pairs = [(cfg.var_index[name], cfg.index[def_id], cfg.index[use_id])
+                      for name, def_id, use_id in flow.pairs()]
+        # 节点下标 -> 节点内部du对的变量下标，经过该节点的路径就覆盖这些du对
+        self.node_local = {}
+        for name, def_id, _ in cfg.local_pairs:
+            self.node_local.setdefault(cfg.index[def_id], []).append(cfg.var_index[name])
+
+    def _bfs(self, sources, neighbours):
+        parent = {each: None for each in sources}
+        queue = deque(sources)
+        while len(queue) > 0:
+            node = queue.popleft()
+            for each in neighbours(node):
+                if each not in parent:
+                    parent[each] = node
+                    queue.append(each)
+        return parent
+
+    def prefix(self, node):
+        """
+        :return: [节点下标] Start到node的最短路径（含两端），不可达时为None
+        """
+        if node not in self.prefix_parent:
+            return None
+        path = []
+        while node is not None:
+            path.append(node)
+            node = self.prefix_parent[node]
+        path.reverse()
+        return path
+
+    def suffix(self, node):
+        """
+        :return: [节点下标] node到End的最短路径（含两端），不可达时为None
+        """
+        if node not in self.suffix_next:
+            return None
+        path = []
+        while node is not None:
+            path.append(node)
+            node = self.suffix_next[node]
+        return path
+
+    def def_clear_paths(self, v, start, uses):
+        """
+        从定义节点出发的一次BFS，得到到达每个使用节点的最短def-clear路径
+        定义v的其他节点可以作为终点但不再向后扩展
+
+        :param v: 变量下标
+        :param start: 定义节点下标
+        :param uses: 使用节点下标的集合
+        :return: {使用节点下标: [节点下标]} 路径含两端
+        """
+        cfg = self.cfg
+        parent = {}
+        queue = deque()
+        for each in cfg.successors(start):
+            if each not in parent:
+                parent[each] = start
+                queue.append(each)
+        found = {}
+        while len(queue) > 0 and len(found) < len(uses):
+            node = queue.popleft()
+            if node in uses and node not in found:
+                path = [node]
+                back = parent[node]
+                # start为终点时（循环中的 i++），路径回到start
+                while back != start:
+                    path.append(back)
+                    back = parent[back]
+                path.append(start)
+                path.reverse()
+                found[node] = path
+            if node == start or v in cfg.d(node):
+                continue
+            for each in cfg.successors(node):
+                if each not in parent:
+                    parent[each] = node
+                    queue.append(each)
+        return found
+
+    def subpaths(self, criterion):
+        """
+        :return: [(需求, [节点下标])] 每个需求的一条def-clear子路径，不可达的需求不在其中
+                 all-defs 和 all-uses 的需求为 (变量下标, 定义下标[, 使用下标])，all-du-paths 为 (变量下标, (节点下标, ...))
+        """
+        if criterion == 'all-du-paths':
+            cfg = self.cfg
+            enumerator = DuPathEnumerator(self.flow, self.loop_bound, self.max_length, self.max_paths, self.max_per_pair)
+            result = []
+            for name, _, _, path in enumerator.paths():
+                path = tuple(cfg.index[each] for each in path)
+                result.append(((cfg.var_index[name], path), list(path)))
+            return result
+        groups = {}
+        for v, start, use in self.pairs:
+            groups.setdefault((v, start), set()).add(use)
+        result = []
+        for (v, start), uses in groups.items():
+            found = self.def_clear_paths(v, start, uses)
+            if v in self.node_local.get(start, ()):
+                found[start] = [start]
+            if criterion == 'all-defs':
+                if len(found) > 0:
+                    path = min(found.values(), key=len)
+                    result.append(((v, start), path))
+            else:
+                for use in sorted(found):
+                    result.append(((v, start, use), found[use]))
+        return result
+
+    def candidate(self, subpath):
+        """
+        :return: (节点下标, ...) 经过subpath的完整路径，Start或End不可达时为None
+        """
+        head = self.prefix(subpath[0])
+        tail = self.suffix(subpath[-1])
+        if head is None or tail is None:
+            return None
+        return tuple(head[:-1] + list(subpath) + tail[1:])
+
+    def covered(self, path, du_paths=None):
+        """
+        扫描一条完整路径，每个变量记录最近的定义位置：向上暴露的使用与之前最近的定义组成du对，
+        节点内部的du对在经过节点时覆盖
+
+        :param path: (节点下标, ...)
+        :param du_paths: index_du_paths的结果，不为None时同时返回覆盖的all-du-paths需求
+        :return: (覆盖的du对 {(变量, 定义, 使用)}, 覆盖的du路径)
+        """
+        node_d = self.node_d
+        node_u = self.node_u
+        last = {}
+        pairs = set()
+        covered_paths = set()
+        for position, node in enumerate(path):
+            for v in node_u[node]:
+                p = last.get(v)
+                if p is None:
+                    continue
+                pairs.add((v, path[p], node))
+                if du_paths is not None:
+                    same_ends = du_paths.get((v, path[p], node, position + 1 - p))
+                    if same_ends is not None and path[p:position + 1] in same_ends:
+                        covered_paths.add((v, path[p:position + 1]))
+            for v in self.node_local.get(node, ()):
+                pairs.add((v, node, node))
+                if du_paths is not None and (node,) in du_paths.get((v, node, node, 1), ()):
+                    covered_paths.add((v, (node,)))
+            for v in node_d[node]:
+                last[v] = position
+        return pairs, covered_paths
+
+    def select(self, criterion='all-uses', name=''):
+        """
+        :param criterion: 'all-defs' / 'all-uses' / 'all-du-paths'
+        :param name: 结果的名称
+        :return: TestSuite
+        """
+        if criterion not in CRITERIA:
+            raise ValueError('unknown criterion: %s' % criterion)
+        subpaths = self.subpaths(criterion)
+        du_paths = index_du_paths(req for req, _ in subpaths) if criterion == 'all-du-paths' else None
+        # 较长的子路径先生成候选路径，已被之前的候选路径覆盖的需求不再单独生成，同一条完整路径只保留一次
+        subpaths.sort(key=lambda each: -len(each[1]))
+        candidates = {}
+        reachable = set()
+        for req, subpath in subpaths:
+            if req in reachable:
+                continue
+            path = self.candidate(subpath)
+            if path is not None and path not in candidates:
+                candidates[path] = self.requirements_of(criterion, *self.covered(path, du_paths))
+                reachable |= candidates[path]
+        paths = list(candidates)
+        covers = [candidates[path] for path in paths]
+        # 惰性贪心：新增覆盖数只会减少，堆顶重新计算后仍最大即选中
+        heap = [(-len(each), i) for i, each in enumerate(covers)]
+        heapq.heapify(heap)
+        done = set()
+        chosen = []
+        while len(heap) > 0:
+            gain, i = heapq.heappop(heap)
+            fresh = len(covers[i] - done)
+            if fresh == 0:
+                continue
+            if fresh < -gain:
+                heapq.heappush(heap, (-fresh, i))
+                continue
+            chosen.append(paths[i])
+            done |= covers[i]
+        return self.report(criterion, chosen, name, du_paths)
+
+    def requirements_of(self, criterion, pairs, covered_paths):
+        if criterion == 'all-defs':
+            return set((v, start) for v, start, _ in pairs)
+        if criterion == 'all-uses':
+            return pairs
+        return covered_paths
+
+    def report(self, criterion, chosen, name='', du_paths=None):
+        """
+        计算一组完整路径对各准则的覆盖率
+
+        :param chosen: [(节点下标, ...)] 完整路径
+        :param du_paths: all-du-paths 的全部需求，见index_du_paths
+        :return: TestSuite 其中的节点为AstNode id
+        """
+        cfg = self.cfg
+        heads = self.prefix_parent
+        tails = self.suffix_next
+        all_pairs = set(self.pairs)
+        all_defs = set((v, start) for v, start, _ in self.pairs)
+        feasible_pairs = set(each for each in all_pairs if each[1] in heads and each[2] in tails)
+        feasible_defs = set((v, start) for v, start, _ in feasible_pairs)
+        if criterion == 'all-du-paths' and du_paths is None:
+            du_paths = index_du_paths(req for req, _ in self.subpaths(criterion))
+        pairs = set()
+        covered_paths = set()
+        for path in chosen:
+            each_pairs, each_paths = self.covered(path, du_paths)
+            pairs |= each_pairs
+            covered_paths |= each_paths
+        pairs &= all_pairs
+        defs = set((v, start) for v, start, _ in pairs)
+        coverage = {'all-defs': (len(defs), len(feasible_defs), len(all_defs)),
+                    'all-uses': (len(pairs), len(feasible_pairs), len(all_pairs))}
+        if criterion == 'all-defs':
+            uncovered = [(cfg.vars[v], cfg.ids[start]) for v, start in sorted(feasible_defs - defs)]
+        elif criterion == 'all-uses':
+            uncovered = [(cfg.vars[v], cfg.ids[start], cfg.ids[use])
+                         for v, start, use in sorted(feasible_pairs - pairs)]
+        else:
+            all_paths = set((key[0], path) for key, same_ends in du_paths.items() for path in same_ends)
+            feasible_paths = set(each for each in all_paths if each[1][0] in heads and each[1][-1] in tails)
+            coverage['all-du-paths'] = (len(covered_paths), len(feasible_paths), len(all_paths))
+            uncovered = [(cfg.vars[v], tuple(cfg.ids[i] for i in path))
+                         for v, path in sorted(feasible_paths - covered_paths)]
+        paths = [tuple(cfg.ids[i] for i in path) for path in chosen]
+        return TestSuite(name or cfg.name, criterion, paths, coverage, uncovered)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='generate a small set of test paths covering the du pairs of a c file')
+    parser.add_argument('path', help='c file')
+    parser.add_argument('-c', '--criterion', choices=CRITERIA, default='all-uses', help='coverage criterion')
+    parser.add_argument('--func', default=None, help='only this function')
+    parser.add_argument('--loop-bound', type=int, default=1, help='times a node may repeat in one du path (all-du-paths)')
+    parser.add_argument('--max-length', type=int, default=None, help='longest du path in nodes (all-du-paths)')
+    parser.add_argument('--max-per-pair', type=int, default=None, help='du paths enumerated per du pair (all-du-paths)')
+    parser.add_argument('--max-paths', type=int, default=None, help='du paths enumerated per function (all-du-paths)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='only print coverage, not the paths')
+    args = parser.parse_args(argv)
+
+    graph = graph_gen.analyze(args.path, args.path)
+    for index, cfg in enumerate(graph.flatten()):
+        kind, name = graph.units[index][:2]
+        if kind != 'func' or args.func is not None and name != args.func:
+            continue
+        start = time.perf_counter()
+        generator = TestPathGenerator(cfg, args.loop_bound, args.max_length, args.max_per_pair, args.max_paths)
+        suite = generator.select(args.criterion, name)
+        elapsed = time.perf_counter() - start
+        line = '%-24s paths %4d' % (name, len(suite.paths))
+        for criterion, (covered, feasible, total) in suite.coverage.items():
+            line += '  %s %d/%d (%.1f%%)' % (criterion, covered, feasible, 100 * suite.ratio(criterion))
+            if feasible < total:
+                line += ' infeasible %d' % (total - feasible)
+        print(line + '  %.1f ms' % (elapsed * 1000))
+        if not args.quiet:
+            for path in suite.paths:
+                print('    ' + ' -> '.join(str(each) for each in path))
+            for each in suite.uncovered:
+                print('    uncovered: %s' % (each,))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())